@@ -1,8 +1,8 @@
-# hello/urls.py
-from django.urls import path
-
-from .views import homePageView
-
-urlpatterns = [
-    path('', homePageView, name='home')
-]
+# hello/urls.py
+from django.urls import path
+
+from .views import homePageView
+
+urlpatterns = [
+    path('', homePageView, name='home')
+]
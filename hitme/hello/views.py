@@ -1,7 +1,7 @@
-from django.shortcuts import render
-from django.http import HttpResponse
-
-# Create your views here.
-
-def homePageView(request):
-    return HttpResponse('Hello, World!')
+from django.shortcuts import render
+from django.http import HttpResponse
+
+# Create your views here.
+
+def homePageView(request):
+    return HttpResponse('Hello, World!')
@@ -1,13 +1,13 @@
-# hitme/routing.py
-from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
-import hitme_game.routing
-
-application = ProtocolTypeRouter({
-    # (http->django views is added by default)
-    'websocket': AuthMiddlewareStack(
-        URLRouter(
-            hitme_game.routing.websocket_urlpatterns
-        )
-    ),
-})
+# hitme/routing.py
+from channels.routing import ProtocolTypeRouter, URLRouter
+from hitme_game.handshake import CachedAuthMiddlewareStack
+import hitme_game.routing
+
+application = ProtocolTypeRouter({
+    # (http->django views is added by default)
+    'websocket': CachedAuthMiddlewareStack(
+        URLRouter(
+            hitme_game.routing.websocket_urlpatterns
+        )
+    ),
+})
@@ -1,162 +1,280 @@
-"""
-Django settings for hitme project.
-
-Generated by 'django-admin startproject' using Django 2.2.2.
-
-For more information on this file, see
-https://docs.djangoproject.com/en/2.2/topics/settings/
-
-For the full list of settings and their values, see
-https://docs.djangoproject.com/en/2.2/ref/settings/
-"""
-
-import os
-
-# Add local settings file to prevent deployment specific settings
-# in source control.
-try:
-    from .local_settings import *
-except ImportError:
-    raise Exception("A local_settings.py file is required to run this project")
-
-# Build paths inside the project like this: os.path.join(BASE_DIR, ...)
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
-
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = '34v!ypse9rzut@so))y_1$-(8plxey80m@oz09%&y320%t#1mk'
-
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
-
-# ALLOWED_HOSTS = []
-
-
-# Application definition
-
-INSTALLED_APPS = [
-    'django.contrib.admin',
-    'django.contrib.auth',
-    'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
-    'hello.apps.HelloConfig',
-    'hitme_game.apps.HitmeGameConfig',
-    'channels',
-]
-
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-]
-
-ROOT_URLCONF = 'hitme.urls'
-
-TEMPLATES = [
-    {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
-        'APP_DIRS': True,
-        'OPTIONS': {
-            'context_processors': [
-                'django.template.context_processors.debug',
-                'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
-            ],
-        },
-    },
-]
-
-WSGI_APPLICATION = 'hitme.wsgi.application'
-
-
-# Database
-# https://docs.djangoproject.com/en/2.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': DATABASE_NAME,
-        'USER': DATABASE_USER,
-        'PASSWORD': DATABASE_PASSWORD,
-        'HOST': DATABASE_HOST,
-        'PORT': DATABASE_PORT,
-    }
-}
-
-# Password validation
-# https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
-
-AUTH_PASSWORD_VALIDATORS = [
-    {
-        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
-    },
-]
-
-
-# Internationalization
-# https://docs.djangoproject.com/en/2.2/topics/i18n/
-
-LANGUAGE_CODE = 'en-us'
-
-TIME_ZONE = 'UTC'
-
-USE_I18N = True
-
-USE_L10N = True
-
-USE_TZ = True
-
-
-# Static files (CSS, JavaScript, Images)
-# https://docs.djangoproject.com/en/2.2/howto/static-files/
-
-STATIC_URL = '/static/'
-STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
-MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
-LOGIN_REDIRECT_URL = "/hitme/lobby"
-LOGIN_URL = "/hitme"
-
-# Game Session URL Length
-SESSION_URL_LENGTH = 10
-
-# Max Players per Game
-MAX_PLAYERS_PER_GAME = 3
-
-# Channels
-ASGI_APPLICATION = 'hitme.routing.application'
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
-        },
-    },
-}
-
-# Live Games Redis Config
-LIVE_GAMES_REDIS_CONFIG = {
-    'host': '127.0.0.1',
-    'port': 6379,
-    'db': 1,
-}
+"""
+Django settings for hitme project.
+
+Generated by 'django-admin startproject' using Django 2.2.2.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/2.2/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/2.2/ref/settings/
+"""
+
+import os
+
+# Add local settings file to prevent deployment specific settings
+# in source control.
+try:
+    from .local_settings import *
+except ImportError:
+    raise Exception("A local_settings.py file is required to run this project")
+
+# Build paths inside the project like this: os.path.join(BASE_DIR, ...)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = '34v!ypse9rzut@so))y_1$-(8plxey80m@oz09%&y320%t#1mk'
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+# ALLOWED_HOSTS = []
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'hello.apps.HelloConfig',
+    'hitme_game.apps.HitmeGameConfig',
+    'channels',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'hitme.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'hitme.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/2.2/ref/settings/#databases
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.mysql',
+        'NAME': DATABASE_NAME,
+        'USER': DATABASE_USER,
+        'PASSWORD': DATABASE_PASSWORD,
+        'HOST': DATABASE_HOST,
+        'PORT': DATABASE_PORT,
+    }
+}
+
+# Password validation
+# https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/2.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_L10N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/2.2/howto/static-files/
+
+STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+LOGIN_REDIRECT_URL = "/hitme/lobby"
+LOGIN_URL = "/hitme"
+
+# Game Session URL Length, urls repeat after 2 ** (length * log2(36) - 18)
+# milliseconds, about 557 years for 12
+SESSION_URL_LENGTH = 12
+
+# Max Players per Game
+MAX_PLAYERS_PER_GAME = 3
+
+# Largest bet a player may place, as offered by the game room's bet input
+MAX_BET = 100
+
+# Shoe: decks per shoe, fraction dealt before reshuffling, and a fixed
+# seed (None for random) to replay deals in load tests
+SHOE_NUM_DECKS = 6
+SHOE_PENETRATION = 0.75
+SHOE_SEED = None
+
+# Channels
+ASGI_APPLICATION = 'hitme.routing.application'
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            "hosts": [('127.0.0.1', 6379)],
+        },
+    },
+}
+
+# Live Games Redis Config
+LIVE_GAMES_REDIS_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 6379,
+    'db': 1,
+    'max_connections': 50,
+    'pool_timeout': 20,
+    'socket_timeout': 5,
+    'socket_connect_timeout': 5,
+    'health_check_interval': 30,
+}
+
+# Live Games state backend: 'pickle' (lock + encoded GameObj), 'lua'
+# (Redis scripts) or 'actor' (in-process owner with write-behind)
+LIVE_GAMES_BACKEND = 'pickle'
+
+# Per process cache of game snapshots for the 'pickle' backend, kept fresh
+# through Redis pub/sub invalidation. 0 disables it
+LIVE_GAMES_CACHE_SIZE = 1024
+
+# Lobby changes are collected for this long (seconds) and sent as one
+# LOBBY_DIFF frame
+LOBBY_DIFF_WINDOW = 0.25
+
+# Games per page of the lobby listing, lobby sockets only get the changes
+# of the page they show
+LOBBY_PAGE_SIZE = 20
+
+# GameSession.num_players is written behind from Redis every flush_interval
+# seconds, or once a process recorded flush_changes joins and leaves. One
+# process flushes at a time, holding a lock that expires after
+# flush_lock_timeout seconds
+LIVE_GAMES_SESSION_WRITER_CONFIG = {
+    'flush_interval': 0.5,
+    'flush_changes': 200,
+    'flush_lock_timeout': 30,
+}
+
+# Websocket handshakes read the game creator and the session user from
+# Redis, cached for these many seconds
+HANDSHAKE_CACHE_CONFIG = {
+    'game_ttl': 86400,
+    'user_ttl': 300,
+}
+
+# Actor backend: owner key ttl, how long a remote owner is cached,
+# write-behind period, how long a forwarded command may take and how long
+# the actor may take to start (seconds)
+LIVE_GAMES_ACTOR_CONFIG = {
+    'owner_ttl_ms': 5000,
+    'owner_cache_seconds': 1,
+    'write_behind_interval': 0.2,
+    'forward_timeout': 5,
+    'start_timeout': 5,
+}
+
+# Addresses (REMOTE_ADDR, so the proxy's own behind one) allowed to scrape
+# /hitme/metrics, staff users may always see it
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Profiling of game room messages and game transitions: off unless
+# enabled here or started on the running workers with profile_workers.
+# Fraction of messages sampled, whether allocations are traced, where and
+# how often (seconds) profiles are dumped, how often workers poll Redis
+PROFILING_CONFIG = {
+    'enabled': False,
+    'sample_rate': 0.01,
+    'tracemalloc': False,
+    'dump_dir': os.path.join(BASE_DIR, 'profiles'),
+    'dump_interval': 60,
+    'poll_interval': 1,
+}
+
+# Game server logs, one JSON object per line written off the request path.
+# Levels are set per category, per message and per frame records are
+# DEBUG and sampled to at most 'rate' per second when enabled
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'context': {'()': 'hitme_game.logs.ContextFilter'},
+        'sample_messages': {'()': 'hitme_game.logs.SampleFilter',
+                            'rate': 20, 'burst': 50},
+        'sample_frames': {'()': 'hitme_game.logs.SampleFilter',
+                          'rate': 20, 'burst': 50},
+    },
+    'formatters': {
+        'json': {'()': 'hitme_game.logs.JsonFormatter'},
+    },
+    'handlers': {
+        'queued': {
+            'class': 'hitme_game.logs.QueuedHandler',
+            'formatter': 'json',
+            'filters': ['context'],
+        },
+    },
+    'loggers': {
+        'hitme_game': {
+            'handlers': ['queued'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'hitme_game.messages': {
+            'level': 'INFO',
+            'filters': ['sample_messages'],
+        },
+        'hitme_game.frames': {
+            'level': 'INFO',
+            'filters': ['sample_frames'],
+        },
+        'hitme_game.games': {'level': 'INFO'},
+        'hitme_game.background': {'level': 'INFO'},
+    },
+}
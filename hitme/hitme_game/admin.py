@@ -1,8 +1,8 @@
-"""hitme_game - admin """
-
-from django.contrib import admin
-from .models import GameSession
-
-# Register your models here.
-
+"""hitme_game - admin """
+
+from django.contrib import admin
+from .models import GameSession
+
+# Register your models here.
+
 admin.site.register(GameSession)
\ No newline at end of file
@@ -1,6 +1,10 @@
-"""Hitme - apps"""
-
-from django.apps import AppConfig
-
-class HitmeGameConfig(AppConfig):
-    name = 'hitme_game'
+"""Hitme - apps"""
+
+from django.apps import AppConfig
+
+class HitmeGameConfig(AppConfig):
+    name = 'hitme_game'
+
+    def ready(self):
+        # Connects the logout signal dropping cached websocket users
+        from . import handshake
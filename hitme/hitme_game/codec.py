@@ -0,0 +1,250 @@
+"""
+Compact, schema versioned binary encoding of live games.
+
+Layout (little endian, version 5):
+    header  : b'HG' + version byte
+    game    : url, creator, game_state, current_turn, dealer_blackjack,
+              seat count, uint32 shoe position and cut card position,
+              next shoe seed and state version, then the dealer hand and
+              one record per seat
+    seat    : present flag, followed for a present seat by name, username
+              and a fixed layout player record plus the hand
+    strings : uint16 length prefixed utf-8
+    hands   : uint8 count, uint8 hard total and uint8 ace count followed
+              by one byte per card
+    card    : suit index * 13 + number index
+
+The shoe buffer itself is stored under its own key and handed to
+decode_game, it only changes when the shoe is reshuffled.
+
+Version 1 hands had no totals, they are recomputed when decoding. Version
+1 and 2 games had no shoe, they get a fresh one on their next round.
+Games before version 4 start again from state version 0. Version 3 and 4
+stored the shoe and cut card positions as uint16, which caps the shoe at
+65535 cards.
+
+Values written by older deploys with pickle are still readable, they get
+rewritten in the current format on the next write to the game.
+"""
+
+from . import live_games
+from array import array
+import pickle
+import struct
+
+
+MAGIC = b'HG'
+VERSION = 5
+
+_HEADER = struct.Struct('<2sB')
+_STR_LEN = struct.Struct('<H')
+_GAME_V2 = struct.Struct('<BhBB')
+_GAME_V3 = struct.Struct('<BhBBHHQ')
+_GAME_V4 = struct.Struct('<BhBBHHQI')
+_GAME = struct.Struct('<BhBBIIQI')
+_PLAYER = struct.Struct('<biiiBBB')
+_BYTE = struct.Struct('<B')
+_HAND = struct.Struct('<BBB')
+
+_PICKLE_PROTO_OPCODE = 0x80
+
+_TABLES = {}
+
+
+def _tables():
+    if not _TABLES:
+        _TABLES['game_states'] = list(live_games.GameState)
+        _TABLES['player_states'] = list(live_games.PlayerGameState)
+        _TABLES['outcomes'] = list(live_games.PlayerGameOutcome)
+        _TABLES['game_state_ids'] = {
+            s: i for i, s in enumerate(_TABLES['game_states'])}
+        _TABLES['player_state_ids'] = {
+            s: i for i, s in enumerate(_TABLES['player_states'])}
+        _TABLES['outcome_ids'] = {
+            s: i for i, s in enumerate(_TABLES['outcomes'])}
+    return _TABLES
+
+
+def _legacy_card_id(card):
+    # Pickled games kept each card as {'suit': .., 'num': .., 'value': ..}
+    return (live_games.SUITS.index(card['suit']) * len(live_games.NUMBERS) +
+            live_games.NUMBERS.index(card['num']))
+
+
+def _legacy_hand(hand):
+    return array(live_games.HAND_TYPECODE, map(_legacy_card_id, hand))
+
+
+def _upgrade_legacy(game_obj):
+    game_obj.shoe = b''
+    game_obj.shoe_pos = game_obj.shoe_cut = 0
+    game_obj.shoe_seed = live_games.initial_shoe_seed()
+    game_obj.shoe_dirty = False
+    game_obj.version = 0
+    game_obj.dealer_hand = _legacy_hand(game_obj.dealer_hand)
+    game_obj.dealer_hard_total, game_obj.dealer_aces = (
+        live_games.hand_totals(game_obj.dealer_hand))
+    for p in game_obj.players_list:
+        if p is not None:
+            p.current_hand = _legacy_hand(p.current_hand)
+            p.hand_hard_total, p.hand_aces = (
+                live_games.hand_totals(p.current_hand))
+    return game_obj
+
+
+def _pack_str(parts, value):
+    data = value.encode('utf-8')
+    parts.append(_STR_LEN.pack(len(data)))
+    parts.append(data)
+
+
+def _unpack_str(data, offset):
+    length, = _STR_LEN.unpack_from(data, offset)
+    offset += _STR_LEN.size
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def _pack_hand(parts, hand, hard_total, aces):
+    parts.append(_HAND.pack(len(hand), hard_total, aces))
+    parts.append(hand.tobytes())
+
+
+def _unpack_hand_v1(data, offset):
+    count, = _BYTE.unpack_from(data, offset)
+    offset += _BYTE.size
+    hand = array(live_games.HAND_TYPECODE, data[offset:offset + count])
+    hard_total, aces = live_games.hand_totals(hand)
+    return hand, hard_total, aces, offset + count
+
+
+def _unpack_hand_v2(data, offset):
+    count, hard_total, aces = _HAND.unpack_from(data, offset)
+    offset += _HAND.size
+    hand = array(live_games.HAND_TYPECODE, data[offset:offset + count])
+    return hand, hard_total, aces, offset + count
+
+
+def encode_game(game_obj):
+    tables = _tables()
+    parts = [_HEADER.pack(MAGIC, VERSION)]
+    _pack_str(parts, game_obj.url)
+    _pack_str(parts, game_obj.creator)
+    parts.append(_GAME.pack(tables['game_state_ids'][game_obj.game_state],
+                            game_obj.current_turn,
+                            game_obj.dealer_blackjack,
+                            len(game_obj.players_list),
+                            game_obj.shoe_pos,
+                            game_obj.shoe_cut,
+                            game_obj.shoe_seed,
+                            game_obj.version))
+    _pack_hand(parts, game_obj.dealer_hand, game_obj.dealer_hard_total,
+               game_obj.dealer_aces)
+
+    for p in game_obj.players_list:
+        if p is None:
+            parts.append(_BYTE.pack(0))
+            continue
+        parts.append(_BYTE.pack(1))
+        _pack_str(parts, p.name)
+        _pack_str(parts, p.username)
+        parts.append(_PLAYER.pack(
+            p.index, p.dollars, p.current_bet, p.win_loss, p.in_game,
+            tables['player_state_ids'][p.player_game_state],
+            tables['outcome_ids'][p.player_game_outcome]))
+        _pack_hand(parts, p.current_hand, p.hand_hard_total, p.hand_aces)
+    return b''.join(parts)
+
+
+def _decode_game(data, offset, unpack_hand, game_struct, shoe):
+    tables = _tables()
+    url, offset = _unpack_str(data, offset)
+    creator, offset = _unpack_str(data, offset)
+    game_obj = live_games.GameObj(url=url, creator_username=creator)
+
+    fields = game_struct.unpack_from(data, offset)
+    offset += game_struct.size
+    game_state, current_turn, dealer_blackjack, seats = fields[:4]
+    if len(fields) > 4:
+        game_obj.shoe_seed = fields[6]
+        if shoe:
+            game_obj.shoe = shoe
+            game_obj.shoe_pos, game_obj.shoe_cut = fields[4:6]
+    if len(fields) > 7:
+        game_obj.version = fields[7]
+    game_obj.game_state = tables['game_states'][game_state]
+    game_obj.current_turn = current_turn
+    game_obj.dealer_blackjack = bool(dealer_blackjack)
+    (game_obj.dealer_hand, game_obj.dealer_hard_total, game_obj.dealer_aces,
+     offset) = unpack_hand(data, offset)
+    game_obj.players_list = [None] * seats
+
+    for idx in range(seats):
+        present, = _BYTE.unpack_from(data, offset)
+        offset += _BYTE.size
+        if not present:
+            continue
+        name, offset = _unpack_str(data, offset)
+        username, offset = _unpack_str(data, offset)
+        p = live_games.Player(name, username)
+        (p.index, p.dollars, p.current_bet, p.win_loss, in_game,
+         player_state, outcome) = _PLAYER.unpack_from(data, offset)
+        offset += _PLAYER.size
+        p.in_game = bool(in_game)
+        p.player_game_state = tables['player_states'][player_state]
+        p.player_game_outcome = tables['outcomes'][outcome]
+        p.current_hand, p.hand_hard_total, p.hand_aces, offset = unpack_hand(
+            data, offset)
+        game_obj.players_list[idx] = p
+        game_obj.players_map[name] = idx
+    return game_obj
+
+
+def _decode_v1(data, offset, shoe):
+    return _decode_game(data, offset, _unpack_hand_v1, _GAME_V2, None)
+
+
+def _decode_v2(data, offset, shoe):
+    return _decode_game(data, offset, _unpack_hand_v2, _GAME_V2, None)
+
+
+def _decode_v3(data, offset, shoe):
+    return _decode_game(data, offset, _unpack_hand_v2, _GAME_V3, shoe)
+
+
+def _decode_v4(data, offset, shoe):
+    return _decode_game(data, offset, _unpack_hand_v2, _GAME_V4, shoe)
+
+
+def _decode_v5(data, offset, shoe):
+    return _decode_game(data, offset, _unpack_hand_v2, _GAME, shoe)
+
+
+_DECODERS = {
+    1: _decode_v1,
+    2: _decode_v2,
+    3: _decode_v3,
+    4: _decode_v4,
+    5: _decode_v5,
+}
+
+
+def is_legacy(data):
+    return data[0] == _PICKLE_PROTO_OPCODE
+
+
+def needs_migration(data):
+    if is_legacy(data):
+        return True
+    _, version = _HEADER.unpack_from(data, 0)
+    return version != VERSION
+
+
+def decode_game(data, shoe=None):
+    if is_legacy(data):
+        # Written by a deploy that still pickled games
+        return _upgrade_legacy(pickle.loads(data))
+    magic, version = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in _DECODERS:
+        raise ValueError(
+            "Unknown live game encoding: {!r} v{}".format(magic, version))
+    return _DECODERS[version](data, _HEADER.size, shoe)
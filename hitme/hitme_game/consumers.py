@@ -1,549 +1,557 @@
-# hitme_game/consumers.py
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
-from channels.layers import get_channel_layer
-from django.conf import settings
-import json
-from .models import GameSession
-from . import live_games
-from time import sleep
-
-MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
-
-
-class LobbyConsumer(JsonWebsocketConsumer):
-    LOBBY_CHANNEL_GROUP = "lobby_channels"
-
-    @classmethod
-    def update_game_broadcast(cls, data):
-        channel_layer = get_channel_layer()
-        data['type'] = 'update_game'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.LOBBY_CHANNEL_GROUP, data
-        )
-
-    @classmethod
-    def remove_game_broadcast(cls, data):
-        channel_layer = get_channel_layer()
-        data['type'] = 'remove_game'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.LOBBY_CHANNEL_GROUP, data
-        )
-
-    @classmethod
-    def chat_broadcast(cls, data):
-        channel_layer = get_channel_layer()
-        data['type'] = 'chat_message'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.LOBBY_CHANNEL_GROUP, data
-        )
-
-    def connect(self):
-        if self.scope["user"].is_anonymous:
-            self.close()
-
-        # Join Lobby Group
-        async_to_sync(self.channel_layer.group_add)(
-            LobbyConsumer.LOBBY_CHANNEL_GROUP,
-            self.channel_name
-        )
-        self.accept()
-
-    def disconnect(self, close_code):
-        # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(
-            LobbyConsumer.LOBBY_CHANNEL_GROUP,
-            self.channel_name
-        )
-
-    def receive_json(self, content):
-        message_type = content.get('type', '')
-        if message_type == "CHAT":
-            LobbyConsumer.chat_broadcast({
-                'chat_message': content['chat_message'],
-                'player': self.scope["user"].username
-            })
-
-    def update_game(self, event):
-        url = event["url"]
-        creator = event["creator"]
-        num_players = event["num_players"]
-
-        content = {
-            'type': 'UPDATE_GAME',
-            'url': url,
-            'creator': creator,
-            'num_players': num_players,
-        }
-        self.send_json(content)
-
-    def remove_game(self, event):
-        url = event["url"]
-
-        content = {
-            'type': 'REMOVE_GAME',
-            'url': url,
-        }
-        self.send_json(content)
-
-    def chat_message(self, event):
-        content = {
-            'type': 'CHAT_MESSAGE',
-            'chat_message': event["chat_message"],
-            'player': event["player"]
-        }
-        self.send_json(content)
-
-
-class GameRoomConsumer(JsonWebsocketConsumer):
-
-    GROUP_NAME_PREFIX = "GAME-"
-
-    def send_json(self, content):
-        super().send_json(content)
-        print("Sending Message: {}".format(content['type']))
-
-    @classmethod
-    def chat_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'chat_message'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def add_player_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'player_added'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def remove_player_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'player_removed'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def start_game_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'game_started'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def start_game_all_ready_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'game_started_all_ready'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def turn_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'turn_changed'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def player_hit_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'player_hit'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def player_ready_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'player_ready'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def dealer_turn_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'dealer_final_turn'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    @classmethod
-    def players_blackjack_broadcast(cls, data, url):
-        channel_layer = get_channel_layer()
-        data['type'] = 'players_blackjack'
-        # Send message to room group
-        async_to_sync(channel_layer.group_send)(
-            cls.GROUP_NAME_PREFIX+url, data
-        )
-
-    def connect(self):
-        if self.scope["user"].is_anonymous:
-            self.close()
-        game_url = self.scope["url_route"]["kwargs"]["game_url"]
-        game = GameSession.objects.get_game(game_url)
-        if game is None:
-            self.close()
-        self.game_url = game_url
-        self.game_creator = game.creator.username
-        # Join Game Group
-        async_to_sync(self.channel_layer.group_add)(
-            GameRoomConsumer.GROUP_NAME_PREFIX + self.game_url,
-            self.channel_name
-        )
-        self.accept()
-        self.add_player()
-
-    def add_player(self):
-        url = self.game_url
-        creator_username = self.game_creator
-        current_player = self.scope["user"].username
-
-        num_players = live_games._redis_add_player(
-            self, url, creator_username, current_player)
-
-        # Send lobby Updates
-        if num_players > 0 and num_players < MAX_PLAYERS_PER_GAME:
-            LobbyConsumer.update_game_broadcast({
-                'url': url,
-                'creator': creator_username,
-                'num_players': num_players
-            })
-        else:
-            LobbyConsumer.remove_game_broadcast({
-                'url': url
-            })
-
-    def disconnect(self, close_code):
-        self.remove_player()
-        # Leave game group
-        async_to_sync(self.channel_layer.group_discard)(
-            GameRoomConsumer.GROUP_NAME_PREFIX + self.game_url,
-            self.channel_name
-        )
-
-    def remove_player(self):
-        url = self.game_url
-        creator_username = self.game_creator
-
-        num_players, player_removed = live_games._redis_remove_player(
-            self, url)
-
-        if num_players > 0 and num_players < MAX_PLAYERS_PER_GAME:
-            # Send lobby Updates
-            LobbyConsumer.update_game_broadcast({
-                'url': url,
-                'creator': creator_username,
-                'num_players': num_players
-            })
-        else:
-            # Send lobby Updates
-            LobbyConsumer.remove_game_broadcast({
-                'url': url
-            })
-
-        # Inform other players in the game
-        GameRoomConsumer.remove_player_broadcast({
-            'idx': player_removed.index,
-            'player': player_removed.get_json_obj()}, self.game_url)
-
-        game_obj = live_games._get_redis_game_obj_json(self.game_url)
-        if game_obj and self.check_if_all_ready(game_obj):
-            # sleep for small duration
-            sleep(0.1)
-            self.start_game_all_ready()
-
-    def receive_json(self, content):
-        print("Received Message: {}".format(content))
-        message_type = content.get('type', '')
-        if message_type == "CHAT":
-            GameRoomConsumer.chat_broadcast({
-                'chat_message': content['chat_message'],
-                'player': self.scope["user"].username
-            }, self.game_url)
-        elif message_type == "INIT_GAME":
-            self.send_init_game()
-        elif message_type == "START_GAME":
-            self.start_game()
-        elif message_type == "HIT":
-            self.hit(content.get('idx', None))
-        elif message_type == "DOUBLE":
-            self.double(content.get('idx', None))
-        elif message_type == "HOLD":
-            self.hold(content.get('idx', None))
-        elif message_type == "PLAYER_READY":
-            self.ready_btn(content.get('idx', None), content.get('bet', 5))
-
-    def send_init_game(self):
-        game_obj = live_games._get_redis_game_obj_json(self.game_url)
-        print(game_obj)
-        idx = -1
-        for key, val in game_obj['players'].items():
-            if val['name'] == self.channel_name:
-                idx = key
-                break
-        content = {
-            'type': 'INIT_GAME',
-            'my_idx': idx,
-            'state': game_obj
-        }
-        self.send_json(content)
-        sleep(0.05)
-        # Also inform other players of the new player arrived
-        GameRoomConsumer.add_player_broadcast({
-            'idx': idx,
-            'player': game_obj['players'][idx]
-        }, self.game_url)
-
-    def start_game(self):
-        game_obj = live_games._get_redis_game_obj_json(self.game_url)
-        
-        if (game_obj['game_state'] == live_games.GameState.STARTED.value or
-                game_obj['game_state'] == live_games.GameState.AWAITING_READY.value):
-            return
-        
-        started_game_obj = live_games._redis_start_game(self.game_url)
-
-        # Init game object correctly and inform clients to make bets
-        GameRoomConsumer.start_game_broadcast({
-            'state': started_game_obj
-        }, self.game_url)
-
-    def start_game_all_ready(self):
-        game_obj, status = live_games._redis_start_game_all_ready(
-            self.game_url)
-        # Dealdeal all cards then inform clients
-        GameRoomConsumer.start_game_all_ready_broadcast({
-            'state': game_obj
-        }, self.game_url)
-
-        # Check blackjack
-        game_obj = live_games._redis_check_initial_blackjack(self.game_url)
-
-        # Check if players have any blackjack
-        player_blackjacks = []
-        for idx, player_obj in game_obj['players'].items():
-            if player_obj["player_game_state"] == live_games.PlayerGameState.GAME_OVER_BLACKJACK.value:
-                player_blackjacks.append(idx)
-        # If players have blackjack, inform clients
-        if len(player_blackjacks) > 0:
-            # sleep for small duration
-            sleep(0.05)
-            GameRoomConsumer.players_blackjack_broadcast({
-                'players': player_blackjacks
-            }, self.game_url)
-
-        # sleep for small duration
-        sleep(0.1)
-
-        # If dealer blackjack or all players blackjack
-        if (game_obj['dealer_blackjack'] == True or
-                game_obj['current_turn'] >= MAX_PLAYERS_PER_GAME):
-            game_obj = live_games._redis_dealer_final_turn(self.game_url)
-            GameRoomConsumer.dealer_turn_broadcast({
-                'state': game_obj
-            }, self.game_url)
-
-        # Else send regular turn event
-        else:
-            GameRoomConsumer.turn_broadcast({
-                'state': game_obj
-            }, self.game_url)
-
-    def hit(self, idx):
-        if not self.is_valid_turn(idx):
-            return
-        game_obj, status = live_games._redis_player_hit(self.game_url, idx)
-
-        # Inform clients of Player Hit
-        if status:
-            GameRoomConsumer.player_hit_broadcast({
-                'idx': idx,
-                'state': game_obj
-            }, self.game_url)
-        # sleep for small duration
-        sleep(0.1)
-        # Check is user turn is done, total above 21
-        if game_obj['players'][idx]["current_hand_value"] >= 21:
-            self.do_next_turn()
-
-    def double(self, idx):
-        if not self.is_valid_turn(idx):
-            return
-        game_obj, status = live_games._redis_player_hit(self.game_url,
-                                                        idx, is_double=True)
-        # Inform clients of Player Hit
-        if status:
-            GameRoomConsumer.player_hit_broadcast({
-                'idx': idx,
-                'state': game_obj
-            }, self.game_url)
-        # sleep for small duration
-        sleep(0.1)
-        # End turn after double
-        self.do_next_turn()
-
-    def hold(self, idx):
-        if not self.is_valid_turn(idx):
-            return
-        self.do_next_turn()
-
-    def ready_btn(self, idx, bet):
-        if idx is None or idx < 0 or idx >= MAX_PLAYERS_PER_GAME:
-            return
-
-        game_obj, status = live_games._redis_player_ready(
-            self.game_url, idx, bet)
-        print("Player Ready Status :: {}".format(status))
-        # Inform clients of Player Hit
-        if status:
-            GameRoomConsumer.player_ready_broadcast({
-                'idx': idx,
-                'state': game_obj
-            }, self.game_url)
-
-        if self.check_if_all_ready(game_obj):
-            # sleep for small duration
-            sleep(0.1)
-            self.start_game_all_ready()
-
-    def do_next_turn(self):
-        game_obj, next_turn = live_games._redis_next_turn(self.game_url)
-        if next_turn >= MAX_PLAYERS_PER_GAME:
-            # Dealer Turn
-            game_obj = live_games._redis_dealer_final_turn(self.game_url)
-            GameRoomConsumer.dealer_turn_broadcast({
-                'state': game_obj
-            }, self.game_url)
-        else:
-            GameRoomConsumer.turn_broadcast({
-                'state': game_obj
-            }, self.game_url)
-
-    def check_if_all_ready(self, game_obj):
-        if game_obj['game_state'] != live_games.GameState.AWAITING_READY.value:
-            return False
-        for player_obj in game_obj['players'].values():
-            if not player_obj['in_game']:
-                continue
-            elif (player_obj['player_game_state'] ==
-                  live_games.PlayerGameState.AWAITING_READY.value):
-                return False
-        return True
-
-    def is_valid_turn(self, idx):
-        if idx is None:
-            print("idx is None")
-            return False
-
-        game_obj = live_games._get_redis_game_obj_json(self.game_url)
-        if game_obj["current_turn"] != idx:
-            print("Not a valid turn! Current turn not same as idx")
-            return False
-
-        current_player = game_obj['players'].get(idx, None)
-        if current_player:
-            current_player_channel_name = current_player['name']
-        else:
-            current_player_channel_name = None
-        if current_player_channel_name != self.channel_name:
-            print(
-                "Not a valid turn! "
-                "Current turn channel name does not match current consumer")
-            return False
-
-        return True
-
-    def chat_message(self, event):
-        content = {
-            'type': 'CHAT_MESSAGE',
-            'chat_message': event["chat_message"],
-            'player': event["player"]
-        }
-        self.send_json(content)
-
-    def player_added(self, event):
-        content = {
-            'type': 'PLAYER_ADDED',
-            'idx': event["idx"],
-            'player_added': event["player"]
-        }
-        self.send_json(content)
-
-    def player_removed(self, event):
-        content = {
-            'type': 'PLAYER_REMOVED',
-            'idx': event["idx"],
-            'player_removed': event["player"]
-        }
-        self.send_json(content)
-
-    def game_started(self, event):
-        content = {
-            'type': 'GAME_STARTED',
-            'state': event["state"]
-        }
-        self.send_json(content)
-
-    def game_started_all_ready(self, event):
-        content = {
-            'type': 'GAME_STARTED_ALL_READY',
-            'state': event["state"]
-        }
-        self.send_json(content)
-
-    def turn_changed(self, event):
-        content = {
-            'type': 'NEXT_TURN',
-            'state': event["state"]
-        }
-        self.send_json(content)
-
-    def player_hit(self, event):
-        content = {
-            'type': 'PLAYER_HIT',
-            'state': event["state"],
-            'idx': event['idx']
-        }
-        self.send_json(content)
-
-    def player_ready(self, event):
-        content = {
-            'type': 'PLAYER_READY',
-            'state': event["state"],
-            'idx': event['idx']
-        }
-        self.send_json(content)
-
-    def dealer_final_turn(self, event):
-        content = {
-            'type': 'DEALER_FINAL_TURN',
-            'state': event["state"],
-        }
-        self.send_json(content)
-
-    def players_blackjack(self, event):
-        content = {
-            'type': 'PLAYERS_BLACKJACK',
-            'players': event["players"],
-        }
-        self.send_json(content)
+# hitme_game/consumers.py
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import delta, handshake, lobby_index, logs, metrics, profiling
+from .frames import encode_frame
+from .lobby_feed import LobbyDiffAggregator
+from .scheduler import GameEventScheduler
+import logging
+
+MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
+MAX_BET = getattr(settings, 'MAX_BET', 100)
+LIVE_GAMES_BACKEND = getattr(settings, 'LIVE_GAMES_BACKEND', 'pickle')
+LOBBY_DIFF_WINDOW = getattr(settings, 'LOBBY_DIFF_WINDOW', 0.25)
+
+if LIVE_GAMES_BACKEND == 'lua':
+    from . import lua_games as live_games
+elif LIVE_GAMES_BACKEND == 'actor':
+    from . import game_actor as live_games
+else:
+    from . import live_games
+
+log_messages = logging.getLogger('hitme_game.messages')
+log_frames = logging.getLogger('hitme_game.frames')
+log_games = logging.getLogger('hitme_game.games')
+
+# Inbound game room messages, labels of the latency metric
+MESSAGE_TYPES = {"CHAT", "INIT_GAME", "SYNC", "START_GAME", "HIT", "DOUBLE",
+                 "HOLD", "PLAYER_READY"}
+
+# Spaces out the broadcasts of each game so clients can animate them
+_SCHEDULER = GameEventScheduler()
+
+
+class LobbyConsumer(AsyncJsonWebsocketConsumer):
+    LOBBY_CHANNEL_GROUP = "lobby_channels"
+
+    page_group = None
+
+    @classmethod
+    async def update_game_broadcast(cls, data):
+        before = await lobby_index.aput_game(
+            data['url'], data['creator'], data['num_players'])
+        # Sent with the other lobby changes at the end of the window
+        _LOBBY_DIFFS.note(data['url'], before)
+
+    @classmethod
+    async def remove_game_broadcast(cls, data):
+        before = await lobby_index.aremove_game(data['url'])
+        _LOBBY_DIFFS.note(data['url'], before)
+
+    @classmethod
+    async def lobby_diff_broadcast(cls, group, games):
+        # Only the sockets showing the page of the games get the diff
+        await cls.frame_broadcast({
+            'type': 'LOBBY_DIFF',
+            'games': games,
+        }, group)
+
+    @classmethod
+    async def chat_broadcast(cls, data):
+        await cls.frame_broadcast({
+            'type': 'CHAT_MESSAGE',
+            'chat_message': data['chat_message'],
+            'player': data['player']
+        })
+
+    @classmethod
+    async def frame_broadcast(cls, content, group=None):
+        channel_layer = get_channel_layer()
+        metrics.GROUP_SENDS.inc('lobby' if group is None else 'lobby_page')
+        # Send message to room group, encoded once for all members
+        await channel_layer.group_send(
+            group or cls.LOBBY_CHANNEL_GROUP, {
+                'type': 'send_frame',
+                'text': encode_frame(content)
+            }
+        )
+
+    @classmethod
+    async def encode_json(cls, content):
+        return encode_frame(content)
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.close()
+            return
+
+        # Join Lobby Group
+        await self.channel_layer.group_add(
+            LobbyConsumer.LOBBY_CHANNEL_GROUP,
+            self.channel_name
+        )
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        # Leave room group
+        await self.channel_layer.group_discard(
+            LobbyConsumer.LOBBY_CHANNEL_GROUP,
+            self.channel_name
+        )
+        await self.subscribe_page(None)
+
+    async def receive_json(self, content):
+        message_type = content.get('type', '')
+        if message_type == "CHAT":
+            await LobbyConsumer.chat_broadcast({
+                'chat_message': content['chat_message'],
+                'player': self.scope["user"].username
+            })
+        elif message_type == "LIST_GAMES":
+            await self.list_games(content)
+
+    async def list_games(self, content):
+        # One page of the listing, filtered by free seats or creator.
+        # Changes of the page are sent to this socket until the next
+        # LIST_GAMES
+        page, free, creator = (content.get('page'), content.get('free'),
+                               content.get('creator'))
+        page = page if isinstance(page, int) and page > 0 else 0
+        if not isinstance(free, int) or not 0 < free < MAX_PLAYERS_PER_GAME:
+            free = None
+        if not isinstance(creator, str):
+            creator = None
+        games, pages = await lobby_index.alist_games(page, free, creator)
+        await self.subscribe_page(lobby_index.page_group(
+            lobby_index.facet_key(free, creator), page))
+        await self.send_json({
+            'type': 'GAMES',
+            'games': games,
+            'page': page,
+            'pages': pages
+        })
+
+    async def subscribe_page(self, group):
+        if group == self.page_group:
+            return
+        if self.page_group is not None:
+            await self.channel_layer.group_discard(
+                self.page_group, self.channel_name)
+        if group is not None:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.page_group = group
+
+    async def send_frame(self, event):
+        await self.send(text_data=event['text'])
+
+
+# Collects lobby changes and sends them as one LOBBY_DIFF per window
+_LOBBY_DIFFS = LobbyDiffAggregator(
+    LOBBY_DIFF_WINDOW, LobbyConsumer.lobby_diff_broadcast)
+
+
+class GameRoomConsumer(AsyncJsonWebsocketConsumer):
+
+    GROUP_NAME_PREFIX = "GAME-"
+
+    game_url = None
+    message_seq = 0
+
+    async def send_json(self, content, close=False):
+        await super().send_json(content, close)
+        log_frames.debug("sent", extra={'data': {'type': content['type']}})
+
+    @classmethod
+    async def encode_json(cls, content):
+        return encode_frame(content)
+
+    @classmethod
+    def frame_event(cls, content):
+        # Encoded once by the sender, every member forwards the same text
+        return {
+            'type': 'send_frame',
+            'frame_type': content['type'],
+            'text': encode_frame(content)
+        }
+
+    @classmethod
+    async def chat_broadcast(cls, data, url):
+        channel_layer = get_channel_layer()
+        metrics.GROUP_SENDS.inc('game_chat')
+        # Send message to room group
+        await channel_layer.group_send(
+            cls.GROUP_NAME_PREFIX+url, cls.frame_event({
+                'type': 'CHAT_MESSAGE',
+                'chat_message': data['chat_message'],
+                'player': data['player']
+            })
+        )
+
+    @classmethod
+    def frame_broadcast(cls, content, url):
+        channel_layer = get_channel_layer()
+        metrics.GROUP_SENDS.inc('game')
+        # Queue message to room group behind earlier events of the game
+        _SCHEDULER.send(url, channel_layer.group_send,
+                        cls.GROUP_NAME_PREFIX+url, cls.frame_event(content))
+
+    @classmethod
+    def add_player_broadcast(cls, data, url):
+        cls.frame_broadcast({
+            'type': 'PLAYER_ADDED',
+            'idx': data['idx'],
+            'player_added': data['player']
+        }, url)
+
+    @classmethod
+    def remove_player_broadcast(cls, data, url):
+        cls.frame_broadcast({
+            'type': 'PLAYER_REMOVED',
+            'idx': data['idx'],
+            'player_removed': data['player']
+        }, url)
+
+    @classmethod
+    def update_broadcast(cls, content, data, url):
+        content.update(data['update'])
+        cls.frame_broadcast(content, url)
+
+    @classmethod
+    def start_game_broadcast(cls, data, url):
+        cls.update_broadcast({'type': 'GAME_STARTED'}, data, url)
+
+    @classmethod
+    def turn_broadcast(cls, data, url):
+        cls.update_broadcast({'type': 'NEXT_TURN'}, data, url)
+
+    @classmethod
+    def player_hit_broadcast(cls, data, url):
+        cls.update_broadcast({'type': 'PLAYER_HIT', 'idx': data['idx']},
+                             data, url)
+
+    @classmethod
+    def player_ready_broadcast(cls, data, url):
+        cls.update_broadcast({'type': 'PLAYER_READY', 'idx': data['idx']},
+                             data, url)
+
+    @classmethod
+    def dealer_turn_broadcast(cls, data, url):
+        cls.update_broadcast({'type': 'DEALER_FINAL_TURN'}, data, url)
+
+    @classmethod
+    def batch_broadcast(cls, events, url):
+        # Events are played in order, each 'delay' ms after the previous one
+        cls.frame_broadcast({'type': 'BATCH', 'events': events}, url)
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.close()
+            return
+        game_url = self.scope["url_route"]["kwargs"]["game_url"]
+        game_creator = await handshake.aget_game_creator(game_url)
+        if game_creator is None:
+            await self.close()
+            return
+        self.game_url = game_url
+        self.game_creator = game_creator
+        # Correlates every record logged while serving this socket
+        logs.bind(game=game_url, conn=self.channel_name)
+        # Join Game Group
+        await self.channel_layer.group_add(
+            GameRoomConsumer.GROUP_NAME_PREFIX + self.game_url,
+            self.channel_name
+        )
+        await self.accept()
+        await self.add_player()
+
+    async def add_player(self):
+        url = self.game_url
+        creator_username = self.game_creator
+        current_player = self.scope["user"].username
+
+        num_players = await live_games._aredis_add_player(
+            self, url, creator_username, current_player)
+
+        # Send lobby Updates
+        if num_players > 0 and num_players < MAX_PLAYERS_PER_GAME:
+            await LobbyConsumer.update_game_broadcast({
+                'url': url,
+                'creator': creator_username,
+                'num_players': num_players
+            })
+        else:
+            await LobbyConsumer.remove_game_broadcast({
+                'url': url
+            })
+
+    async def disconnect(self, close_code):
+        if self.game_url is None:
+            # Rejected in connect, never joined
+            return
+        await self.remove_player()
+        # Leave game group
+        await self.channel_layer.group_discard(
+            GameRoomConsumer.GROUP_NAME_PREFIX + self.game_url,
+            self.channel_name
+        )
+
+    async def remove_player(self):
+        url = self.game_url
+        creator_username = self.game_creator
+
+        num_players, player_removed, game_obj = (
+            await live_games._aredis_remove_player(self, url))
+
+        if num_players > 0 and num_players < MAX_PLAYERS_PER_GAME:
+            # Send lobby Updates
+            await LobbyConsumer.update_game_broadcast({
+                'url': url,
+                'creator': creator_username,
+                'num_players': num_players
+            })
+        else:
+            # Send lobby Updates
+            await LobbyConsumer.remove_game_broadcast({
+                'url': url
+            })
+
+        # Inform other players in the game
+        GameRoomConsumer.remove_player_broadcast({
+            'idx': player_removed['index'],
+            'player': player_removed}, self.game_url)
+
+        if game_obj and self.check_if_all_ready(game_obj):
+            # space out the next event
+            _SCHEDULER.pause(self.game_url, 0.1)
+            await self.start_game_all_ready()
+
+    async def receive_json(self, content):
+        message_type = content.get('type', '')
+        self.message_seq += 1
+        logs.bind(seq=self.message_seq)
+        log_messages.debug("received", extra={'data': {'type': message_type}})
+        # Unknown types share a label, clients pick the type
+        label = message_type if message_type in MESSAGE_TYPES else 'other'
+        with metrics.MESSAGE_SECONDS.time(label):
+            async with profiling.sample('message.' + label):
+                await self.handle_message(message_type, content)
+
+    async def handle_message(self, message_type, content):
+        if message_type == "CHAT":
+            await GameRoomConsumer.chat_broadcast({
+                'chat_message': content['chat_message'],
+                'player': self.scope["user"].username
+            }, self.game_url)
+        elif message_type == "INIT_GAME":
+            await self.send_init_game()
+        elif message_type == "SYNC":
+            await self.send_sync()
+        elif message_type == "START_GAME":
+            await self.start_game()
+        elif message_type == "HIT":
+            await self.hit(content.get('idx', None))
+        elif message_type == "DOUBLE":
+            await self.double(content.get('idx', None))
+        elif message_type == "HOLD":
+            await self.hold(content.get('idx', None))
+        elif message_type == "PLAYER_READY":
+            await self.ready_btn(content.get('idx', None),
+                                 content.get('bet', 5))
+
+    async def send_init_game(self):
+        game_obj = await live_games._aget_redis_game_obj_json(self.game_url)
+        idx = -1
+        for key, val in game_obj['players'].items():
+            if val['name'] == self.channel_name:
+                idx = key
+                break
+        content = {
+            'type': 'INIT_GAME',
+            'my_idx': idx,
+            'state': game_obj
+        }
+        _SCHEDULER.send(self.game_url, self.send_json, content)
+        _SCHEDULER.pause(self.game_url, 0.05)
+        # Also inform other players of the new player arrived
+        GameRoomConsumer.add_player_broadcast({
+            'idx': idx,
+            'player': game_obj['players'][idx]
+        }, self.game_url)
+
+    async def send_sync(self):
+        # Client missed a version, send the whole state right away
+        game_obj = await live_games._aget_redis_game_obj_json(self.game_url)
+        await self.send_json({
+            'type': 'SYNC',
+            'state': game_obj
+        })
+
+    async def start_game(self):
+        game_obj = await live_games._aget_redis_game_obj_json(self.game_url)
+        
+        if (game_obj['game_state'] == live_games.GameState.STARTED.value or
+                game_obj['game_state'] == live_games.GameState.AWAITING_READY.value):
+            return
+        
+        _, update = await live_games._aredis_start_game(self.game_url)
+
+        # Init game object correctly and inform clients to make bets
+        GameRoomConsumer.start_game_broadcast({
+            'update': update
+        }, self.game_url)
+
+    async def start_game_all_ready(self):
+        # Deal, blackjack check and dealer turn run as one transition and
+        # reach the clients as one frame, the client spaces the events out
+        game_obj, status, updates = await live_games._aredis_start_round(
+            self.game_url)
+        if not status:
+            # Round was already dealt by another player
+            return
+        events = [dict(updates[0], type='GAME_STARTED_ALL_READY')]
+
+        # Players who changed state in the blackjack check have blackjack
+        checked = updates[1]['patch'].get('players', {})
+        player_blackjacks = [
+            idx for idx, player_obj in checked.items()
+            if player_obj.get("player_game_state") ==
+            live_games.PlayerGameState.GAME_OVER_BLACKJACK.value]
+        # If players have blackjack, inform clients
+        if len(player_blackjacks) > 0:
+            events.append({
+                'type': 'PLAYERS_BLACKJACK',
+                'players': player_blackjacks,
+                'delay': 50
+            })
+
+        # Dealer played right away on dealer blackjack or all players
+        # blackjack, else send regular turn event
+        if len(updates) > 2:
+            event = dict(delta.merge_updates(updates[1], updates[2]),
+                         type='DEALER_FINAL_TURN')
+        else:
+            event = dict(updates[1], type='NEXT_TURN')
+        event['delay'] = 100
+        events.append(event)
+        GameRoomConsumer.batch_broadcast(events, self.game_url)
+
+    async def hit(self, idx):
+        if not await self.is_valid_turn(idx):
+            return
+        game_obj, status, update = await live_games._aredis_player_hit(
+            self.game_url, idx)
+
+        # Inform clients of Player Hit
+        if status:
+            GameRoomConsumer.player_hit_broadcast({
+                'idx': idx,
+                'update': update
+            }, self.game_url)
+        # space out the next event
+        _SCHEDULER.pause(self.game_url, 0.1)
+        # Check is user turn is done, total above 21
+        if game_obj['players'][idx]["current_hand_value"] >= 21:
+            await self.do_next_turn()
+
+    async def double(self, idx):
+        if not await self.is_valid_turn(idx):
+            return
+        game_obj, status, update = await live_games._aredis_player_hit(
+            self.game_url, idx, is_double=True)
+        # Inform clients of Player Hit
+        if status:
+            GameRoomConsumer.player_hit_broadcast({
+                'idx': idx,
+                'update': update
+            }, self.game_url)
+        # space out the next event
+        _SCHEDULER.pause(self.game_url, 0.1)
+        # End turn after double
+        await self.do_next_turn()
+
+    async def hold(self, idx):
+        if not await self.is_valid_turn(idx):
+            return
+        await self.do_next_turn()
+
+    async def ready_btn(self, idx, bet):
+        if idx is None or idx < 0 or idx >= MAX_PLAYERS_PER_GAME:
+            return
+        # The codec stores bets as int32, reject any other value sent
+        if type(bet) is not int or not 0 < bet <= MAX_BET:
+            return
+
+        game_obj, status, update = await live_games._aredis_player_ready(
+            self.game_url, idx, bet)
+        log_games.debug("player ready", extra={'data': {
+            'idx': idx, 'status': status}})
+        # Inform clients of Player Hit
+        if status:
+            GameRoomConsumer.player_ready_broadcast({
+                'idx': idx,
+                'update': update
+            }, self.game_url)
+
+        if self.check_if_all_ready(game_obj):
+            # space out the next event
+            _SCHEDULER.pause(self.game_url, 0.1)
+            await self.start_game_all_ready()
+
+    async def do_next_turn(self):
+        game_obj, next_turn, update = await live_games._aredis_next_turn(
+            self.game_url)
+        if next_turn >= MAX_PLAYERS_PER_GAME:
+            # Dealer Turn
+            await self.dealer_final_turn_after(update)
+        else:
+            GameRoomConsumer.turn_broadcast({
+                'update': update
+            }, self.game_url)
+
+    async def dealer_final_turn_after(self, update):
+        # The preceding transition was not broadcast, clients get both
+        # patches in the dealer event
+        game_obj, dealer_update = await live_games._aredis_dealer_final_turn(
+            self.game_url)
+        GameRoomConsumer.dealer_turn_broadcast({
+            'update': delta.merge_updates(update, dealer_update)
+        }, self.game_url)
+
+    def check_if_all_ready(self, game_obj):
+        if game_obj['game_state'] != live_games.GameState.AWAITING_READY.value:
+            return False
+        for player_obj in game_obj['players'].values():
+            if not player_obj['in_game']:
+                continue
+            elif (player_obj['player_game_state'] ==
+                  live_games.PlayerGameState.AWAITING_READY.value):
+                return False
+        return True
+
+    async def is_valid_turn(self, idx):
+        if idx is None:
+            log_messages.info("invalid turn, no idx")
+            return False
+
+        game_obj = await live_games._aget_redis_game_obj_json(self.game_url)
+        if game_obj["current_turn"] != idx:
+            log_messages.info("invalid turn, not the current turn",
+                              extra={'data': {'idx': idx}})
+            return False
+
+        current_player = game_obj['players'].get(idx, None)
+        if current_player:
+            current_player_channel_name = current_player['name']
+        else:
+            current_player_channel_name = None
+        if current_player_channel_name != self.channel_name:
+            log_messages.info("invalid turn, seat of another player",
+                              extra={'data': {'idx': idx}})
+            return False
+
+        return True
+
+    async def send_frame(self, event):
+        await self.send(text_data=event['text'])
+        log_frames.debug("sent", extra={'data': {'type': event['frame_type']}})
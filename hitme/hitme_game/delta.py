@@ -0,0 +1,73 @@
+"""
+Versioned patches between two JSON snapshots of a live game.
+
+A patch only holds what changed: nested objects are patched key by key,
+any other changed value (hands included) is sent whole and a removed key
+is sent as None. game_ws.js applies it with the same rules.
+"""
+
+
+def diff(old, new):
+    patch = {}
+    for key, value in new.items():
+        old_value = old.get(key)
+        if old_value == value and key in old:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            patch[key] = diff(old_value, value)
+        else:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+def make_update(before, after):
+    """Patch turning the before snapshot into after, with both versions"""
+    return {
+        'base': before.get('version', 0),
+        'version': after['version'],
+        'patch': diff(before, after),
+    }
+
+
+def apply_transition(game_obj, mutation, *args):
+    """
+    Run mutation(game_obj, *args), bump the game version if the snapshot
+    changed and return the new snapshot, the mutation result and the update.
+    """
+    before = game_obj.get_json_obj()
+    result = mutation(game_obj, *args)
+    after = game_obj.get_json_obj()
+    update = make_update(before, after)
+    if update['patch']:
+        game_obj.version += 1
+        after['version'] = update['version'] = game_obj.version
+        update['patch']['version'] = game_obj.version
+    return after, result, update
+
+
+def merge_patch(first, second):
+    merged = dict(first)
+    for key, value in second.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_patch(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_updates(first, second):
+    """
+    One update for two consecutive transitions that are broadcast together.
+    If another transition slipped in between, second is returned as is and
+    clients resync on the gap.
+    """
+    if first['version'] != second['base']:
+        return second
+    return {
+        'base': first['base'],
+        'version': second['version'],
+        'patch': merge_patch(first['patch'], second['patch']),
+    }
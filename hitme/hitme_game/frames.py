@@ -0,0 +1,21 @@
+"""
+JSON text frames sent to websocket clients.
+
+Broadcasts are encoded once by the sender and every group member forwards
+the same text. orjson is used when installed, json otherwise.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_frame(content):
+    if orjson is not None:
+        # Player seats are int keys, json.dumps turns them into strings too
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(content, separators=(',', ':'))
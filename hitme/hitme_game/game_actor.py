@@ -0,0 +1,563 @@
+"""
+In-process game actor engine for live games.
+
+Each game url is owned by one worker process, recorded in Redis with a
+short lived OWNER key. The owner keeps the live GameObj in memory and
+applies commands one at a time under a per game in-process lock, so no
+distributed lock is taken. Dirty games are written back to Redis by a
+background thread for failover, a new owner picks the snapshot up once the
+old owner's key expires.
+
+Consumers on other workers forward their commands to the owner's process
+channel through the channel layer and wait for the reply. The actor builds
+its own instance of the default channel layer and only uses it on its own
+event loop, the server's loop keeps the shared instance. The module
+exposes the same helpers as live_games and is selected with
+LIVE_GAMES_BACKEND = 'actor'.
+"""
+
+from asgiref.sync import sync_to_async
+from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers
+from django.conf import settings
+from . import delta, live_games, metrics, profiling, session_writer
+from .live_games import (GameObj, GameState, PlayerGameState,
+                         PlayerGameOutcome, MAX_PLAYERS_PER_GAME)
+import asyncio
+import logging
+import threading
+import time
+
+log = logging.getLogger('hitme_game.background')
+
+
+OWNER_KEY_FORMAT = "OWNER:{}:OWNER"
+
+ACTOR_CONFIG = getattr(settings, 'LIVE_GAMES_ACTOR_CONFIG', {})
+OWNER_TTL_MS = ACTOR_CONFIG.get('owner_ttl_ms', 5000)
+OWNER_CACHE_SECONDS = ACTOR_CONFIG.get('owner_cache_seconds', 1)
+WRITE_BEHIND_INTERVAL = ACTOR_CONFIG.get('write_behind_interval', 0.2)
+FORWARD_TIMEOUT = ACTOR_CONFIG.get('forward_timeout', 5)
+START_TIMEOUT = ACTOR_CONFIG.get('start_timeout', 5)
+
+# Only extend the owner key while it still names this process
+LUA_REFRESH_OWNER = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Write-behind of an owned game, refused once the owner key names another
+# process or expired, so a stalled owner never overwrites the snapshot of
+# the game's new owner. ARGV[3] is the shoe, empty when unchanged
+LUA_STORE_OWNED = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[3], ARGV[3])
+end
+return 1
+"""
+
+# Delete an owned game and release it, same ownership check
+LUA_DELETE_OWNED = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[2], KEYS[3], KEYS[1])
+return 1
+"""
+
+class ForwardedCommandError(Exception):
+    """A command forwarded to the game's owner failed there"""
+
+
+TRANSITIONS = {
+    'start_game': GameObj.start_game,
+    'start_game_all_ready': GameObj.start_game_all_ready,
+    'player_hit': GameObj.player_hit,
+    'do_next_turn': GameObj.do_next_turn,
+    'dealer_final_turn': GameObj.dealer_final_turn,
+    'player_ready': GameObj.player_ready,
+    'check_initial_blackjack': GameObj.check_initial_blackjack,
+}
+
+
+def _encode_seats(value):
+    # msgpack, which channels_redis uses, refuses int map keys by default:
+    # seats travel as strings and _decode_seats restores them
+    if isinstance(value, dict):
+        return {str(key) if isinstance(key, int) else key:
+                _encode_seats(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_seats(item) for item in value]
+    return value
+
+
+def _decode_seats(value):
+    if isinstance(value, dict):
+        decoded = {key: _decode_seats(item) for key, item in value.items()}
+        players = decoded.get('players')
+        if isinstance(players, dict):
+            decoded['players'] = {int(idx): player
+                                  for idx, player in players.items()}
+        return decoded
+    if isinstance(value, list):
+        return [_decode_seats(item) for item in value]
+    return value
+
+
+class GameActor(object):
+    """Owns the games of this process and serves forwarded commands"""
+
+    def __init__(self):
+        self.channel_name = None
+        self.channel_layer = None
+        self.loop = None
+        self.games = {}
+        self.game_locks = {}
+        self.owned = set()
+        self.remote_owners = {}
+        self.dirty = set()
+        self.deleted = set()
+        self.state_lock = threading.Lock()
+        self.started = False
+        self.ready = threading.Event()
+        self.writing = False
+
+    def _spawn(self):
+        with self.state_lock:
+            if self.started:
+                return
+            threading.Thread(target=self._serve, name='game-actor',
+                             daemon=True).start()
+            self.started = True
+
+    def start(self):
+        # Waits outside state_lock, the serving thread may need it
+        if self.ready.is_set():
+            return
+        self._spawn()
+        if not self.ready.wait(START_TIMEOUT):
+            raise RuntimeError("game actor did not start")
+
+    async def astart(self):
+        if self.ready.is_set():
+            return
+        self._spawn()
+        ready = await sync_to_async(self.ready.wait, thread_sensitive=False)(
+            START_TIMEOUT)
+        if not ready:
+            raise RuntimeError("game actor did not start")
+
+    # Ownership
+
+    def known_owner(self, url):
+        if url in self.owned:
+            return self.channel_name
+        cached = self.remote_owners.get(url)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def remember_owner(self, url, owner):
+        if owner == self.channel_name:
+            with self.state_lock:
+                self.owned.add(url)
+        else:
+            self.remote_owners[url] = (
+                owner, time.monotonic() + OWNER_CACHE_SECONDS)
+        return owner
+
+    def owner_of(self, url):
+        owner = self.known_owner(url)
+        if owner is not None:
+            return owner
+
+        r = live_games._get_redis_conn()
+        key = OWNER_KEY_FORMAT.format(url)
+        while True:
+            if r.set(key, self.channel_name, nx=True, px=OWNER_TTL_MS):
+                return self.remember_owner(url, self.channel_name)
+            owner = r.get(key)
+            if owner is not None:
+                return self.remember_owner(url, owner.decode('utf-8'))
+
+    async def aowner_of(self, url):
+        owner = self.known_owner(url)
+        if owner is not None:
+            return owner
+
+        r = live_games._get_async_redis_conn()
+        key = OWNER_KEY_FORMAT.format(url)
+        while True:
+            if await r.set(key, self.channel_name, nx=True, px=OWNER_TTL_MS):
+                return self.remember_owner(url, self.channel_name)
+            owner = await r.get(key)
+            if owner is not None:
+                return self.remember_owner(url, owner.decode('utf-8'))
+
+    def _game_lock(self, url):
+        with self.state_lock:
+            lock = self.game_locks.get(url)
+            if lock is None:
+                lock = self.game_locks[url] = threading.Lock()
+            return lock
+
+    # Commands
+
+    def dispatch(self, url, op, *args):
+        self.start()
+        owner = self.owner_of(url)
+        if owner == self.channel_name:
+            return self.apply(url, op, args)
+        try:
+            return asyncio.run_coroutine_threadsafe(
+                self._forward(owner, url, op, args), self.loop).result()
+        except asyncio.TimeoutError:
+            # Owner is gone, its key expires and the next command claims it
+            self.remote_owners.pop(url, None)
+            raise
+
+    async def adispatch(self, url, op, *args):
+        await self.astart()
+        owner = await self.aowner_of(url)
+        if owner != self.channel_name:
+            try:
+                return await self.forward(owner, url, op, args)
+            except asyncio.TimeoutError:
+                self.remote_owners.pop(url, None)
+                raise
+        if url in self.games:
+            # In memory, the per game lock is only ever held briefly
+            return self.apply(url, op, args)
+        # Taking over reads the last snapshot from Redis
+        return await sync_to_async(self.apply, thread_sensitive=False)(
+            url, op, args)
+
+    async def forward(self, owner, url, op, args):
+        # The actor's layer instance is bound to the actor's loop
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            self._forward(owner, url, op, args), self.loop))
+
+    async def _forward(self, owner, url, op, args):
+        channel_layer = self.channel_layer
+        reply_channel = await channel_layer.new_channel()
+        await channel_layer.send(owner, {
+            'type': 'game.command',
+            'url': url,
+            'op': op,
+            'args': list(args),
+            'reply_channel': reply_channel,
+        })
+        reply = await asyncio.wait_for(
+            channel_layer.receive(reply_channel), FORWARD_TIMEOUT)
+        if 'error' in reply:
+            raise ForwardedCommandError(reply['error'])
+        return _decode_seats(reply['result'])
+
+    def apply(self, url, op, args):
+        with metrics.TimedLock(self._game_lock(url), op):
+            game_obj = self.games.get(url)
+            if game_obj is None and url not in self.deleted:
+                # Taking over, start from the last written snapshot
+                game_obj = live_games._load_game_obj(
+                    live_games._get_redis_conn(), url)
+                if game_obj is not None:
+                    self.games[url] = game_obj
+            with profiling.sample('game.' + op):
+                if op in TRANSITIONS:
+                    return self.op_transition(url, game_obj, op, *args)
+                return getattr(self, 'op_' + op)(url, game_obj, *args)
+
+    def mark_dirty(self, url):
+        with self.state_lock:
+            self.deleted.discard(url)
+            self.dirty.add(url)
+
+    def op_snapshot(self, url, game_obj):
+        return game_obj.get_json_obj() if game_obj is not None else None
+
+    def op_add_player(self, url, game_obj, channel_name, creator_username,
+                      current_player):
+        if game_obj is None:
+            game_obj = self.games[url] = GameObj(
+                url=url, creator_username=creator_username)
+        live_games._add_to_game_obj(channel_name, game_obj, current_player)
+        self.mark_dirty(url)
+        return len(game_obj.players_map)
+
+    def op_remove_player(self, url, game_obj, channel_name):
+        player = live_games._remove_from_game_obj(channel_name, game_obj)
+        player = player.get_json_obj() if player is not None else None
+        num_players = len(game_obj.players_map)
+        if num_players == 0:
+            with self.state_lock:
+                self.games.pop(url, None)
+                self.dirty.discard(url)
+                self.deleted.add(url)
+            return num_players, player, None
+        self.mark_dirty(url)
+        return num_players, player, game_obj.get_json_obj()
+
+    def op_start_round(self, url, game_obj):
+        outcome = live_games.start_round(game_obj)
+        self.mark_dirty(url)
+        return outcome
+
+    def op_transition(self, url, game_obj, op, *args):
+        game_json, result, update = delta.apply_transition(
+            game_obj, TRANSITIONS[op], *args)
+        self.mark_dirty(url)
+        return game_json, result, update
+
+    # Background threads
+
+    def _serve(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._serve_forever())
+        except Exception:
+            log.exception("game actor stopped")
+        finally:
+            # The next command starts it again on a new channel, the old
+            # channel's games are dropped once their owner keys are lost
+            with self.state_lock:
+                self.ready.clear()
+                self.started = False
+            loop.close()
+
+    async def _serve_forever(self):
+        channel_layer = channel_layers.make_backend(DEFAULT_CHANNEL_LAYER)
+        self.channel_name = await channel_layer.new_channel()
+        self.channel_layer = channel_layer
+        self.loop = asyncio.get_event_loop()
+        with self.state_lock:
+            if not self.writing:
+                threading.Thread(target=self._write_behind,
+                                 name='game-actor-write-behind',
+                                 daemon=True).start()
+                self.writing = True
+        self.ready.set()
+        loop = self.loop
+        while True:
+            message = await channel_layer.receive(self.channel_name)
+            if message.get('type') == 'game.command':
+                loop.create_task(self._serve_command(channel_layer, message))
+
+    async def _serve_command(self, channel_layer, message):
+        # dispatch re-routes the command if ownership moved meanwhile
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(
+                None, self.dispatch, message['url'], message['op'],
+                *message['args'])
+            reply = {'type': 'game.reply', 'result': _encode_seats(result)}
+        except Exception as e:
+            # Answer anyway, a silent owner would be taken for dead
+            log.exception("forwarded game command failed", extra={'data': {
+                'game': message['url'], 'op': message['op']}})
+            reply = {'type': 'game.reply',
+                     'error': '{}: {}'.format(type(e).__name__, e)}
+        await channel_layer.send(message['reply_channel'], reply)
+
+    def _write_behind(self):
+        r = live_games._get_redis_conn()
+        scripts = (r.register_script(LUA_STORE_OWNED),
+                   r.register_script(LUA_DELETE_OWNED),
+                   r.register_script(LUA_REFRESH_OWNER))
+        while True:
+            time.sleep(WRITE_BEHIND_INTERVAL)
+            try:
+                self.flush(r, *scripts)
+            except Exception:
+                # Keep the games dirty and retry on the next tick
+                log.exception("game actor write-behind failed")
+
+    def flush(self, r, store_owned, delete_owned, refresh_owner):
+        with self.state_lock:
+            dirty, self.dirty = self.dirty, set()
+            deleted, self.deleted = self.deleted, set()
+            owned = list(self.owned)
+
+        try:
+            pipe = r.pipeline(transaction=False)
+            stored = []
+            for url in dirty:
+                with self._game_lock(url):
+                    game_obj = self.games.get(url)
+                    if game_obj is None:
+                        continue
+                    shoe = game_obj.shoe if game_obj.shoe_dirty else b''
+                    store_owned(keys=[OWNER_KEY_FORMAT.format(url),
+                                      live_games.KEY_FORMAT.format(url),
+                                      live_games.SHOE_KEY_FORMAT.format(url)],
+                                args=[self.channel_name,
+                                      live_games._encode_game_obj(game_obj),
+                                      shoe],
+                                client=pipe)
+                    stored.append((url, game_obj, shoe))
+            for url in deleted:
+                delete_owned(keys=[OWNER_KEY_FORMAT.format(url),
+                                   live_games.KEY_FORMAT.format(url),
+                                   live_games.SHOE_KEY_FORMAT.format(url)],
+                             args=[self.channel_name], client=pipe)
+            written = pipe.execute()
+        except Exception:
+            with self.state_lock:
+                self.dirty |= dirty
+                self.deleted |= deleted
+            raise
+
+        lost = set()
+        for (url, game_obj, shoe), kept in zip(stored, written):
+            if not kept:
+                lost.add(url)
+            elif shoe:
+                with self._game_lock(url):
+                    # Unless the shoe was reshuffled since it was queued
+                    if game_obj.shoe is shoe:
+                        game_obj.shoe_dirty = False
+        for url in deleted:
+            with self.state_lock:
+                if url not in self.games:
+                    self.owned.discard(url)
+                    self.game_locks.pop(url, None)
+
+        pipe = r.pipeline(transaction=False)
+        for url in owned:
+            refresh_owner(keys=[OWNER_KEY_FORMAT.format(url)],
+                          args=[self.channel_name, OWNER_TTL_MS], client=pipe)
+        for url, kept in zip(owned, pipe.execute()):
+            if not kept:
+                lost.add(url)
+        for url in lost:
+            # Another worker took the game over, stop serving it
+            with self.state_lock:
+                self.owned.discard(url)
+                self.games.pop(url, None)
+
+
+_ACTOR = GameActor()
+
+
+def _get_redis_game_obj_json(url):
+    return _ACTOR.dispatch(url, 'snapshot')
+
+
+def _redis_add_player(player_consumer, url, creator_username, current_player):
+    num_players = _ACTOR.dispatch(url, 'add_player',
+                                  player_consumer.channel_name,
+                                  creator_username, current_player)
+    # Update Database
+    session_writer.update_num_players(url, num_players)
+    return num_players
+
+
+def _redis_remove_player(player_consumer, url):
+    num_players, player, game_obj = _ACTOR.dispatch(
+        url, 'remove_player', player_consumer.channel_name)
+    if num_players == 0:
+        session_writer.delete_game_session(url)
+    else:
+        session_writer.update_num_players(url, num_players)
+    return num_players, player, game_obj
+
+
+def _redis_start_game(url):
+    game_obj, _, update = _ACTOR.dispatch(url, 'start_game')
+    return game_obj, update
+
+
+def _redis_start_game_all_ready(url):
+    return tuple(_ACTOR.dispatch(url, 'start_game_all_ready'))
+
+
+def _redis_player_hit(url, idx, is_double=False):
+    return tuple(_ACTOR.dispatch(url, 'player_hit', idx, is_double))
+
+
+def _redis_next_turn(url):
+    return tuple(_ACTOR.dispatch(url, 'do_next_turn'))
+
+
+def _redis_dealer_final_turn(url):
+    game_obj, _, update = _ACTOR.dispatch(url, 'dealer_final_turn')
+    return game_obj, update
+
+
+def _redis_player_ready(url, idx, bet):
+    return tuple(_ACTOR.dispatch(url, 'player_ready', idx, bet))
+
+
+def _redis_check_initial_blackjack(url):
+    game_obj, _, update = _ACTOR.dispatch(url, 'check_initial_blackjack')
+    return game_obj, update
+
+
+def _redis_start_round(url):
+    return tuple(_ACTOR.dispatch(url, 'start_round'))
+
+
+# asyncio counterparts of the helpers above, used by the async consumers
+
+async def _aget_redis_game_obj_json(url):
+    return await _ACTOR.adispatch(url, 'snapshot')
+
+
+async def _aredis_add_player(player_consumer, url, creator_username,
+                             current_player):
+    num_players = await _ACTOR.adispatch(url, 'add_player',
+                                         player_consumer.channel_name,
+                                         creator_username, current_player)
+    # Update Database
+    await session_writer.aupdate_num_players(url, num_players)
+    return num_players
+
+
+async def _aredis_remove_player(player_consumer, url):
+    num_players, player, game_obj = await _ACTOR.adispatch(
+        url, 'remove_player', player_consumer.channel_name)
+    if num_players == 0:
+        await session_writer.adelete_game_session(url)
+    else:
+        await session_writer.aupdate_num_players(url, num_players)
+    return num_players, player, game_obj
+
+
+async def _aredis_start_game(url):
+    game_obj, _, update = await _ACTOR.adispatch(url, 'start_game')
+    return game_obj, update
+
+
+async def _aredis_start_game_all_ready(url):
+    return tuple(await _ACTOR.adispatch(url, 'start_game_all_ready'))
+
+
+async def _aredis_player_hit(url, idx, is_double=False):
+    return tuple(await _ACTOR.adispatch(url, 'player_hit', idx, is_double))
+
+
+async def _aredis_next_turn(url):
+    return tuple(await _ACTOR.adispatch(url, 'do_next_turn'))
+
+
+async def _aredis_dealer_final_turn(url):
+    game_obj, _, update = await _ACTOR.adispatch(url, 'dealer_final_turn')
+    return game_obj, update
+
+
+async def _aredis_player_ready(url, idx, bet):
+    return tuple(await _ACTOR.adispatch(url, 'player_ready', idx, bet))
+
+
+async def _aredis_check_initial_blackjack(url):
+    game_obj, _, update = await _ACTOR.adispatch(
+        url, 'check_initial_blackjack')
+    return game_obj, update
+
+
+async def _aredis_start_round(url):
+    return tuple(await _ACTOR.adispatch(url, 'start_round'))
@@ -0,0 +1,108 @@
+"""
+Redis cached lookups for the websocket handshake.
+
+Opening a socket used to load the session and the user from MySQL, and
+the game room also looked up the game creator. The creator of a game is
+cached when the game is created and dropped when the game session is
+deleted. The user of a session is cached for user_ttl seconds under a hash
+of the session key, and dropped on logout. A miss falls back to the
+database and fills the cache.
+"""
+
+from channels.auth import AuthMiddleware, get_user
+from channels.db import database_sync_to_async
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model, user_logged_out
+from django.contrib.auth.models import AnonymousUser
+from django.dispatch import receiver
+from .models import GameSession
+from . import live_games
+import hashlib
+import json
+
+HANDSHAKE_CACHE_CONFIG = getattr(settings, 'HANDSHAKE_CACHE_CONFIG', {})
+GAME_TTL = HANDSHAKE_CACHE_CONFIG.get('game_ttl', 86400)
+USER_TTL = HANDSHAKE_CACHE_CONFIG.get('user_ttl', 300)
+
+GAME_CREATOR_KEY_FORMAT = "CREATOR:{}:CREATOR"
+SESSION_USER_KEY_FORMAT = "WS_USER:{}:WS_USER"
+
+
+def _session_user_key(session_key):
+    # Raw session keys are credentials, keep them out of Redis
+    return SESSION_USER_KEY_FORMAT.format(
+        hashlib.sha256(session_key.encode('utf-8')).hexdigest())
+
+
+# Game creator
+
+def put_game_creator(url, creator):
+    live_games._get_redis_conn().set(
+        GAME_CREATOR_KEY_FORMAT.format(url), creator, ex=GAME_TTL)
+
+
+def queue_delete_game_creators(pipe, urls):
+    if urls:
+        pipe.delete(*[GAME_CREATOR_KEY_FORMAT.format(url) for url in urls])
+
+
+@database_sync_to_async
+def _get_db_game_creator(url):
+    game = GameSession.objects.select_related('creator').filter(
+        url=url).first()
+    return game.creator.username if game is not None else None
+
+
+async def aget_game_creator(url):
+    """Username of the creator of the game, None if there is no such game"""
+    r = live_games._get_async_redis_conn()
+    key = GAME_CREATOR_KEY_FORMAT.format(url)
+    creator = await r.get(key)
+    if creator is not None:
+        return creator.decode('utf-8')
+    creator = await _get_db_game_creator(url)
+    if creator is not None:
+        await r.set(key, creator, ex=GAME_TTL)
+    return creator
+
+
+# Session user
+
+async def aget_session_user(scope):
+    session_key = scope["session"].session_key
+    if not session_key:
+        return AnonymousUser()
+    r = live_games._get_async_redis_conn()
+    key = _session_user_key(session_key)
+    cached = await r.get(key)
+    if cached is not None:
+        # Only what the consumers use, the user is not loaded
+        cached = json.loads(cached)
+        return get_user_model()(pk=cached['id'],
+                                username=cached['username'])
+    user = await get_user(scope)
+    if not user.is_anonymous:
+        await r.set(key, json.dumps({
+            'id': user.pk,
+            'username': user.get_username(),
+        }), ex=USER_TTL)
+    return user
+
+
+@receiver(user_logged_out)
+def forget_session_user(sender, request, **kwargs):
+    session_key = request.session.session_key
+    if session_key:
+        live_games._get_redis_conn().delete(_session_user_key(session_key))
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    """AuthMiddleware reading the user of the session from the cache"""
+
+    async def resolve_scope(self, scope):
+        scope["user"]._wrapped = await aget_session_user(scope)
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
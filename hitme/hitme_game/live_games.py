@@ -1,455 +1,913 @@
-from .models import GameSession
-from math import ceil
-from django.conf import settings
-from enum import Enum
-import functools
-from typing import Dict, List, Optional
-from random import choice
-from redis import StrictRedis
-import pickle
-
-
-KEY_FORMAT = "GAME:{}:GAME"
-LOCK_FORMAT = "LOCK:{}:LOCK"
-MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
-
-SUITS = ["spades", "hearts", "clubs", "diams"]
-NUMBERS = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
-# BGCOLORS = {'D': 'red', 'C': 'black', 'H': 'red', 'S': 'black'}
-
-
-class Player(object):
-    def __init__(self, name, username):
-        self.name = name
-        self.index = -1
-        self.dollars = 100
-        self.current_bet = 0
-        self.win_loss = 0
-        self.username = username
-        self.in_game = False
-        self.current_hand = []
-        self.player_game_state = PlayerGameState.GAME_NOT_STARTED
-        self.player_game_outcome = PlayerGameOutcome.NA
-
-    def get_json_obj(self):
-        return {
-            "name": self.name,
-            "username": self.username,
-            "index": self.index,
-            "dollars": self.dollars,
-            "current_bet": self.current_bet,
-            "in_game": self.in_game,
-            "current_hand": self.current_hand,
-            "player_game_state": self.player_game_state.value,
-            "player_game_outcome": self.player_game_outcome.value,
-            "win_loss": self.win_loss,
-            "current_hand_value": functools.reduce(lambda x, y: x+y['value'],
-                                                   self.current_hand, 0)
-        }
-
-
-class GameObj(object):
-    def __init__(self, url, creator_username):
-        self.url = url
-        self.creator = creator_username
-        self.players_map: Dict[str, int] = {}
-        self.players_list: List[Optional[Player]] = [None]*MAX_PLAYERS_PER_GAME
-        self.game_state = GameState.NOT_STARTED
-        self.current_turn = -1
-        self.dealer_hand = []
-        self.dealer_blackjack = False
-
-    def get_json_obj(self):
-        obj = {}
-        obj['url'] = self.url
-        obj['players'] = {}
-        for idx in range(len(self.players_list)):
-            if self.players_list[idx] is not None:
-                obj['players'][idx] = self.players_list[idx].get_json_obj()
-        obj['game_state'] = self.game_state.value
-        obj['current_turn'] = self.current_turn
-        obj['dealer_hand'] = self.dealer_hand
-        obj['dealer_blackjack'] = self.dealer_blackjack
-        obj['dealer_hand_value'] = functools.reduce(lambda x, y: x+y['value'],
-                                                    self.dealer_hand, 0)
-        return obj
-
-    def start_game(self):
-        # update game state
-        self.game_state = GameState.AWAITING_READY
-        self.current_turn = -1
-
-        # Update Dealer hand
-        self.dealer_hand.clear()
-        self.dealer_blackjack = False
-
-        # Update all player objects
-        for p in self.players_list:
-            if p:
-                p.in_game = True
-                p.current_hand.clear()
-                p.player_game_state = PlayerGameState.AWAITING_READY
-                p.player_game_outcome = PlayerGameOutcome.NA
-                p.win_loss = 0
-                p.current_bet = 0
-
-    def start_game_all_ready(self):
-        if self.game_state == GameState.STARTED:
-            return False
-
-        self.game_state = GameState.STARTED
-        
-        # Deal initial cards to everyone
-        self.deal_initial_cards()
-
-        # #### To Delete #####
-        # c = choice([0,1,3, 4, 5, 6, 7 , 8 ,9, 10, 11, 12])
-        # if c == 0:
-        #     print("Making dealer blackjack")
-        #     self.dealer_hand[0]['value'] = 11
-        #     self.dealer_hand[0]['num'] = 'A'
-        #     self.dealer_hand[1]['value'] = 10
-        #     self.dealer_hand[1]['num'] = 'K'
-
-        # for p in self.players_list:
-        #     if p: 
-        #         c = choice([0])
-        #         if c == 0 and p.index == 0:
-        #             print("Making Blackjack")
-        #             p.current_hand[0]['value'] = 11
-        #             p.current_hand[0]['num'] = 'A'
-        #             p.current_hand[1]['value'] = 10
-        #             p.current_hand[1]['num'] = 'K'
-        # ####################
-
-        return True
-
-    def deal_initial_cards(self):
-        # Deal dealer cards
-        self.dealer_hand.append(deal_card())
-        self.dealer_hand.append(deal_card())
-
-        # Iterate over players and deal cards
-        for p in self.players_list:
-            if p and p.in_game:
-                p.player_game_state = PlayerGameState.GAME_STARTED
-                p.current_hand.append(deal_card())
-                p.current_hand.append(deal_card())
-
-    def do_next_turn(self):
-        self.current_turn = self.get_next_turn(self.current_turn)
-        return self.current_turn
-
-    def get_next_turn(self, prev_turn):
-        start = prev_turn + 1
-        while (start < len(self.players_list)):
-            if (self.players_list[start] and 
-                self.players_list[start].in_game and
-                self.players_list[start].player_game_state == PlayerGameState.GAME_STARTED):
-                return start
-            else:
-                start += 1
-        return start + 1000
-
-    def player_hit(self, idx, is_double=False):
-        player_obj = self.players_list[idx]
-        if player_obj is None:
-            print("player_hit:: player_obj is None")
-            return False
-        player_obj.current_hand.append(deal_card())
-        if is_double:
-            player_obj.dollars -= player_obj.current_bet
-            player_obj.current_bet *= 2
-        return True
-
-    def dealer_final_turn(self):
-        dealer_total = functools.reduce(lambda x, y: x+y['value'],
-                                        self.dealer_hand, 0)
-        while (dealer_total < 17):
-            card = deal_card()
-            dealer_total += card['value']
-            self.dealer_hand.append(card)
-        self.calculate_score()
-        self.game_state = GameState.NOT_STARTED
-
-    def player_ready(self, idx, bet):
-        player_obj = self.players_list[idx]
-        if player_obj is None:
-            print("player_ready:: player_obj is None")
-            return False
-        if player_obj.player_game_state == PlayerGameState.AWAITING_READY:
-            player_obj.current_bet = bet
-            player_obj.dollars -= bet
-            player_obj.player_game_state = PlayerGameState.READY
-            return True
-        return False
-
-    def check_initial_blackjack(self):
-        dealer_total = functools.reduce(lambda x, y: x+y['value'],
-                                        self.dealer_hand, 0)
-        if dealer_total == 21:
-            self.dealer_blackjack = True
-
-        # Iterate over players and check for blackjack
-        for p in self.players_list:
-            if p and p.player_game_state == PlayerGameState.GAME_STARTED:
-                player_total = functools.reduce(lambda x, y: x+y['value'],
-                                                p.current_hand, 0)
-                if player_total == 21:
-                    p.player_game_state = PlayerGameState.GAME_OVER_BLACKJACK
-
-        # Update next turn based on player blackjack
-        self.do_next_turn()
-
-        # if self.dealer_blackjack:
-        #     self.calculate_score()
-        #     self.game_state = GameState.NOT_STARTED
-
-    def calculate_score(self):
-        dealer_total = functools.reduce(lambda x, y: x+y['value'],
-                                        self.dealer_hand, 0)
-        # Iterate over players and calculate winnings/losings
-        for p in self.players_list:
-            if not p or p.in_game == False:
-                continue
-            player_total = functools.reduce(lambda x, y: x+y['value'],
-                                                p.current_hand, 0)
-            # player busted , so player lose
-            if player_total > 21:
-                p.player_game_outcome = PlayerGameOutcome.LOSS
-                p.win_loss = p.current_bet
-
-            # Player Blackjack
-            elif p.player_game_state == PlayerGameState.GAME_OVER_BLACKJACK:
-                if self.dealer_blackjack == True:
-                    p.player_game_outcome = PlayerGameOutcome.PUSH
-                    p.win_loss = 0
-                else:
-                    p.player_game_outcome = PlayerGameOutcome.WIN
-                    p.win_loss = ceil(1.5 * p.current_bet)
-
-            # Player Stay
-            else:
-                if self.dealer_blackjack == True:
-                    p.player_game_outcome = PlayerGameOutcome.LOSS
-                    p.win_loss = p.current_bet
-                elif dealer_total > 21:
-                    p.player_game_outcome = PlayerGameOutcome.WIN
-                    p.win_loss = p.current_bet
-                elif player_total > dealer_total:
-                    p.player_game_outcome = PlayerGameOutcome.WIN
-                    p.win_loss = p.current_bet
-                elif player_total < dealer_total:
-                    p.player_game_outcome = PlayerGameOutcome.LOSS
-                    p.win_loss = p.current_bet
-                else:
-                    p.player_game_outcome = PlayerGameOutcome.PUSH
-                    p.win_loss = 0
-
-            p.dollars += p.current_bet
-            p.current_bet = 0
-            if p.player_game_outcome == PlayerGameOutcome.WIN:
-                p.dollars += p.win_loss
-            elif p.player_game_outcome == PlayerGameOutcome.LOSS:
-                p.dollars -= p.win_loss
-
-
-def deal_card():
-    card = {}
-    card['suit'] = choice(SUITS)
-    card['num'] = choice(NUMBERS)
-    #card['bg'] = BGCOLORS[card['suit']]
-
-    def get_value(num):
-        try:
-            val = int(num)
-            return val
-        except ValueError:
-            if num == 'A':
-                return 11
-            else:
-                return 10
-
-    card['value'] = get_value(card['num'])
-    return card
-
-
-class GameState(Enum):
-    NOT_STARTED = "not-started"
-    AWAITING_READY = "awaiting-ready"
-    STARTED = "started"
-
-
-class PlayerGameState(Enum):
-    GAME_NOT_STARTED = "game-not-started"
-    AWAITING_READY = "awaiting-ready"
-    READY = "ready"
-    GAME_STARTED = "game-started"
-    GAME_OVER_BLACKJACK = "game-over-blackjack"
-    
-class PlayerGameOutcome(Enum):
-    NA = "na"
-    WIN = "win"
-    LOSS = "loss"
-    PUSH = "push"
-
-
-def _get_redis_conn():
-    redis_configs = getattr(settings, 'LIVE_GAMES_REDIS_CONFIG', {})
-    return StrictRedis(host=redis_configs.get('host', 'localhost'),
-                       port=redis_configs.get('port', 6379),
-                       db=redis_configs.get('db', 0))
-
-
-def _get_redis_game_obj_json(url):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-
-    with r.lock(lock_key):
-        if r.exists(key):
-            ret_obj = pickle.loads(r.get(key)).get_json_obj()
-        else:
-            ret_obj = None
-    return ret_obj
-
-
-def _redis_add_player(player_consumer, url, creator_username, current_player):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-
-    with r.lock(lock_key):
-        if r.exists(key):
-            game_obj = pickle.loads(r.get(key))
-        else:
-            game_obj = GameObj(url=url, creator_username=creator_username)
-
-        player = _add_to_game_obj(
-            player_consumer.channel_name, game_obj, current_player)
-        r.set(key, pickle.dumps(game_obj))
-
-    num_players = len(game_obj.players_map)
-
-    # Update Database
-    GameSession.objects.update_num_players(url, num_players)
-    return num_players
-
-
-def _redis_remove_player(player_consumer, url):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        player = _remove_from_game_obj(player_consumer.channel_name, game_obj)
-        num_players = len(game_obj.players_map)
-        if num_players == 0:
-            r.delete(key)
-        else:
-            r.set(key, pickle.dumps(game_obj))
-
-    if num_players == 0:
-        GameSession.objects.delete_game_session(url)
-    else:
-        GameSession.objects.update_num_players(url, num_players)
-    return num_players, player
-
-
-def _redis_start_game(url):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        game_obj.start_game()
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url)
-
-
-def _redis_start_game_all_ready(url):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        status = game_obj.start_game_all_ready()
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url), status
-
-
-def _redis_player_hit(url, idx, is_double=False):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        status = game_obj.player_hit(idx, is_double)
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url), status
-
-
-def _redis_next_turn(url):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        next_turn = game_obj.do_next_turn()
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url), next_turn
-
-
-def _redis_dealer_final_turn(url):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        game_obj.dealer_final_turn()
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url)
-
-
-def _redis_player_ready(url, idx, bet):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        status = game_obj.player_ready(idx, bet)
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url), status
-
-
-def _redis_check_initial_blackjack(url,):
-    r = _get_redis_conn()
-    key = KEY_FORMAT.format(url)
-    lock_key = LOCK_FORMAT.format(url)
-    with r.lock(lock_key):
-        game_obj = pickle.loads(r.get(key))
-        game_obj.check_initial_blackjack()
-        r.set(key, pickle.dumps(game_obj))
-    return _get_redis_game_obj_json(url)
-
-
-def _add_to_game_obj(player_name, game_obj, current_player):
-    if None in game_obj.players_list:
-        idx = game_obj.players_list.index(None)
-        player = Player(player_name, current_player)
-        player.index = idx
-        game_obj.players_list[idx] = player
-        game_obj.players_map[player_name] = idx
-        return player
-    return None
-
-
-def _remove_from_game_obj(player_name, game_obj):
-    if player_name in game_obj.players_map:
-        idx = game_obj.players_map[player_name]
-        player = game_obj.players_list[idx]
-        game_obj.players_list[idx] = None
-        game_obj.players_map.pop(player_name, None)
-        return player
-    return None
+from math import ceil
+from django.conf import settings
+from enum import Enum
+from array import array
+from operator import attrgetter
+from typing import Dict, List, Optional
+from random import Random, getrandbits
+from redis import BlockingConnectionPool, StrictRedis
+from redis import asyncio as aioredis
+from . import codec, delta, metrics, profiling, session_writer
+from .snapshot_cache import INVALIDATE_CHANNEL, SnapshotCache
+import logging
+
+log = logging.getLogger('hitme_game.games')
+
+
+KEY_FORMAT = "GAME:{}:GAME"
+SHOE_KEY_FORMAT = "SHOE:{}:SHOE"
+LOCK_FORMAT = "LOCK:{}:LOCK"
+VERSION_KEY_FORMAT = "VERSION:{}:VERSION"
+MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
+
+# Shoe: number of decks, fraction dealt before the cut card forces a
+# reshuffle, and an optional fixed seed for deterministic replay
+SHOE_NUM_DECKS = getattr(settings, 'SHOE_NUM_DECKS', 6)
+SHOE_PENETRATION = getattr(settings, 'SHOE_PENETRATION', 0.75)
+SHOE_SEED = getattr(settings, 'SHOE_SEED', None)
+SHOE_SEED_BITS = 63
+
+SUITS = ["spades", "hearts", "clubs", "diams"]
+NUMBERS = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
+NUMBER_VALUES = [11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10]
+# BGCOLORS = {'D': 'red', 'C': 'black', 'H': 'red', 'S': 'black'}
+
+# A card is one small int: suit index * len(NUMBERS) + number index.
+# Everything about a card is a table lookup, the dict form is only used
+# when building JSON for clients.
+DECK_SIZE = len(SUITS) * len(NUMBERS)
+CARD_SUITS = [suit for suit in SUITS for num in NUMBERS]
+CARD_NUMBERS = [num for suit in SUITS for num in NUMBERS]
+CARD_VALUES = [value for suit in SUITS for value in NUMBER_VALUES]
+# Aces count 1 in the hard total, one of them may add 10 more (soft hand)
+CARD_HARD_VALUES = [1 if num == 'A' else value for num, value in
+                    zip(CARD_NUMBERS, CARD_VALUES)]
+CARD_ACES = [1 if num == 'A' else 0 for num in CARD_NUMBERS]
+CARD_JSON = [{'suit': CARD_SUITS[c], 'num': CARD_NUMBERS[c],
+              'value': CARD_VALUES[c]} for c in range(DECK_SIZE)]
+HAND_TYPECODE = 'B'
+
+
+class Player(object):
+    __slots__ = ('name', 'index', 'dollars', 'current_bet', 'win_loss',
+                 'username', 'in_game', 'current_hand', 'hand_hard_total',
+                 'hand_aces', 'player_game_state', 'player_game_outcome')
+
+    def __init__(self, name, username):
+        self.name = name
+        self.index = -1
+        self.dollars = 100
+        self.current_bet = 0
+        self.win_loss = 0
+        self.username = username
+        self.in_game = False
+        self.current_hand = new_hand()
+        self.hand_hard_total = 0
+        self.hand_aces = 0
+        self.player_game_state = PlayerGameState.GAME_NOT_STARTED
+        self.player_game_outcome = PlayerGameOutcome.NA
+
+    def __getstate__(self):
+        return _PLAYER_STATE(self)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before Player used __slots__
+            state = tuple(state.get(attr) for attr in Player.__slots__)
+        for attr, value in zip(Player.__slots__, state):
+            setattr(self, attr, value)
+
+    def __copy__(self):
+        player = Player.__new__(Player)
+        player.__setstate__(self.__getstate__())
+        return player
+
+    def __deepcopy__(self, memo):
+        player = self.__copy__()
+        player.current_hand = array(HAND_TYPECODE, self.current_hand)
+        return player
+
+    @property
+    def current_hand_value(self):
+        return best_total(self.hand_hard_total, self.hand_aces)
+
+    @property
+    def current_hand_soft(self):
+        return is_soft_total(self.hand_hard_total, self.hand_aces)
+
+    def add_card(self, card):
+        self.current_hand.append(card)
+        self.hand_hard_total += CARD_HARD_VALUES[card]
+        self.hand_aces += CARD_ACES[card]
+
+    def clear_hand(self):
+        del self.current_hand[:]
+        self.hand_hard_total = 0
+        self.hand_aces = 0
+
+    def get_json_obj(self):
+        return {
+            "name": self.name,
+            "username": self.username,
+            "index": self.index,
+            "dollars": self.dollars,
+            "current_bet": self.current_bet,
+            "in_game": self.in_game,
+            "current_hand": hand_json(self.current_hand),
+            "player_game_state": self.player_game_state.value,
+            "player_game_outcome": self.player_game_outcome.value,
+            "win_loss": self.win_loss,
+            "current_hand_value": self.current_hand_value,
+            "current_hand_soft": self.current_hand_soft
+        }
+
+
+_PLAYER_STATE = attrgetter(*Player.__slots__)
+
+
+class GameObj(object):
+    __slots__ = ('url', 'creator', 'players_map', 'players_list',
+                 'game_state', 'current_turn', 'dealer_hand',
+                 'dealer_hard_total', 'dealer_aces', 'dealer_blackjack',
+                 'shoe', 'shoe_pos', 'shoe_cut', 'shoe_seed', 'shoe_dirty',
+                 'version')
+
+    def __init__(self, url, creator_username):
+        self.url = url
+        self.creator = creator_username
+        self.players_map: Dict[str, int] = {}
+        self.players_list: List[Optional[Player]] = [None]*MAX_PLAYERS_PER_GAME
+        self.game_state = GameState.NOT_STARTED
+        self.current_turn = -1
+        self.dealer_hand = new_hand()
+        self.dealer_hard_total = 0
+        self.dealer_aces = 0
+        self.dealer_blackjack = False
+        # Shuffled lazily on the first round, shoe_seed seeds the next shuffle
+        self.shoe = b''
+        self.shoe_pos = 0
+        self.shoe_cut = 0
+        self.shoe_seed = initial_shoe_seed()
+        self.shoe_dirty = False
+        # Bumped by every game transition, clients patch from one to the next
+        self.version = 0
+
+    def __getstate__(self):
+        return _GAMEOBJ_STATE(self)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before GameObj used __slots__
+            state = tuple(state.get(attr) for attr in GameObj.__slots__)
+        for attr, value in zip(GameObj.__slots__, state):
+            setattr(self, attr, value)
+
+    def __copy__(self):
+        game_obj = GameObj.__new__(GameObj)
+        game_obj.__setstate__(self.__getstate__())
+        return game_obj
+
+    def __deepcopy__(self, memo):
+        game_obj = self.__copy__()
+        game_obj.players_map = dict(self.players_map)
+        game_obj.players_list = [p.__deepcopy__(memo) if p else None
+                                 for p in self.players_list]
+        game_obj.dealer_hand = array(HAND_TYPECODE, self.dealer_hand)
+        return game_obj
+
+    @property
+    def dealer_hand_value(self):
+        return best_total(self.dealer_hard_total, self.dealer_aces)
+
+    @property
+    def dealer_hand_soft(self):
+        return is_soft_total(self.dealer_hard_total, self.dealer_aces)
+
+    def add_dealer_card(self, card):
+        self.dealer_hand.append(card)
+        self.dealer_hard_total += CARD_HARD_VALUES[card]
+        self.dealer_aces += CARD_ACES[card]
+
+    def clear_dealer_hand(self):
+        del self.dealer_hand[:]
+        self.dealer_hard_total = 0
+        self.dealer_aces = 0
+
+    def shuffle_shoe(self):
+        self.shoe, self.shoe_seed = shuffle_shoe(SHOE_NUM_DECKS,
+                                                 self.shoe_seed)
+        self.shoe_pos = 0
+        self.shoe_cut = int(len(self.shoe) * SHOE_PENETRATION)
+        self.shoe_dirty = True
+
+    def draw_card(self):
+        # Only runs dry mid-round if penetration is set close to 1
+        if self.shoe_pos >= len(self.shoe):
+            self.shuffle_shoe()
+        card = self.shoe[self.shoe_pos]
+        self.shoe_pos += 1
+        return card
+
+    def get_json_obj(self):
+        obj = {}
+        obj['url'] = self.url
+        obj['players'] = {}
+        for idx in range(len(self.players_list)):
+            if self.players_list[idx] is not None:
+                obj['players'][idx] = self.players_list[idx].get_json_obj()
+        obj['game_state'] = self.game_state.value
+        obj['current_turn'] = self.current_turn
+        obj['dealer_hand'] = hand_json(self.dealer_hand)
+        obj['dealer_blackjack'] = self.dealer_blackjack
+        obj['dealer_hand_value'] = self.dealer_hand_value
+        obj['dealer_hand_soft'] = self.dealer_hand_soft
+        obj['version'] = self.version
+        return obj
+
+    def start_game(self):
+        # update game state
+        self.game_state = GameState.AWAITING_READY
+        self.current_turn = -1
+
+        # Update Dealer hand
+        self.clear_dealer_hand()
+        self.dealer_blackjack = False
+
+        # Reshuffle only between rounds, once the cut card came out
+        if self.shoe_pos >= self.shoe_cut:
+            self.shuffle_shoe()
+
+        # Update all player objects
+        for p in self.players_list:
+            if p:
+                p.in_game = True
+                p.clear_hand()
+                p.player_game_state = PlayerGameState.AWAITING_READY
+                p.player_game_outcome = PlayerGameOutcome.NA
+                p.win_loss = 0
+                p.current_bet = 0
+
+    def start_game_all_ready(self):
+        if self.game_state == GameState.STARTED:
+            return False
+
+        self.game_state = GameState.STARTED
+        
+        # Deal initial cards to everyone
+        self.deal_initial_cards()
+
+        # #### To Delete #####
+        # c = choice([0,1,3, 4, 5, 6, 7 , 8 ,9, 10, 11, 12])
+        # if c == 0:
+        #     print("Making dealer blackjack")
+        #     self.dealer_hand[0]['value'] = 11
+        #     self.dealer_hand[0]['num'] = 'A'
+        #     self.dealer_hand[1]['value'] = 10
+        #     self.dealer_hand[1]['num'] = 'K'
+
+        # for p in self.players_list:
+        #     if p: 
+        #         c = choice([0])
+        #         if c == 0 and p.index == 0:
+        #             print("Making Blackjack")
+        #             p.current_hand[0]['value'] = 11
+        #             p.current_hand[0]['num'] = 'A'
+        #             p.current_hand[1]['value'] = 10
+        #             p.current_hand[1]['num'] = 'K'
+        # ####################
+
+        return True
+
+    def deal_initial_cards(self):
+        # Deal dealer cards
+        self.add_dealer_card(self.draw_card())
+        self.add_dealer_card(self.draw_card())
+
+        # Iterate over players and deal cards
+        for p in self.players_list:
+            if p and p.in_game:
+                p.player_game_state = PlayerGameState.GAME_STARTED
+                p.add_card(self.draw_card())
+                p.add_card(self.draw_card())
+
+    def do_next_turn(self):
+        self.current_turn = self.get_next_turn(self.current_turn)
+        return self.current_turn
+
+    def get_next_turn(self, prev_turn):
+        start = prev_turn + 1
+        while (start < len(self.players_list)):
+            if (self.players_list[start] and 
+                self.players_list[start].in_game and
+                self.players_list[start].player_game_state == PlayerGameState.GAME_STARTED):
+                return start
+            else:
+                start += 1
+        return start + 1000
+
+    def player_hit(self, idx, is_double=False):
+        player_obj = self.players_list[idx]
+        if player_obj is None:
+            log.warning("player_hit: no player", extra={'data': {
+                'game': self.url, 'idx': idx}})
+            return False
+        player_obj.add_card(self.draw_card())
+        if is_double:
+            player_obj.dollars -= player_obj.current_bet
+            player_obj.current_bet *= 2
+        return True
+
+    def dealer_final_turn(self):
+        while (self.dealer_hand_value < 17):
+            self.add_dealer_card(self.draw_card())
+        self.calculate_score()
+        self.game_state = GameState.NOT_STARTED
+
+    def player_ready(self, idx, bet):
+        player_obj = self.players_list[idx]
+        if player_obj is None:
+            log.warning("player_ready: no player", extra={'data': {
+                'game': self.url, 'idx': idx}})
+            return False
+        if player_obj.player_game_state == PlayerGameState.AWAITING_READY:
+            player_obj.current_bet = bet
+            player_obj.dollars -= bet
+            player_obj.player_game_state = PlayerGameState.READY
+            return True
+        return False
+
+    def check_initial_blackjack(self):
+        if self.dealer_hand_value == 21:
+            self.dealer_blackjack = True
+
+        # Iterate over players and check for blackjack
+        for p in self.players_list:
+            if p and p.player_game_state == PlayerGameState.GAME_STARTED:
+                if p.current_hand_value == 21:
+                    p.player_game_state = PlayerGameState.GAME_OVER_BLACKJACK
+
+        # Update next turn based on player blackjack
+        self.do_next_turn()
+
+        # if self.dealer_blackjack:
+        #     self.calculate_score()
+        #     self.game_state = GameState.NOT_STARTED
+
+    def calculate_score(self):
+        dealer_total = self.dealer_hand_value
+        # Iterate over players and calculate winnings/losings
+        for p in self.players_list:
+            if not p or p.in_game == False:
+                continue
+            player_total = p.current_hand_value
+            # player busted , so player lose
+            if player_total > 21:
+                p.player_game_outcome = PlayerGameOutcome.LOSS
+                p.win_loss = p.current_bet
+
+            # Player Blackjack
+            elif p.player_game_state == PlayerGameState.GAME_OVER_BLACKJACK:
+                if self.dealer_blackjack == True:
+                    p.player_game_outcome = PlayerGameOutcome.PUSH
+                    p.win_loss = 0
+                else:
+                    p.player_game_outcome = PlayerGameOutcome.WIN
+                    p.win_loss = ceil(1.5 * p.current_bet)
+
+            # Player Stay
+            else:
+                if self.dealer_blackjack == True:
+                    p.player_game_outcome = PlayerGameOutcome.LOSS
+                    p.win_loss = p.current_bet
+                elif dealer_total > 21:
+                    p.player_game_outcome = PlayerGameOutcome.WIN
+                    p.win_loss = p.current_bet
+                elif player_total > dealer_total:
+                    p.player_game_outcome = PlayerGameOutcome.WIN
+                    p.win_loss = p.current_bet
+                elif player_total < dealer_total:
+                    p.player_game_outcome = PlayerGameOutcome.LOSS
+                    p.win_loss = p.current_bet
+                else:
+                    p.player_game_outcome = PlayerGameOutcome.PUSH
+                    p.win_loss = 0
+
+            p.dollars += p.current_bet
+            p.current_bet = 0
+            if p.player_game_outcome == PlayerGameOutcome.WIN:
+                p.dollars += p.win_loss
+            elif p.player_game_outcome == PlayerGameOutcome.LOSS:
+                p.dollars -= p.win_loss
+
+
+_GAMEOBJ_STATE = attrgetter(*GameObj.__slots__)
+
+
+def initial_shoe_seed():
+    if SHOE_SEED is not None:
+        return SHOE_SEED & ((1 << SHOE_SEED_BITS) - 1)
+    return getrandbits(SHOE_SEED_BITS)
+
+
+def shuffle_shoe(num_decks, seed):
+    """
+    Fisher-Yates shuffle num_decks decks into a byte buffer, one card per
+    byte. Returns the buffer and the seed for the following shoe, so a
+    game's whole sequence of shoes replays from its first seed.
+    """
+    rng = Random(seed)
+    shoe = bytearray(range(DECK_SIZE)) * num_decks
+    for i in range(len(shoe) - 1, 0, -1):
+        j = rng.randrange(i + 1)
+        shoe[i], shoe[j] = shoe[j], shoe[i]
+    return bytes(shoe), rng.getrandbits(SHOE_SEED_BITS)
+
+
+def new_hand():
+    return array(HAND_TYPECODE)
+
+
+def hand_totals(hand):
+    # Full scan, only needed when a hand is rebuilt outside add_card
+    return (sum(map(CARD_HARD_VALUES.__getitem__, hand)),
+            sum(map(CARD_ACES.__getitem__, hand)))
+
+
+def best_total(hard_total, aces):
+    if aces and hard_total + 10 <= 21:
+        return hard_total + 10
+    return hard_total
+
+
+def is_soft_total(hard_total, aces):
+    return bool(aces) and hard_total + 10 <= 21
+
+
+def hand_json(hand):
+    return [CARD_JSON[c] for c in hand]
+
+
+def start_round(game_obj):
+    """
+    Deal, check initial blackjacks and play the dealer if nobody is left
+    to play, as one transition with an update per step. Nothing happens if
+    the round was already dealt.
+    """
+    game_json, status, dealt = delta.apply_transition(
+        game_obj, GameObj.start_game_all_ready)
+    if not status:
+        return game_json, status, []
+    game_json, _, checked = delta.apply_transition(
+        game_obj, GameObj.check_initial_blackjack)
+    updates = [dealt, checked]
+    if (game_obj.dealer_blackjack or
+            game_obj.current_turn >= MAX_PLAYERS_PER_GAME):
+        game_json, _, played = delta.apply_transition(
+            game_obj, GameObj.dealer_final_turn)
+        updates.append(played)
+    return game_json, status, updates
+
+
+class GameState(Enum):
+    NOT_STARTED = "not-started"
+    AWAITING_READY = "awaiting-ready"
+    STARTED = "started"
+
+
+class PlayerGameState(Enum):
+    GAME_NOT_STARTED = "game-not-started"
+    AWAITING_READY = "awaiting-ready"
+    READY = "ready"
+    GAME_STARTED = "game-started"
+    GAME_OVER_BLACKJACK = "game-over-blackjack"
+    
+class PlayerGameOutcome(Enum):
+    NA = "na"
+    WIN = "win"
+    LOSS = "loss"
+    PUSH = "push"
+
+
+_REDIS_POOL = None
+_ASYNC_REDIS_POOL = None
+
+# Snapshots served to readers without taking the game lock, 0 disables it
+_SNAPSHOT_CACHE = SnapshotCache(getattr(settings, 'LIVE_GAMES_CACHE_SIZE',
+                                        1024))
+
+# Deleted games keep their version counter for a while so a reader never
+# caches a recreated game under a version it has already seen
+DELETED_VERSION_TTL_MS = 24 * 60 * 60 * 1000
+
+# Bump the game version and announce it to every process' snapshot cache
+LUA_BUMP_VERSION = """
+local version = redis.call('INCR', KEYS[1])
+if tonumber(ARGV[3]) > 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+else
+    redis.call('PERSIST', KEYS[1])
+end
+redis.call('PUBLISH', ARGV[1], ARGV[2] .. ':' .. version)
+return version
+"""
+
+
+def _redis_pool_kwargs():
+    redis_configs = getattr(settings, 'LIVE_GAMES_REDIS_CONFIG', {})
+    return dict(
+        host=redis_configs.get('host', 'localhost'),
+        port=redis_configs.get('port', 6379),
+        db=redis_configs.get('db', 0),
+        max_connections=redis_configs.get('max_connections', 50),
+        timeout=redis_configs.get('pool_timeout', 20),
+        socket_timeout=redis_configs.get('socket_timeout', 5),
+        socket_connect_timeout=redis_configs.get(
+            'socket_connect_timeout', 5),
+        health_check_interval=redis_configs.get(
+            'health_check_interval', 30))
+
+
+def _get_redis_pool():
+    """Process wide connection pool shared by all live game helpers"""
+    global _REDIS_POOL
+    if _REDIS_POOL is None:
+        _REDIS_POOL = BlockingConnectionPool(**_redis_pool_kwargs())
+    return _REDIS_POOL
+
+
+def _get_async_redis_pool():
+    """Same for the asyncio helpers, bound to the server's event loop"""
+    global _ASYNC_REDIS_POOL
+    if _ASYNC_REDIS_POOL is None:
+        _ASYNC_REDIS_POOL = aioredis.BlockingConnectionPool(
+            **_redis_pool_kwargs())
+    return _ASYNC_REDIS_POOL
+
+
+def _get_redis_conn():
+    r = StrictRedis(connection_pool=_get_redis_pool())
+    _SNAPSHOT_CACHE.start(_get_redis_conn)
+    return r
+
+
+def _get_async_redis_conn():
+    _SNAPSHOT_CACHE.start(_get_redis_conn)
+    return aioredis.StrictRedis(connection_pool=_get_async_redis_pool())
+
+
+def _get_game_lock(r, url, op='other'):
+    # op names the helper in the lock wait and hold metrics
+    redis_configs = getattr(settings, 'LIVE_GAMES_REDIS_CONFIG', {})
+    return metrics.TimedLock(
+        r.lock(LOCK_FORMAT.format(url),
+               timeout=redis_configs.get('lock_timeout', None),
+               blocking_timeout=redis_configs.get(
+                   'lock_blocking_timeout', None)), op)
+
+
+def _decode_game(data, shoe=None):
+    with metrics.CODEC_SECONDS.time('decode'):
+        return codec.decode_game(data, shoe)
+
+
+def _load_game_obj(r, url):
+    # Game and shoe in one MGET, a missing game comes back as None
+    with metrics.REDIS_SECONDS.time('load'):
+        data, shoe = r.mget(KEY_FORMAT.format(url),
+                            SHOE_KEY_FORMAT.format(url))
+    if data is None:
+        return None
+    return _decode_game(data, shoe)
+
+
+async def _aload_game_obj(r, url):
+    with metrics.REDIS_SECONDS.time('load'):
+        data, shoe = await r.mget(KEY_FORMAT.format(url),
+                                  SHOE_KEY_FORMAT.format(url))
+    if data is None:
+        return None
+    return _decode_game(data, shoe)
+
+
+def _encode_game_obj(game_obj):
+    with metrics.CODEC_SECONDS.time('encode'):
+        data = codec.encode_game(game_obj)
+    metrics.GAME_BYTES.observe(len(data))
+    return data
+
+
+def _store_game_obj(pipe, url, game_obj):
+    pipe.set(KEY_FORMAT.format(url), _encode_game_obj(game_obj))
+    # The shoe buffer only changes when it is reshuffled
+    if game_obj.shoe_dirty:
+        pipe.set(SHOE_KEY_FORMAT.format(url), game_obj.shoe)
+        game_obj.shoe_dirty = False
+
+
+def _delete_game_obj(pipe, url):
+    pipe.delete(KEY_FORMAT.format(url), SHOE_KEY_FORMAT.format(url))
+
+
+def _queue_write(pipe, url, game_obj):
+    """
+    Queue the store (or delete when game_obj is None) and the version bump,
+    the new version is the last result of the pipeline.
+    """
+    if game_obj is None:
+        _delete_game_obj(pipe, url)
+    else:
+        _store_game_obj(pipe, url, game_obj)
+    # Plain EVAL so the same call works on sync and asyncio pipelines
+    pipe.eval(LUA_BUMP_VERSION, 1, VERSION_KEY_FORMAT.format(url),
+              INVALIDATE_CHANNEL, url,
+              DELETED_VERSION_TTL_MS if game_obj is None else 0)
+
+
+def _cache_written(url, game_obj, game_json, version, token):
+    if game_obj is None:
+        return None
+    if game_json is None:
+        game_json = game_obj.get_json_obj()
+    _SNAPSHOT_CACHE.put(url, version, game_json, token)
+    return game_json
+
+
+def _write_game_obj(r, url, game_obj, game_json=None):
+    """
+    Store (or delete when game_obj is None) and refresh local cache,
+    game_json is the snapshot of game_obj if the caller already built it.
+    """
+    token = _SNAPSHOT_CACHE.token()
+    pipe = r.pipeline(transaction=False)
+    _queue_write(pipe, url, game_obj)
+    with metrics.REDIS_SECONDS.time('write'):
+        version = pipe.execute()[-1]
+    return _cache_written(url, game_obj, game_json, version, token)
+
+
+async def _awrite_game_obj(r, url, game_obj, game_json=None):
+    token = _SNAPSHOT_CACHE.token()
+    pipe = r.pipeline(transaction=False)
+    _queue_write(pipe, url, game_obj)
+    with metrics.REDIS_SECONDS.time('write'):
+        version = (await pipe.execute())[-1]
+    return _cache_written(url, game_obj, game_json, version, token)
+
+
+def _queue_snapshot_read(pipe, url):
+    # Writers replace the value in one SET, so a plain read is consistent
+    # without the lock, the version is read in the same transaction
+    pipe.get(KEY_FORMAT.format(url))
+    pipe.get(VERSION_KEY_FORMAT.format(url))
+
+
+def _cache_snapshot(url, data, version, token):
+    if data is None:
+        return None
+    game_json = _decode_game(data).get_json_obj()
+    _SNAPSHOT_CACHE.put(url, int(version or 0), game_json, token)
+    return game_json
+
+
+def _get_redis_game_obj_json(url):
+    game_json = _SNAPSHOT_CACHE.get(url)
+    if game_json is not None:
+        return game_json
+
+    r = _get_redis_conn()
+    token = _SNAPSHOT_CACHE.token()
+    pipe = r.pipeline(transaction=True)
+    _queue_snapshot_read(pipe, url)
+    with metrics.REDIS_SECONDS.time('snapshot'):
+        data, version = pipe.execute()
+    return _cache_snapshot(url, data, version, token)
+
+
+async def _aget_redis_game_obj_json(url):
+    game_json = _SNAPSHOT_CACHE.get(url)
+    if game_json is not None:
+        return game_json
+
+    r = _get_async_redis_conn()
+    token = _SNAPSHOT_CACHE.token()
+    pipe = r.pipeline(transaction=True)
+    _queue_snapshot_read(pipe, url)
+    with metrics.REDIS_SECONDS.time('snapshot'):
+        data, version = await pipe.execute()
+    return _cache_snapshot(url, data, version, token)
+
+
+def _redis_add_player(player_consumer, url, creator_username, current_player):
+    r = _get_redis_conn()
+
+    with _get_game_lock(r, url, 'add_player'):
+        game_obj = _load_game_obj(r, url)
+        if game_obj is None:
+            game_obj = GameObj(url=url, creator_username=creator_username)
+
+        player = _add_to_game_obj(
+            player_consumer.channel_name, game_obj, current_player)
+        _write_game_obj(r, url, game_obj)
+
+    num_players = len(game_obj.players_map)
+
+    # Update Database
+    session_writer.update_num_players(url, num_players)
+    return num_players
+
+
+def _redis_remove_player(player_consumer, url):
+    r = _get_redis_conn()
+
+    with _get_game_lock(r, url, 'remove_player'):
+        game_obj = _load_game_obj(r, url)
+        player = _remove_from_game_obj(player_consumer.channel_name, game_obj)
+        num_players = len(game_obj.players_map)
+        game_json = _write_game_obj(
+            r, url, game_obj if num_players > 0 else None)
+
+    player = player.get_json_obj() if player is not None else None
+    if num_players == 0:
+        session_writer.delete_game_session(url)
+        return num_players, player, None
+    session_writer.update_num_players(url, num_players)
+    return num_players, player, game_json
+
+
+def _redis_apply(url, mutation, *args):
+    """
+    Apply mutation(game_obj, *args) to the stored game inside a single
+    critical section and return the JSON snapshot of that same mutated
+    object, the mutation result and the versioned patch from the previous
+    snapshot.
+    """
+    return _redis_run(url, delta.apply_transition, mutation, *args)
+
+
+def _transition_name(transition, args):
+    if transition is delta.apply_transition:
+        # Named after the GameObj mutation
+        return args[0].__name__
+    return transition.__name__
+
+
+def _redis_run(url, transition, *args):
+    """
+    Run transition(game_obj, *args) under the game lock and store the game,
+    transition returns the new snapshot first.
+    """
+    r = _get_redis_conn()
+    name = _transition_name(transition, args)
+    with _get_game_lock(r, url, name):
+        game_obj = _load_game_obj(r, url)
+        with profiling.sample('game.' + name):
+            outcome = transition(game_obj, *args)
+        _write_game_obj(r, url, game_obj, outcome[0])
+    return outcome
+
+
+def _redis_start_round(url):
+    return _redis_run(url, start_round)
+
+
+def _redis_start_game(url):
+    game_obj, _, update = _redis_apply(url, GameObj.start_game)
+    return game_obj, update
+
+
+def _redis_start_game_all_ready(url):
+    return _redis_apply(url, GameObj.start_game_all_ready)
+
+
+def _redis_player_hit(url, idx, is_double=False):
+    return _redis_apply(url, GameObj.player_hit, idx, is_double)
+
+
+def _redis_next_turn(url):
+    return _redis_apply(url, GameObj.do_next_turn)
+
+
+def _redis_dealer_final_turn(url):
+    game_obj, _, update = _redis_apply(url, GameObj.dealer_final_turn)
+    return game_obj, update
+
+
+def _redis_player_ready(url, idx, bet):
+    return _redis_apply(url, GameObj.player_ready, idx, bet)
+
+
+def _redis_check_initial_blackjack(url):
+    game_obj, _, update = _redis_apply(url, GameObj.check_initial_blackjack)
+    return game_obj, update
+
+
+# asyncio counterparts of the helpers above, used by the async consumers
+
+async def _aredis_add_player(player_consumer, url, creator_username,
+                             current_player):
+    r = _get_async_redis_conn()
+
+    async with _get_game_lock(r, url, 'add_player'):
+        game_obj = await _aload_game_obj(r, url)
+        if game_obj is None:
+            game_obj = GameObj(url=url, creator_username=creator_username)
+
+        _add_to_game_obj(player_consumer.channel_name, game_obj,
+                         current_player)
+        await _awrite_game_obj(r, url, game_obj)
+
+    num_players = len(game_obj.players_map)
+
+    # Update Database
+    await session_writer.aupdate_num_players(url, num_players)
+    return num_players
+
+
+async def _aredis_remove_player(player_consumer, url):
+    r = _get_async_redis_conn()
+
+    async with _get_game_lock(r, url, 'remove_player'):
+        game_obj = await _aload_game_obj(r, url)
+        player = _remove_from_game_obj(player_consumer.channel_name, game_obj)
+        num_players = len(game_obj.players_map)
+        game_json = await _awrite_game_obj(
+            r, url, game_obj if num_players > 0 else None)
+
+    player = player.get_json_obj() if player is not None else None
+    if num_players == 0:
+        await session_writer.adelete_game_session(url)
+        return num_players, player, None
+    await session_writer.aupdate_num_players(url, num_players)
+    return num_players, player, game_json
+
+
+async def _aredis_apply(url, mutation, *args):
+    return await _aredis_run(url, delta.apply_transition, mutation, *args)
+
+
+async def _aredis_run(url, transition, *args):
+    r = _get_async_redis_conn()
+    name = _transition_name(transition, args)
+    async with _get_game_lock(r, url, name):
+        game_obj = await _aload_game_obj(r, url)
+        with profiling.sample('game.' + name):
+            outcome = transition(game_obj, *args)
+        await _awrite_game_obj(r, url, game_obj, outcome[0])
+    return outcome
+
+
+async def _aredis_start_round(url):
+    return await _aredis_run(url, start_round)
+
+
+async def _aredis_start_game(url):
+    game_obj, _, update = await _aredis_apply(url, GameObj.start_game)
+    return game_obj, update
+
+
+async def _aredis_start_game_all_ready(url):
+    return await _aredis_apply(url, GameObj.start_game_all_ready)
+
+
+async def _aredis_player_hit(url, idx, is_double=False):
+    return await _aredis_apply(url, GameObj.player_hit, idx, is_double)
+
+
+async def _aredis_next_turn(url):
+    return await _aredis_apply(url, GameObj.do_next_turn)
+
+
+async def _aredis_dealer_final_turn(url):
+    game_obj, _, update = await _aredis_apply(url, GameObj.dealer_final_turn)
+    return game_obj, update
+
+
+async def _aredis_player_ready(url, idx, bet):
+    return await _aredis_apply(url, GameObj.player_ready, idx, bet)
+
+
+async def _aredis_check_initial_blackjack(url):
+    game_obj, _, update = await _aredis_apply(
+        url, GameObj.check_initial_blackjack)
+    return game_obj, update
+
+
+def _add_to_game_obj(player_name, game_obj, current_player):
+    if None in game_obj.players_list:
+        idx = game_obj.players_list.index(None)
+        player = Player(player_name, current_player)
+        player.index = idx
+        game_obj.players_list[idx] = player
+        game_obj.players_map[player_name] = idx
+        return player
+    return None
+
+
+def _remove_from_game_obj(player_name, game_obj):
+    if player_name in game_obj.players_map:
+        idx = game_obj.players_map[player_name]
+        player = game_obj.players_list[idx]
+        game_obj.players_list[idx] = None
+        game_obj.players_map.pop(player_name, None)
+        return player
+    return None
@@ -0,0 +1,50 @@
+"""
+Aggregated lobby updates.
+
+Joins and leaves are not sent to the lobby one by one. The games that
+changed are collected for a short window, then every lobby page group they
+show up on, or shift, gets one LOBBY_DIFF frame with the current lobby index entry of
+each of its games (None for games no longer listed). A game that is back
+to the entry it had when the window opened is left out, so a join quickly
+followed by a leave costs nothing.
+"""
+
+from . import lobby_index
+import asyncio
+import logging
+
+log = logging.getLogger('hitme_game.background')
+
+
+class LobbyDiffAggregator(object):
+
+    def __init__(self, window, publish):
+        self.window = window
+        # coroutine function called with a page group and its url -> entry
+        # diff
+        self.publish = publish
+        # url -> entry the game had when the window opened
+        self.pending = {}
+
+    def note(self, url, before):
+        """Record a change of the game, before is the entry it replaced"""
+        if not self.pending:
+            asyncio.ensure_future(self._flush_later())
+        self.pending.setdefault(url, before)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        pending, self.pending = self.pending, {}
+        try:
+            # Read the index again so the latest change of every worker wins
+            current = await lobby_index.aget_games(list(pending))
+            changes = {url: (pending[url], entry)
+                       for url, entry in current.items()
+                       if entry != pending[url]}
+            if not changes:
+                return
+            groups = await lobby_index.aroute_changes(changes)
+            for group, games in groups.items():
+                await self.publish(group, games)
+        except Exception:
+            log.exception("lobby diff failed")
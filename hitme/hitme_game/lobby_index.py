@@ -0,0 +1,242 @@
+"""
+Live index of the open games shown in the lobby.
+
+Open games (at least one player, at least one free seat) are kept in Redis
+so the lobby never scans GameSession in MySQL. GAMES is a hash of url ->
+JSON entry with the url, creator, number of players and the sequence
+number the game was opened with. Each facet the lobby can be filtered by
+(all games, games with n free seats, games of a creator) is a sorted set of
+urls scored by that sequence number, so a page of any listing is one
+ZRANGE. The index is written wherever the lobby is told about a game and
+rebuilt from MySQL with the rebuild_lobby_index command.
+
+Lobby sockets subscribe to the channel group of the page they show, see
+page_group. A change is sent to the page the game sits on in each facet
+it was or is part of. A game joining or leaving a facet shifts the games
+after it, so the change is also sent to every later page of the facet,
+where the client lists its page again.
+"""
+
+from django.conf import settings
+from .live_games import _get_redis_conn, _get_async_redis_conn
+import json
+import zlib
+
+MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
+LOBBY_PAGE_SIZE = getattr(settings, 'LOBBY_PAGE_SIZE', 20)
+
+LOBBY_KEY_PREFIX = "LOBBY:"
+LOBBY_GAMES_KEY = LOBBY_KEY_PREFIX + "GAMES"
+LOBBY_SEQ_KEY = LOBBY_KEY_PREFIX + "SEQ"
+LOBBY_OPEN_KEY = LOBBY_KEY_PREFIX + "OPEN"
+LOBBY_FREE_KEY_FORMAT = LOBBY_KEY_PREFIX + "FREE:{}"
+LOBBY_CREATOR_KEY_FORMAT = LOBBY_KEY_PREFIX + "CREATOR:{}"
+
+# Moves the url between facets atomically, a game keeps its sequence
+# number while it stays listed. An empty entry unlists the game. Returns
+# the entry before and after the change.
+LUA_PUT_GAME = """
+local url, prefix = ARGV[1], ARGV[3]
+local max_players = tonumber(ARGV[4])
+local function facets(entry)
+    return {prefix .. 'OPEN',
+            prefix .. 'FREE:' .. (max_players - entry.num_players),
+            prefix .. 'CREATOR:' .. entry.creator}
+end
+
+local before_raw = redis.call('HGET', KEYS[1], url)
+local opened
+if before_raw then
+    local before = cjson.decode(before_raw)
+    opened = before.opened
+    for _, key in ipairs(facets(before)) do
+        redis.call('ZREM', key, url)
+    end
+end
+if ARGV[2] == '' then
+    redis.call('HDEL', KEYS[1], url)
+    return {before_raw, false}
+end
+
+local entry = cjson.decode(ARGV[2])
+entry.opened = opened or redis.call('INCR', KEYS[2])
+for _, key in ipairs(facets(entry)) do
+    redis.call('ZADD', key, entry.opened, url)
+end
+local raw = cjson.encode(entry)
+redis.call('HSET', KEYS[1], url, raw)
+return {before_raw, raw}
+"""
+
+
+def is_open(num_players):
+    return 0 < num_players < MAX_PLAYERS_PER_GAME
+
+
+def facet_key(free=None, creator=None):
+    """Sorted set of the listing filtered by free seats or by creator"""
+    if creator:
+        return LOBBY_CREATOR_KEY_FORMAT.format(creator)
+    if free:
+        return LOBBY_FREE_KEY_FORMAT.format(free)
+    return LOBBY_OPEN_KEY
+
+
+def entry_facet_keys(entry):
+    return [LOBBY_OPEN_KEY,
+            LOBBY_FREE_KEY_FORMAT.format(
+                MAX_PLAYERS_PER_GAME - entry['num_players']),
+            LOBBY_CREATOR_KEY_FORMAT.format(entry['creator'])]
+
+
+def page_group(key, page):
+    # Group names only allow a few characters, creators may use others
+    return "lobby.{:08x}.{}".format(zlib.crc32(key.encode('utf-8')), page)
+
+
+def _queue_put(pipe, url, creator, num_players):
+    entry = ''
+    if is_open(num_players):
+        entry = json.dumps({
+            'url': url,
+            'creator': creator,
+            'num_players': num_players,
+        })
+    pipe.eval(LUA_PUT_GAME, 2, LOBBY_GAMES_KEY, LOBBY_SEQ_KEY,
+              url, entry, LOBBY_KEY_PREFIX, MAX_PLAYERS_PER_GAME)
+
+
+def _decode_entry(entry):
+    return json.loads(entry) if entry else None
+
+
+def _decode_games(entries):
+    return [json.loads(entry) for entry in entries if entry is not None]
+
+
+def _queue_page(pipe, key, page):
+    start = page * LOBBY_PAGE_SIZE
+    pipe.zrange(key, start, start + LOBBY_PAGE_SIZE - 1)
+    pipe.zcard(key)
+
+
+def _num_pages(total):
+    return max(1, -(-total // LOBBY_PAGE_SIZE))
+
+
+def _queue_routes(pipe, changes):
+    routes = []
+    for url, entries in changes.items():
+        before, now = [set(entry_facet_keys(entry)) if entry else set()
+                       for entry in entries]
+        for entry in entries:
+            if entry is None:
+                continue
+            for key in entry_facet_keys(entry):
+                # Position the game has, or had, in the facet
+                pipe.zcount(key, '-inf', '({}'.format(entry['opened']))
+                pipe.zcard(key)
+                routes.append((url, key, (key in before) != (key in now)))
+    return routes
+
+
+def _group_changes(changes, routes, counts):
+    groups = {}
+    for (url, key, shifts), position, total in zip(
+            routes, counts[::2], counts[1::2]):
+        first = position // LOBBY_PAGE_SIZE
+        # Up to the last page, before the game left or after it joined
+        last = total // LOBBY_PAGE_SIZE if shifts else first
+        for page in range(first, last + 1):
+            group = page_group(key, page)
+            groups.setdefault(group, {})[url] = changes[url][-1]
+    return groups
+
+
+def put_game(url, creator, num_players):
+    """
+    List the game with its current number of players, or unlist it.
+    Returns the entry the game had before, None if it was not listed.
+    """
+    pipe = _get_redis_conn().pipeline()
+    _queue_put(pipe, url, creator, num_players)
+    return _decode_entry(pipe.execute()[0][0])
+
+
+def remove_game(url):
+    return put_game(url, None, 0)
+
+
+def get_games(urls):
+    """url -> entry for each of urls, None for games not listed"""
+    entries = _get_redis_conn().hmget(LOBBY_GAMES_KEY, urls)
+    return {url: _decode_entry(entry) for url, entry in zip(urls, entries)}
+
+
+def list_games(page=0, free=None, creator=None):
+    """
+    Games on a page of the listing, in the order they opened, and the
+    number of pages.
+    """
+    r = _get_redis_conn()
+    pipe = r.pipeline()
+    _queue_page(pipe, facet_key(free, creator), page)
+    urls, total = pipe.execute()
+    games = _decode_games(r.hmget(LOBBY_GAMES_KEY, urls)) if urls else []
+    return games, _num_pages(total)
+
+
+def route_changes(changes):
+    """
+    Group changes, url -> (entry before, entry now), by the channel group
+    of every page the game shows up or showed up on, and of the later pages
+    of the facets it joined or left. Each group gets url -> entry now.
+    """
+    pipe = _get_redis_conn().pipeline()
+    routes = _queue_routes(pipe, changes)
+    return _group_changes(changes, routes, pipe.execute())
+
+
+def rebuild(games):
+    """Replace the index with games, an iterable of GameSession"""
+    r = _get_redis_conn()
+    keys = list(r.scan_iter(match=LOBBY_KEY_PREFIX + '*'))
+    pipe = r.pipeline()
+    if keys:
+        pipe.delete(*keys)
+    for game in games:
+        _queue_put(pipe, game.url, game.creator.username, game.num_players)
+    pipe.execute()
+
+
+# asyncio counterparts of the helpers above, used by the async consumers
+
+async def aput_game(url, creator, num_players):
+    pipe = _get_async_redis_conn().pipeline()
+    _queue_put(pipe, url, creator, num_players)
+    return _decode_entry((await pipe.execute())[0][0])
+
+
+async def aremove_game(url):
+    return await aput_game(url, None, 0)
+
+
+async def aget_games(urls):
+    entries = await _get_async_redis_conn().hmget(LOBBY_GAMES_KEY, urls)
+    return {url: _decode_entry(entry) for url, entry in zip(urls, entries)}
+
+
+async def alist_games(page=0, free=None, creator=None):
+    r = _get_async_redis_conn()
+    pipe = r.pipeline()
+    _queue_page(pipe, facet_key(free, creator), page)
+    urls, total = await pipe.execute()
+    games = (_decode_games(await r.hmget(LOBBY_GAMES_KEY, urls))
+             if urls else [])
+    return games, _num_pages(total)
+
+
+async def aroute_changes(changes):
+    pipe = _get_async_redis_conn().pipeline()
+    routes = _queue_routes(pipe, changes)
+    return _group_changes(changes, routes, await pipe.execute())
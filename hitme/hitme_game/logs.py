@@ -0,0 +1,113 @@
+"""
+Structured logging for the game servers.
+
+Records are written as one JSON object per line by a listener thread, the
+logging call only puts the record on a bounded queue and drops it when the
+queue is full. Loggers are per category, see LOGGING in settings:
+
+    hitme_game.messages   inbound socket messages (sampled)
+    hitme_game.frames     outbound frames (sampled)
+    hitme_game.games      game engine and consumers
+    hitme_game.background background threads and tasks
+
+bind() adds correlation fields (game url, connection, message number) to
+every record logged from the current task.
+"""
+
+from contextvars import ContextVar
+from logging.handlers import QueueListener
+from . import metrics
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+_CONTEXT = ContextVar('hitme_log_context', default={})
+
+
+def bind(**fields):
+    """Add fields to the records of the current task and its children"""
+    _CONTEXT.set(dict(_CONTEXT.get(), **fields))
+
+
+class ContextFilter(logging.Filter):
+
+    def filter(self, record):
+        record.context = _CONTEXT.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets at most rate records per second through, with bursts of up to
+    burst records. The next record let through counts the dropped ones.
+    """
+
+    def __init__(self, rate=20, burst=50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1
+            record.suppressed, self.suppressed = self.suppressed, 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', {}))
+        data = getattr(record, 'data', None)
+        if data:
+            entry.update(data)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class QueuedHandler(logging.Handler):
+    """
+    Hands records to a stream handler running on a listener thread, so
+    logging never waits on the stream.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__()
+        self.target = logging.StreamHandler(stream)
+        self.queue = queue.Queue(maxsize)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOGS_DROPPED.inc()
@@ -0,0 +1,630 @@
+"""
+Lua script backend for live games.
+
+Every game transition runs as a registered Redis Lua script against a
+structured per game hash, so an action costs one round-trip and needs no
+client side lock. The module exposes the same helpers as live_games and is
+selected with LIVE_GAMES_BACKEND = 'lua'.
+"""
+
+from .live_games import (_get_redis_conn, _get_async_redis_conn,
+                         GameState, PlayerGameState,
+                         PlayerGameOutcome, MAX_PLAYERS_PER_GAME,
+                         SHOE_NUM_DECKS, SHOE_PENETRATION,
+                         initial_shoe_seed)
+from . import delta, metrics, session_writer
+import json
+
+
+LUA_KEY_FORMAT = "GAME:{}:LUA"
+
+# Redis seeds math.random with a C int
+LUA_SEED_MASK = (1 << 31) - 1
+
+# Shared prelude, KEYS[1] is the game hash. ARGV[1] is max players,
+# ARGV[2] the seed of a new game's first shoe, ARGV[3] and ARGV[4] the shoe decks and
+# penetration, op args start at ARGV[5]
+LUA_COMMON = """
+local KEY = KEYS[1]
+local MAX_PLAYERS = tonumber(ARGV[1])
+local NUM_DECKS = tonumber(ARGV[3])
+local PENETRATION = tonumber(ARGV[4])
+
+local SUITS = {'spades', 'hearts', 'clubs', 'diams'}
+local NUMBERS = {'A', '2', '3', '4', '5', '6', '7', '8', '9', '10',
+                 'J', 'Q', 'K'}
+local VALUES = {11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10}
+
+-- The shoe is a byte string, one card (suit * 13 + number) per byte.
+-- It is read once per script and only written back when reshuffled
+local shoe, shoe_pos, shoe_cut
+
+local function load_shoe()
+    if shoe == nil then
+        local fields = redis.call('HMGET', KEY, 'shoe', 'shoe_pos',
+                                  'shoe_cut')
+        shoe = fields[1] or ''
+        shoe_pos = tonumber(fields[2]) or 0
+        shoe_cut = tonumber(fields[3]) or 0
+    end
+end
+
+-- Each shoe stores the seed of the next one, so a game's whole sequence
+-- of shoes replays from its first seed
+local function shuffle_shoe()
+    local seed = redis.call('HGET', KEY, 'shoe_seed')
+    math.randomseed(tonumber(seed or ARGV[2]))
+    local cards = {}
+    for _ = 1, NUM_DECKS do
+        for c = 0, #SUITS * #NUMBERS - 1 do
+            cards[#cards + 1] = c
+        end
+    end
+    for i = #cards, 2, -1 do
+        local j = math.random(i)
+        cards[i], cards[j] = cards[j], cards[i]
+    end
+    for i = 1, #cards do
+        cards[i] = string.char(cards[i])
+    end
+    shoe = table.concat(cards)
+    shoe_pos = 0
+    shoe_cut = math.floor(#shoe * PENETRATION)
+    redis.call('HSET', KEY, 'shoe', shoe, 'shoe_cut', shoe_cut,
+               'shoe_seed', math.random(0, 2147483646))
+end
+
+local function deal_card()
+    load_shoe()
+    if shoe_pos >= #shoe then
+        shuffle_shoe()
+    end
+    shoe_pos = shoe_pos + 1
+    local c = string.byte(shoe, shoe_pos)
+    local n = c % #NUMBERS + 1
+    return {suit=SUITS[math.floor(c / #NUMBERS) + 1], num=NUMBERS[n],
+            value=VALUES[n]}
+end
+
+-- State as it was before the script ran, returned by transitions so the
+-- caller can build a patch
+local loaded_raw
+
+local function load_game()
+    loaded_raw = redis.call('HGET', KEY, 'state')
+    if not loaded_raw then
+        return nil
+    end
+    return cjson.decode(loaded_raw)
+end
+
+local function save_game(game)
+    local raw = cjson.encode(game)
+    redis.call('HSET', KEY, 'state', raw)
+    if shoe ~= nil then
+        redis.call('HSET', KEY, 'shoe_pos', shoe_pos)
+    end
+    return raw
+end
+
+-- Compared by value, cjson does not encode keys in a stable order
+local function same_value(a, b)
+    if type(a) ~= 'table' or type(b) ~= 'table' then
+        return a == b
+    end
+    for k, v in pairs(a) do
+        if not same_value(v, b[k]) then
+            return false
+        end
+    end
+    for k in pairs(b) do
+        if a[k] == nil then
+            return false
+        end
+    end
+    return true
+end
+
+-- The version only moves when the snapshot differs from before (the
+-- loaded state by default), like delta.apply_transition
+local function save_transition(game, before)
+    before = before or loaded_raw
+    if same_value(game, cjson.decode(before)) then
+        return before
+    end
+    game.version = (game.version or 0) + 1
+    return save_game(game)
+end
+
+local function count_players(game)
+    local num_players = 0
+    for _ in pairs(game.players) do
+        num_players = num_players + 1
+    end
+    return num_players
+end
+
+-- Aces count 1, one of them counts 11 when that does not bust (soft hand)
+local function hand_value(hand)
+    local total, aces = 0, 0
+    for _, card in ipairs(hand) do
+        if card.num == 'A' then
+            total = total + 1
+            aces = aces + 1
+        else
+            total = total + card.value
+        end
+    end
+    if aces > 0 and total + 10 <= 21 then
+        return total + 10, true
+    end
+    return total, false
+end
+
+local function player_at(game, idx)
+    return game.players[tostring(idx)]
+end
+
+local function refresh_player(p)
+    p.current_hand_value, p.current_hand_soft = hand_value(p.current_hand)
+end
+
+local function refresh_dealer(game)
+    game.dealer_hand_value, game.dealer_hand_soft = hand_value(
+        game.dealer_hand)
+end
+
+local function get_next_turn(game, prev_turn)
+    local start = prev_turn + 1
+    while start < MAX_PLAYERS do
+        local p = player_at(game, start)
+        if p and p.in_game and p.player_game_state == 'game-started' then
+            return start
+        end
+        start = start + 1
+    end
+    return start + 1000
+end
+
+local function do_next_turn(game)
+    game.current_turn = get_next_turn(game, game.current_turn)
+    return game.current_turn
+end
+
+local function calculate_score(game)
+    local dealer_total = hand_value(game.dealer_hand)
+    for _, p in pairs(game.players) do
+        if p.in_game then
+            local player_total = hand_value(p.current_hand)
+            if player_total > 21 then
+                p.player_game_outcome = 'loss'
+                p.win_loss = p.current_bet
+            elseif p.player_game_state == 'game-over-blackjack' then
+                if game.dealer_blackjack then
+                    p.player_game_outcome = 'push'
+                    p.win_loss = 0
+                else
+                    p.player_game_outcome = 'win'
+                    p.win_loss = math.ceil(1.5 * p.current_bet)
+                end
+            else
+                if game.dealer_blackjack then
+                    p.player_game_outcome = 'loss'
+                    p.win_loss = p.current_bet
+                elseif dealer_total > 21 then
+                    p.player_game_outcome = 'win'
+                    p.win_loss = p.current_bet
+                elseif player_total > dealer_total then
+                    p.player_game_outcome = 'win'
+                    p.win_loss = p.current_bet
+                elseif player_total < dealer_total then
+                    p.player_game_outcome = 'loss'
+                    p.win_loss = p.current_bet
+                else
+                    p.player_game_outcome = 'push'
+                    p.win_loss = 0
+                end
+            end
+
+            p.dollars = p.dollars + p.current_bet
+            p.current_bet = 0
+            if p.player_game_outcome == 'win' then
+                p.dollars = p.dollars + p.win_loss
+            elseif p.player_game_outcome == 'loss' then
+                p.dollars = p.dollars - p.win_loss
+            end
+        end
+    end
+end
+
+-- Round steps shared by the single step scripts and LUA_START_ROUND
+
+local function deal_round(game)
+    if game.game_state == 'started' then
+        return false
+    end
+    game.game_state = 'started'
+    table.insert(game.dealer_hand, deal_card())
+    table.insert(game.dealer_hand, deal_card())
+    refresh_dealer(game)
+    for idx = 0, MAX_PLAYERS - 1 do
+        local p = player_at(game, idx)
+        if p and p.in_game then
+            p.player_game_state = 'game-started'
+            table.insert(p.current_hand, deal_card())
+            table.insert(p.current_hand, deal_card())
+            refresh_player(p)
+        end
+    end
+    return true
+end
+
+local function check_initial_blackjack(game)
+    if hand_value(game.dealer_hand) == 21 then
+        game.dealer_blackjack = true
+    end
+    for _, p in pairs(game.players) do
+        if p.player_game_state == 'game-started' and
+                hand_value(p.current_hand) == 21 then
+            p.player_game_state = 'game-over-blackjack'
+        end
+    end
+    do_next_turn(game)
+end
+
+local function dealer_final_turn(game)
+    refresh_dealer(game)
+    while game.dealer_hand_value < 17 do
+        table.insert(game.dealer_hand, deal_card())
+        refresh_dealer(game)
+    end
+    calculate_score(game)
+    game.game_state = 'not-started'
+end
+"""
+
+LUA_ADD_PLAYER = """
+local channel_name, username = ARGV[5], ARGV[6]
+local game = load_game()
+if not game then
+    game = {url=ARGV[7], creator=ARGV[8], players={},
+            game_state='not-started', current_turn=-1, dealer_hand={},
+            dealer_blackjack=false, dealer_hand_value=0,
+            dealer_hand_soft=false, version=0}
+end
+for idx = 0, MAX_PLAYERS - 1 do
+    if not player_at(game, idx) then
+        game.players[tostring(idx)] = {
+            name=channel_name, username=username, index=idx, dollars=100,
+            current_bet=0, in_game=false, current_hand={},
+            player_game_state='game-not-started', player_game_outcome='na',
+            win_loss=0, current_hand_value=0, current_hand_soft=false}
+        redis.call('HSET', KEY, 'map:' .. channel_name, idx)
+        break
+    end
+end
+save_game(game)
+return count_players(game)
+"""
+
+LUA_REMOVE_PLAYER = """
+local map_field = 'map:' .. ARGV[5]
+local game = load_game()
+local idx = redis.call('HGET', KEY, map_field)
+local player = false
+if game and idx then
+    player = cjson.encode(player_at(game, idx))
+    game.players[tostring(idx)] = nil
+    redis.call('HDEL', KEY, map_field)
+end
+local num_players = game and count_players(game) or 0
+if num_players == 0 then
+    redis.call('DEL', KEY)
+    return {0, player, false}
+end
+return {num_players, player, save_game(game)}
+"""
+
+LUA_START_GAME = """
+local game = load_game()
+game.game_state = 'awaiting-ready'
+game.current_turn = -1
+game.dealer_hand = {}
+game.dealer_blackjack = false
+refresh_dealer(game)
+load_shoe()
+if shoe_pos >= shoe_cut then
+    shuffle_shoe()
+end
+for _, p in pairs(game.players) do
+    p.in_game = true
+    p.current_hand = {}
+    p.player_game_state = 'awaiting-ready'
+    p.player_game_outcome = 'na'
+    p.win_loss = 0
+    p.current_bet = 0
+    refresh_player(p)
+end
+return {save_transition(game), 1, loaded_raw}
+"""
+
+LUA_START_GAME_ALL_READY = """
+local game = load_game()
+if not deal_round(game) then
+    return {loaded_raw, 0, loaded_raw}
+end
+return {save_transition(game), 1, loaded_raw}
+"""
+
+LUA_PLAYER_HIT = """
+local game = load_game()
+local p = player_at(game, ARGV[5])
+if not p then
+    return {loaded_raw, 0, loaded_raw}
+end
+table.insert(p.current_hand, deal_card())
+if ARGV[6] == '1' then
+    p.dollars = p.dollars - p.current_bet
+    p.current_bet = p.current_bet * 2
+end
+refresh_player(p)
+return {save_transition(game), 1, loaded_raw}
+"""
+
+LUA_NEXT_TURN = """
+local game = load_game()
+local next_turn = do_next_turn(game)
+return {save_transition(game), next_turn, loaded_raw}
+"""
+
+LUA_DEALER_FINAL_TURN = """
+local game = load_game()
+dealer_final_turn(game)
+return {save_transition(game), 1, loaded_raw}
+"""
+
+LUA_PLAYER_READY = """
+local game = load_game()
+local p = player_at(game, ARGV[5])
+if not p or p.player_game_state ~= 'awaiting-ready' then
+    return {loaded_raw, 0, loaded_raw}
+end
+local bet = tonumber(ARGV[6])
+p.current_bet = bet
+p.dollars = p.dollars - bet
+p.player_game_state = 'ready'
+return {save_transition(game), 1, loaded_raw}
+"""
+
+LUA_CHECK_INITIAL_BLACKJACK = """
+local game = load_game()
+check_initial_blackjack(game)
+return {save_transition(game), 1, loaded_raw}
+"""
+
+# Returns the snapshot before the round and after each step
+LUA_START_ROUND = """
+local game = load_game()
+if not deal_round(game) then
+    return {0, loaded_raw}
+end
+game.version = (game.version or 0) + 1
+local steps = {1, loaded_raw, cjson.encode(game)}
+check_initial_blackjack(game)
+if game.dealer_blackjack or game.current_turn >= MAX_PLAYERS then
+    game.version = game.version + 1
+    steps[#steps + 1] = cjson.encode(game)
+    dealer_final_turn(game)
+end
+steps[#steps + 1] = save_transition(game, steps[#steps])
+return steps
+"""
+
+_SCRIPTS = {}
+_ASYNC_SCRIPTS = {}
+
+
+def _get_script(r, body, scripts=_SCRIPTS):
+    # Script objects cache the SHA and fall back to EVAL on NOSCRIPT
+    script = scripts.get(body)
+    if script is None:
+        script = r.register_script(LUA_COMMON + body)
+        scripts[body] = script
+    return script
+
+
+def _script_args(args):
+    return [MAX_PLAYERS_PER_GAME, initial_shoe_seed() & LUA_SEED_MASK,
+            SHOE_NUM_DECKS, SHOE_PENETRATION] + list(args)
+
+
+def _run_script(body, url, *args):
+    r = _get_redis_conn()
+    with metrics.REDIS_SECONDS.time('script'):
+        return _get_script(r, body)(
+            keys=[LUA_KEY_FORMAT.format(url)], args=_script_args(args),
+            client=r)
+
+
+async def _arun_script(body, url, *args):
+    r = _get_async_redis_conn()
+    with metrics.REDIS_SECONDS.time('script'):
+        return await _get_script(r, body, _ASYNC_SCRIPTS)(
+            keys=[LUA_KEY_FORMAT.format(url)], args=_script_args(args),
+            client=r)
+
+
+def _decode_game_json(raw):
+    # cjson has no notion of empty arrays nor of integer object keys
+    game_obj = json.loads(raw)
+    game_obj['players'] = {int(idx): _decode_player_json(player)
+                           for idx, player in game_obj['players'].items()}
+    if not game_obj['dealer_hand']:
+        game_obj['dealer_hand'] = []
+    game_obj.setdefault('version', 0)
+    return game_obj
+
+
+def _decode_player_json(player):
+    if not player['current_hand']:
+        player['current_hand'] = []
+    return player
+
+
+def _transition_result(raw, result, before):
+    game_obj = _decode_game_json(raw)
+    return (game_obj, result,
+            delta.make_update(_decode_game_json(before), game_obj))
+
+
+def _run_transition(body, url, *args):
+    return _transition_result(*_run_script(body, url, *args))
+
+
+def _round_result(status, *raws):
+    states = [_decode_game_json(raw) for raw in raws]
+    updates = [delta.make_update(before, after)
+               for before, after in zip(states, states[1:])]
+    return states[-1], bool(status), updates
+
+
+def _get_redis_game_obj_json(url):
+    raw = _get_redis_conn().hget(LUA_KEY_FORMAT.format(url), 'state')
+    return _decode_game_json(raw) if raw is not None else None
+
+
+def _redis_add_player(player_consumer, url, creator_username, current_player):
+    num_players = _run_script(LUA_ADD_PLAYER, url,
+                              player_consumer.channel_name, current_player,
+                              url, creator_username)
+    # Update Database
+    session_writer.update_num_players(url, num_players)
+    return num_players
+
+
+def _redis_remove_player(player_consumer, url):
+    num_players, player, raw = _run_script(
+        LUA_REMOVE_PLAYER, url, player_consumer.channel_name)
+    player = _decode_player_json(json.loads(player)) if player else None
+
+    if num_players == 0:
+        session_writer.delete_game_session(url)
+        return num_players, player, None
+    session_writer.update_num_players(url, num_players)
+    return num_players, player, _decode_game_json(raw)
+
+
+def _redis_start_game(url):
+    game_obj, _, update = _run_transition(LUA_START_GAME, url)
+    return game_obj, update
+
+
+def _redis_start_game_all_ready(url):
+    game_obj, status, update = _run_transition(LUA_START_GAME_ALL_READY, url)
+    return game_obj, bool(status), update
+
+
+def _redis_player_hit(url, idx, is_double=False):
+    game_obj, status, update = _run_transition(LUA_PLAYER_HIT, url, idx,
+                                               int(is_double))
+    return game_obj, bool(status), update
+
+
+def _redis_next_turn(url):
+    return _run_transition(LUA_NEXT_TURN, url)
+
+
+def _redis_dealer_final_turn(url):
+    game_obj, _, update = _run_transition(LUA_DEALER_FINAL_TURN, url)
+    return game_obj, update
+
+
+def _redis_player_ready(url, idx, bet):
+    game_obj, status, update = _run_transition(LUA_PLAYER_READY, url, idx,
+                                               bet)
+    return game_obj, bool(status), update
+
+
+def _redis_check_initial_blackjack(url):
+    game_obj, _, update = _run_transition(LUA_CHECK_INITIAL_BLACKJACK, url)
+    return game_obj, update
+
+
+def _redis_start_round(url):
+    return _round_result(*_run_script(LUA_START_ROUND, url))
+
+
+# asyncio counterparts of the helpers above, used by the async consumers
+
+async def _arun_transition(body, url, *args):
+    return _transition_result(*await _arun_script(body, url, *args))
+
+
+async def _aget_redis_game_obj_json(url):
+    raw = await _get_async_redis_conn().hget(LUA_KEY_FORMAT.format(url),
+                                             'state')
+    return _decode_game_json(raw) if raw is not None else None
+
+
+async def _aredis_add_player(player_consumer, url, creator_username,
+                             current_player):
+    num_players = await _arun_script(LUA_ADD_PLAYER, url,
+                                     player_consumer.channel_name,
+                                     current_player, url, creator_username)
+    # Update Database
+    await session_writer.aupdate_num_players(url, num_players)
+    return num_players
+
+
+async def _aredis_remove_player(player_consumer, url):
+    num_players, player, raw = await _arun_script(
+        LUA_REMOVE_PLAYER, url, player_consumer.channel_name)
+    player = _decode_player_json(json.loads(player)) if player else None
+
+    if num_players == 0:
+        await session_writer.adelete_game_session(url)
+        return num_players, player, None
+    await session_writer.aupdate_num_players(url, num_players)
+    return num_players, player, _decode_game_json(raw)
+
+
+async def _aredis_start_game(url):
+    game_obj, _, update = await _arun_transition(LUA_START_GAME, url)
+    return game_obj, update
+
+
+async def _aredis_start_game_all_ready(url):
+    game_obj, status, update = await _arun_transition(
+        LUA_START_GAME_ALL_READY, url)
+    return game_obj, bool(status), update
+
+
+async def _aredis_player_hit(url, idx, is_double=False):
+    game_obj, status, update = await _arun_transition(
+        LUA_PLAYER_HIT, url, idx, int(is_double))
+    return game_obj, bool(status), update
+
+
+async def _aredis_next_turn(url):
+    return await _arun_transition(LUA_NEXT_TURN, url)
+
+
+async def _aredis_dealer_final_turn(url):
+    game_obj, _, update = await _arun_transition(LUA_DEALER_FINAL_TURN, url)
+    return game_obj, update
+
+
+async def _aredis_player_ready(url, idx, bet):
+    game_obj, status, update = await _arun_transition(
+        LUA_PLAYER_READY, url, idx, bet)
+    return game_obj, bool(status), update
+
+
+async def _aredis_check_initial_blackjack(url):
+    game_obj, _, update = await _arun_transition(
+        LUA_CHECK_INITIAL_BLACKJACK, url)
+    return game_obj, update
+
+
+async def _aredis_start_round(url):
+    return _round_result(*await _arun_script(LUA_START_ROUND, url))
@@ -0,0 +1,292 @@
+"""Micro-benchmark the GameObj engine and the Redis game helpers"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from hitme_game import codec, live_games
+from hitme_game.frames import encode_frame
+import copy
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'bench_game_engine.json')
+
+# Points of a round a benchmarked game is prepared at, in order
+STAGES = ('new', 'awaiting', 'ready', 'dealt', 'checked', 'played', 'scored')
+
+BET = 10
+
+
+def _play_dealer(game_obj):
+    # dealer_final_turn without the scoring, for calculate_score alone
+    while game_obj.dealer_hand_value < 17:
+        game_obj.add_dealer_card(game_obj.draw_card())
+
+
+def _build_game(url, stage, seed):
+    game_obj = live_games.GameObj(url, 'creator')
+    game_obj.shoe_seed = seed
+    for idx in range(live_games.MAX_PLAYERS_PER_GAME):
+        live_games._add_to_game_obj(
+            'channel-{}'.format(idx), game_obj, 'user-{}'.format(idx))
+    if stage == 'scored':
+        # A whole round played, the next start_game finds a shuffled shoe
+        game_obj = _build_game(url, 'checked', seed)
+        game_obj.dealer_final_turn()
+        return game_obj
+    stage = STAGES.index(stage)
+    if stage >= STAGES.index('awaiting'):
+        game_obj.start_game()
+    if stage >= STAGES.index('ready'):
+        for idx in range(live_games.MAX_PLAYERS_PER_GAME):
+            game_obj.player_ready(idx, BET)
+    if stage >= STAGES.index('dealt'):
+        game_obj.start_game_all_ready()
+    if stage >= STAGES.index('checked'):
+        game_obj.check_initial_blackjack()
+    if stage >= STAGES.index('played'):
+        _play_dealer(game_obj)
+    return game_obj
+
+
+def _game_bytes(game_obj, result):
+    return len(codec.encode_game(game_obj))
+
+
+def _json_bytes(game_obj, result):
+    return len(encode_frame(result))
+
+
+def _stored_bytes(url, result):
+    return live_games._get_redis_conn().strlen(
+        live_games.KEY_FORMAT.format(url))
+
+
+# name, stage, operation, serialized size after the operation
+ENGINE_BENCHMARKS = (
+    ('start_game', 'scored',
+     lambda g: g.start_game(), _game_bytes),
+    ('deal_initial_cards', 'ready',
+     lambda g: g.deal_initial_cards(), _game_bytes),
+    ('player_hit', 'checked',
+     lambda g: g.player_hit(0), _game_bytes),
+    ('check_initial_blackjack', 'dealt',
+     lambda g: g.check_initial_blackjack(), _game_bytes),
+    ('dealer_final_turn', 'checked',
+     lambda g: g.dealer_final_turn(), _game_bytes),
+    ('calculate_score', 'played',
+     lambda g: g.calculate_score(), _game_bytes),
+    ('get_json_obj', 'checked',
+     lambda g: g.get_json_obj(), _json_bytes),
+)
+
+REDIS_BENCHMARKS = (
+    ('_redis_start_game', 'scored',
+     lambda url: live_games._redis_start_game(url)),
+    ('_redis_player_ready', 'awaiting',
+     lambda url: live_games._redis_player_ready(url, 0, BET)),
+    ('_redis_start_round', 'ready',
+     lambda url: live_games._redis_start_round(url)),
+    ('_redis_check_initial_blackjack', 'dealt',
+     lambda url: live_games._redis_check_initial_blackjack(url)),
+    ('_redis_player_hit', 'checked',
+     lambda url: live_games._redis_player_hit(url, 0)),
+    ('_redis_dealer_final_turn', 'checked',
+     lambda url: live_games._redis_dealer_final_turn(url)),
+    ('_get_redis_game_obj_json', 'checked',
+     lambda url: live_games._get_redis_game_obj_json(url)),
+)
+
+
+class Command(BaseCommand):
+    help = ("Micro-benchmark the GameObj transitions and the _redis_* "
+            "helpers: ops/sec, bytes allocated per op and serialized size "
+            "of the game, compared against stored baselines")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20000,
+                            help="Operations timed per engine benchmark")
+        parser.add_argument('--redis-rounds', type=int, default=500,
+                            help="Operations timed per Redis benchmark")
+        parser.add_argument('--redis', choices=('local', 'fake', 'none'),
+                            default='local',
+                            help="Run the Redis helpers against the "
+                                 "LIVE_GAMES_REDIS_CONFIG server, against "
+                                 "fakeredis, or not at all")
+        parser.add_argument('--seed', type=int, default=1,
+                            help="Shoe seed of the benchmarked games")
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                            help="JSON file of the stored baselines")
+        parser.add_argument('--save', action='store_true',
+                            help="Store the results as the new baselines")
+        parser.add_argument('--threshold', type=float, default=0.15,
+                            help="Fraction ops/sec may drop, or allocations "
+                                 "and size grow, before a benchmark counts "
+                                 "as a regression")
+
+    def handle(self, *args, **options):
+        results = {'engine': self.run_engine(options)}
+        if options['redis'] != 'none':
+            self.use_redis(options['redis'])
+            results['redis-' + options['redis']] = self.run_redis(options)
+
+        baselines = self.load_baselines(options['baseline'])
+        regressions = self.report(results, baselines, options['threshold'])
+        if options['save']:
+            for suite, suite_results in results.items():
+                baselines[suite] = suite_results
+            baselines['python'] = platform.python_version()
+            with open(options['baseline'], 'w') as f:
+                json.dump(baselines, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(
+                "Baselines saved to {}".format(options['baseline'])))
+        elif regressions:
+            raise CommandError("{} benchmark(s) regressed: {}".format(
+                len(regressions), ', '.join(regressions)))
+
+    # Engine
+
+    def run_engine(self, options):
+        results = {}
+        for name, stage, operation, size in ENGINE_BENCHMARKS:
+            base = _build_game('benchmark', stage, options['seed'])
+
+            def prepare(count):
+                return [copy.deepcopy(base) for _ in range(count)]
+
+            game_obj = prepare(1)[0]
+            results[name] = {
+                'ops_per_sec': self.ops_per_sec(prepare, operation,
+                                                options['rounds']),
+                'alloc_bytes': self.alloc_bytes(prepare, operation,
+                                                options['rounds']),
+                'bytes': size(game_obj, operation(game_obj)),
+            }
+        return results
+
+    # Redis helpers
+
+    def use_redis(self, backend):
+        if backend == 'fake':
+            try:
+                import fakeredis
+            except ImportError:
+                raise CommandError("--redis fake needs fakeredis installed")
+            from redis import ConnectionPool
+            live_games._REDIS_POOL = ConnectionPool(
+                connection_class=fakeredis.FakeConnection,
+                server=fakeredis.FakeServer())
+        try:
+            live_games._get_redis_conn().ping()
+        except Exception as e:
+            raise CommandError("Redis is not reachable: {}".format(e))
+
+    def run_redis(self, options):
+        results = {}
+        r = live_games._get_redis_conn()
+        for name, stage, operation in REDIS_BENCHMARKS:
+            urls = []
+            base = _build_game('benchmark', stage, options['seed'])
+
+            def prepare(count):
+                batch = ['benchmark-{}-{}'.format(name, len(urls) + i)
+                         for i in range(count)]
+                urls.extend(batch)
+                # Queued directly so reads are not served from the cache
+                pipe = r.pipeline(transaction=False)
+                for url in batch:
+                    game_obj = copy.deepcopy(base)
+                    game_obj.url = url
+                    game_obj.shoe_dirty = True
+                    live_games._queue_write(pipe, url, game_obj)
+                pipe.execute()
+                return batch
+
+            try:
+                url = prepare(1)[0]
+                results[name] = {
+                    'ops_per_sec': self.ops_per_sec(
+                        prepare, operation, options['redis_rounds']),
+                    'alloc_bytes': self.alloc_bytes(
+                        prepare, operation, options['redis_rounds']),
+                    'bytes': _stored_bytes(url, operation(url)),
+                }
+            finally:
+                pipe = r.pipeline(transaction=False)
+                for url in urls:
+                    live_games._delete_game_obj(pipe, url)
+                    pipe.delete(live_games.VERSION_KEY_FORMAT.format(url))
+                pipe.execute()
+        return results
+
+    # Measurements
+
+    def ops_per_sec(self, prepare, operation, rounds, repeat=5):
+        best = None
+        for _ in range(repeat):
+            batch = prepare(rounds)
+            # Like timeit, keep collections of the prepared games out
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for item in batch:
+                    operation(item)
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = elapsed if best is None else min(best, elapsed)
+        return rounds / best
+
+    def alloc_bytes(self, prepare, operation, rounds):
+        # Peak traced memory above the start of each operation, averaged
+        batch = prepare(min(rounds, 1000))
+        total = 0
+        tracemalloc.start()
+        try:
+            for item in batch:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                operation(item)
+                total += tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+        return total / len(batch)
+
+    # Baselines
+
+    def load_baselines(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def report(self, results, baselines, threshold):
+        regressions = []
+        self.stdout.write("{:<32} {:>12} {:>12} {:>8} {:>9}".format(
+            'benchmark', 'ops/sec', 'alloc B/op', 'bytes', 'vs base'))
+        for suite, suite_results in results.items():
+            self.stdout.write(suite)
+            suite_baselines = baselines.get(suite, {})
+            for name, result in suite_results.items():
+                baseline = suite_baselines.get(name)
+                if baseline is None:
+                    change, regressed = '-', False
+                else:
+                    ratio = result['ops_per_sec'] / baseline['ops_per_sec']
+                    change = '{:+.1%}'.format(ratio - 1)
+                    regressed = (
+                        ratio < 1 - threshold or
+                        result['alloc_bytes'] >
+                        baseline['alloc_bytes'] * (1 + threshold) or
+                        result['bytes'] > baseline['bytes'])
+                line = "  {:<30} {:>12.0f} {:>12.0f} {:>8} {:>9}".format(
+                    name, result['ops_per_sec'], result['alloc_bytes'],
+                    result['bytes'], change)
+                if regressed:
+                    regressions.append('{}/{}'.format(suite, name))
+                    line = self.style.ERROR(line + '  REGRESSED')
+                self.stdout.write(line)
+        return regressions
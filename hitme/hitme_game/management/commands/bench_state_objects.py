@@ -0,0 +1,88 @@
+"""Compare the __slots__ Player/GameObj against plain __dict__ classes"""
+
+from django.core.management.base import BaseCommand
+from hitme_game import codec, live_games
+import copy
+import pickle
+import timeit
+import tracemalloc
+
+SLOT_HOOKS = ('__slots__', '__getstate__', '__setstate__', '__copy__',
+              '__deepcopy__')
+
+
+def _dict_class(cls):
+    # Same methods as cls but instances keep their attributes in a __dict__,
+    # which is what Player and GameObj looked like before __slots__
+    namespace = {k: v for k, v in vars(cls).items()
+                 if k not in cls.__slots__ and k not in SLOT_HOOKS}
+    namespace['__module__'] = __name__
+    namespace['__qualname__'] = 'Dict' + cls.__name__
+    return type('Dict' + cls.__name__, (object,), namespace)
+
+
+# Module level so pickle can find them
+DictGameObj = _dict_class(live_games.GameObj)
+DictPlayer = _dict_class(live_games.Player)
+
+
+def _build_game(game_cls, player_cls, num_players):
+    game_obj = game_cls('benchmark', 'creator')
+    for idx in range(num_players):
+        player = player_cls('channel-{}'.format(idx), 'user-{}'.format(idx))
+        player.index = idx
+        game_obj.players_list[idx] = player
+        game_obj.players_map[player.name] = idx
+    game_obj.start_game()
+    game_obj.start_game_all_ready()
+    game_obj.check_initial_blackjack()
+    return game_obj
+
+
+class Command(BaseCommand):
+    help = ("Micro-benchmark per object memory and serialization round-trip "
+            "time of the live game state classes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=10000,
+                            help="Games allocated for the memory figures")
+        parser.add_argument('--rounds', type=int, default=20000,
+                            help="Iterations for the timing figures")
+
+    def handle(self, *args, **options):
+        num_players = live_games.MAX_PLAYERS_PER_GAME
+        variants = [
+            ('dict', DictGameObj, DictPlayer),
+            ('slots', live_games.GameObj, live_games.Player),
+        ]
+        self.stdout.write("{:<6} {:>12} {:>14} {:>14} {:>14}".format(
+            'class', 'bytes/game', 'pickle us', 'deepcopy us', 'codec us'))
+        for label, game_cls, player_cls in variants:
+            per_game = self.measure_memory(game_cls, player_cls, num_players,
+                                           options['objects'])
+            game_obj = _build_game(game_cls, player_cls, num_players)
+            rounds = options['rounds']
+            pickle_us = self.time_us(
+                lambda: pickle.loads(pickle.dumps(game_obj)), rounds)
+            copy_us = self.time_us(lambda: copy.deepcopy(game_obj), rounds)
+            if game_cls is live_games.GameObj:
+                codec_us = '{:14.2f}'.format(self.time_us(
+                    lambda: codec.decode_game(codec.encode_game(game_obj)),
+                    rounds))
+            else:
+                codec_us = '{:>14}'.format('-')
+            self.stdout.write("{:<6} {:>12.0f} {:>14.2f} {:>14.2f} {}".format(
+                label, per_game, pickle_us, copy_us, codec_us))
+
+    def measure_memory(self, game_cls, player_cls, num_players, count):
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        games = [_build_game(game_cls, player_cls, num_players)
+                 for _ in range(count)]
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del games
+        return (after - before) / count
+
+    def time_us(self, fn, rounds):
+        return min(timeit.repeat(fn, number=rounds, repeat=3)) / rounds * 1e6
@@ -0,0 +1,47 @@
+"""Rewrite live games stored in Redis with the current codec version"""
+
+from django.core.management.base import BaseCommand
+from hitme_game import codec, live_games
+
+
+class Command(BaseCommand):
+    help = ("Re-encode every live game in Redis (legacy pickle or older "
+            "codec versions) with the current game codec")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report the keys that need migrating")
+
+    def handle(self, *args, **options):
+        r = live_games._get_redis_conn()
+        prefix, suffix = live_games.KEY_FORMAT.split('{}')
+        migrated = pending = skipped = 0
+        for key in r.scan_iter(match=live_games.KEY_FORMAT.format('*')):
+            key = key.decode('utf-8')
+            url = key[len(prefix):-len(suffix)]
+            with live_games._get_game_lock(r, url, 'migrate'):
+                data, shoe = r.mget(
+                    key, live_games.SHOE_KEY_FORMAT.format(url))
+                if data is None or not codec.needs_migration(data):
+                    skipped += 1
+                    continue
+                if options['dry_run']:
+                    pending += 1
+                    self.stdout.write("Would migrate {}".format(url))
+                    continue
+                # Decoded with its shoe, or the shoe position is lost.
+                # Written like any transition: version bumped and snapshot
+                # caches invalidated
+                live_games._write_game_obj(
+                    r, url, live_games._decode_game(data, shoe))
+            migrated += 1
+            self.stdout.write("Migrated {}".format(url))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                "{} games would be migrated, {} already current".format(
+                    pending, skipped)))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                "{} games migrated, {} already current".format(
+                    migrated, skipped)))
@@ -0,0 +1,51 @@
+"""Start or stop a profiling capture on every worker sharing the Redis"""
+
+from django.core.management.base import BaseCommand, CommandError
+from hitme_game import profiling
+import time
+
+
+class Command(BaseCommand):
+    help = ("Start, stop or show the profiling capture of the running "
+            "workers, profiles are dumped under PROFILING_CONFIG dump_dir")
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('start', 'stop', 'status'))
+        parser.add_argument('--sample-rate', type=float,
+                            default=profiling.SAMPLE_RATE,
+                            help="Fraction of messages and transitions "
+                                 "profiled")
+        parser.add_argument('--tracemalloc', action='store_true',
+                            help="Also trace allocations")
+        parser.add_argument('--duration', type=int, default=600,
+                            help="Seconds before the capture stops on its "
+                                 "own")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'start':
+            if not 0 < options['sample_rate'] <= 1:
+                raise CommandError("--sample-rate must be in (0, 1]")
+            capture_id = time.strftime('%Y%m%d-%H%M%S')
+            profiling.start_capture(capture_id, options['sample_rate'],
+                                    options['tracemalloc'],
+                                    options['duration'])
+            self.stdout.write(self.style.SUCCESS(
+                "Capture {} started for {} seconds, profiles in {}".format(
+                    capture_id, options['duration'],
+                    profiling.DUMP_DIR)))
+        elif action == 'stop':
+            if profiling.stop_capture():
+                self.stdout.write(self.style.SUCCESS(
+                    "Capture stopped, workers dump their profiles within "
+                    "{} seconds".format(profiling.POLL_INTERVAL)))
+            else:
+                self.stdout.write("No capture running")
+        else:
+            capture = profiling.get_capture()
+            if capture:
+                self.stdout.write("Capture {id}: sample rate {sample_rate}, "
+                                  "tracemalloc {tracemalloc}".format(
+                                      **capture))
+            else:
+                self.stdout.write("No capture running")
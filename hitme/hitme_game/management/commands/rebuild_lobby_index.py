@@ -0,0 +1,17 @@
+"""Rebuild the Redis lobby index from the game sessions in the database"""
+
+from django.core.management.base import BaseCommand
+from hitme_game import lobby_index
+from hitme_game.models import GameSession
+
+
+class Command(BaseCommand):
+    help = ("Replace the lobby index in Redis with the open games stored "
+            "in the database")
+
+    def handle(self, *args, **options):
+        games = list(GameSession.objects.get_active_games()
+                     .select_related('creator').order_by('id'))
+        lobby_index.rebuild(games)
+        self.stdout.write(self.style.SUCCESS(
+            "{} open games indexed".format(len(games))))
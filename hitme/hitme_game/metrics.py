@@ -0,0 +1,197 @@
+"""
+In-process metrics served in the Prometheus text format.
+
+Counters and histograms are kept per worker process and exposed by the
+metrics view, each worker is scraped on its own. Recording is a dict
+lookup and a few additions under a lock, cheap enough to leave on.
+"""
+
+from bisect import bisect_left
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+_REGISTRY = []
+
+
+def _format_labels(labelnames, labels, extra=''):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                              .replace('"', '\\"'))
+             for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(object):
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram(object):
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket and +Inf, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            entry[0][idx] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labelnames, labels,
+                                      'le="{}"'.format(bound)),
+                       cumulative)
+            yield (self.name + '_sum',
+                   _format_labels(self.labelnames, labels), total)
+            yield (self.name + '_count',
+                   _format_labels(self.labelnames, labels), cumulative)
+
+
+class _Timer(object):
+    """Observes the seconds spent in a with or async with block"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+class TimedLock(object):
+    """Wraps a game lock, observing the wait for it and the time held"""
+
+    def __init__(self, lock, op):
+        self.lock = lock
+        self.op = op
+
+    def _acquired(self, start):
+        self.acquired = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(self.acquired - start, self.op)
+
+    def _released(self):
+        LOCK_HOLD_SECONDS.observe(time.perf_counter() - self.acquired,
+                                  self.op)
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.__enter__()
+        self._acquired(start)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            return self.lock.__exit__(*exc)
+        finally:
+            self._released()
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        await self.lock.__aenter__()
+        self._acquired(start)
+        return self
+
+    async def __aexit__(self, *exc):
+        try:
+            return await self.lock.__aexit__(*exc)
+        finally:
+            self._released()
+
+
+def render():
+    lines = []
+    for metric in _REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append('{}{} {}'.format(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+MESSAGE_SECONDS = Histogram(
+    'hitme_message_seconds',
+    "Time to handle an inbound game room message", ['type'])
+LOCK_WAIT_SECONDS = Histogram(
+    'hitme_game_lock_wait_seconds',
+    "Time waiting for the game lock", ['op'])
+LOCK_HOLD_SECONDS = Histogram(
+    'hitme_game_lock_hold_seconds',
+    "Time the game lock was held", ['op'])
+REDIS_SECONDS = Histogram(
+    'hitme_redis_seconds',
+    "Redis round trips of the game helpers", ['op'])
+CODEC_SECONDS = Histogram(
+    'hitme_game_codec_seconds',
+    "Time to encode or decode a stored game", ['op'],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+             0.0025, 0.01))
+GAME_BYTES = Histogram(
+    'hitme_game_encoded_bytes',
+    "Size of encoded games", buckets=(64, 128, 256, 512, 1024, 2048, 4096))
+EVENT_QUEUE_SECONDS = Histogram(
+    'hitme_event_queue_seconds',
+    "Time a game room broadcast waited in the event scheduler, pauses "
+    "included")
+GROUP_SENDS = Counter(
+    'hitme_group_send_total',
+    "Channel layer group sends", ['group'])
+LOGS_DROPPED = Counter(
+    'hitme_log_dropped_total',
+    "Log records dropped because the log queue was full")
@@ -1,55 +1,139 @@
-"""HitMe Game Models"""
-
-from django.conf import settings
-from django.db import models
-from django.utils.encoding import python_2_unicode_compatible
-import secrets
-import string
-
-AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
-SESSION_URL_LENGTH = getattr(settings, 'SESSION_URL_LENGTH', 10)
-MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
-
-
-class GameSessionManager(models.Manager):
-
-    def create_game_session(self, user):
-        return self.create(url=self.generate_unique_url(), creator=user)
-
-    def generate_unique_url(self):
-        url = ''.join(secrets.choice(string.ascii_letters + string.digits)
-                      for i in range(SESSION_URL_LENGTH))
-        try:
-            obj = self.get(url=url)
-            return self.generate_unique_url()
-        except GameSession.DoesNotExist:
-            return url
-
-    def get_active_games(self):
-        return self.filter(num_players__gt=0,
-                           num_players__lt=MAX_PLAYERS_PER_GAME)
-
-    def get_game(self, url):
-        try:
-            return self.get(url=url)
-        except GameSession.DoesNotExist:
-            return None
-
-    def update_num_players(self, url, num_players):
-        self.filter(url=url).update(num_players=num_players)
-
-    def delete_game_session(self, url):
-        self.filter(url=url).delete()
-
-
-@python_2_unicode_compatible
-class GameSession(models.Model):
-    """
-    Model to store Game Session
-    """
-    url = models.CharField(max_length=25, unique=True)
-    creator = models.ForeignKey(
-        AUTH_USER_MODEL, related_name='creator', on_delete=models.CASCADE)
-    num_players = models.IntegerField(default=0)
-
-    objects = GameSessionManager()
+"""HitMe Game Models"""
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Value, When
+from django.utils.encoding import python_2_unicode_compatible
+import math
+import string
+import threading
+import time
+
+AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
+SESSION_URL_LENGTH = getattr(settings, 'SESSION_URL_LENGTH', 12)
+MAX_PLAYERS_PER_GAME = getattr(settings, 'MAX_PLAYERS_PER_GAME', 3)
+# Tells the worker processes apart in game urls, 0-255. Allocated through
+# Redis if unset
+SESSION_URL_NODE_ID = getattr(settings, 'SESSION_URL_NODE_ID', None)
+
+URL_NODE_ID_KEY = "URLS:NODE_ID"
+
+
+def _allocate_node_id():
+    # Processes sharing the Redis count up, ids only repeat after 256 starts
+    from . import live_games
+    return live_games._get_redis_conn().incr(URL_NODE_ID_KEY) - 1
+
+
+class GameUrlGenerator(object):
+    """
+    Game urls unique by construction: milliseconds since URL_EPOCH_MS, the
+    node id of the process and a per millisecond sequence, written in
+    base 36 on length characters. With 12 characters the clock only wraps
+    around after about 557 years. Lower case only, the url column compares
+    case insensitively on MySQL.
+    """
+
+    ALPHABET = string.digits + string.ascii_lowercase
+    URL_EPOCH_MS = 1577836800000
+    NODE_BITS = 8
+    SEQ_BITS = 10
+
+    def __init__(self, length, node_id=None):
+        self.length = length
+        # None takes one from _allocate_node_id on the first url
+        self.node_id = node_id
+        id_bits = int(length * math.log2(len(self.ALPHABET)))
+        self.time_mask = (1 << (id_bits - self.NODE_BITS - self.SEQ_BITS)) - 1
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.seq = 0
+
+    def _next_id(self):
+        with self.lock:
+            if self.node_id is None:
+                self.node_id = _allocate_node_id()
+            node_id = self.node_id & ((1 << self.NODE_BITS) - 1)
+            # Never step back if the clock does
+            now = max(int(time.time() * 1000), self.last_ms)
+            if now == self.last_ms:
+                self.seq = (self.seq + 1) & ((1 << self.SEQ_BITS) - 1)
+                if self.seq == 0:
+                    # Sequence used up, move on to the next millisecond
+                    now += 1
+            else:
+                self.seq = 0
+            self.last_ms = now
+            stamp = (now - self.URL_EPOCH_MS) & self.time_mask
+            return ((stamp << (self.NODE_BITS + self.SEQ_BITS)) |
+                    (node_id << self.SEQ_BITS) | self.seq)
+
+    def next_url(self):
+        value = self._next_id()
+        base = len(self.ALPHABET)
+        chars = []
+        for _ in range(self.length):
+            value, digit = divmod(value, base)
+            chars.append(self.ALPHABET[digit])
+        return ''.join(reversed(chars))
+
+
+_URLS = GameUrlGenerator(SESSION_URL_LENGTH, SESSION_URL_NODE_ID)
+
+
+class GameSessionManager(models.Manager):
+
+    def create_game_session(self, user):
+        # The unique constraint is the only check, urls only collide when
+        # two processes share a node id
+        try:
+            with transaction.atomic():
+                return self.create(url=self.generate_unique_url(),
+                                   creator=user)
+        except IntegrityError:
+            return self.create(url=self.generate_unique_url(), creator=user)
+
+    def generate_unique_url(self):
+        return _URLS.next_url()
+
+    def get_active_games(self):
+        return self.filter(num_players__gt=0,
+                           num_players__lt=MAX_PLAYERS_PER_GAME)
+
+    def get_game(self, url):
+        try:
+            return self.get(url=url)
+        except GameSession.DoesNotExist:
+            return None
+
+    def update_num_players(self, url, num_players):
+        self.filter(url=url).update(num_players=num_players)
+
+    def delete_game_session(self, url):
+        self.filter(url=url).delete()
+
+    def bulk_update_num_players(self, num_players):
+        """Set num_players of many games, url -> num_players, in one UPDATE"""
+        if not num_players:
+            return
+        self.filter(url__in=list(num_players)).update(num_players=Case(
+            *[When(url=url, then=Value(count))
+              for url, count in num_players.items()],
+            output_field=models.IntegerField()))
+
+    def delete_game_sessions(self, urls):
+        if urls:
+            self.filter(url__in=urls).delete()
+
+
+@python_2_unicode_compatible
+class GameSession(models.Model):
+    """
+    Model to store Game Session
+    """
+    url = models.CharField(max_length=25, unique=True)
+    creator = models.ForeignKey(
+        AUTH_USER_MODEL, related_name='creator', on_delete=models.CASCADE)
+    num_players = models.IntegerField(default=0)
+
+    objects = GameSessionManager()
@@ -0,0 +1,265 @@
+"""
+Opt-in profiling of game room messages and game transitions.
+
+While a capture runs, a sample_rate fraction of the inbound game room
+messages and of the game transitions run in this process are profiled
+with cProfile, and allocations are optionally traced with tracemalloc.
+Profiles are summed per message type and per transition and dumped every
+dump_interval seconds and when the capture stops, to
+dump_dir/<capture>/<host>-<pid>/ as pstats files next to a summary.json.
+
+A capture runs in every worker sharing the Redis while the control hash
+set by the profile_workers command exists, or in this process when
+PROFILING_CONFIG enabled is set. Workers poll the hash from a background
+thread, the hot path only reads an attribute when no capture runs.
+
+A sampled message is profiled until it is handled, what other tasks run
+on the event loop meanwhile is included. One sample runs at a time per
+thread, a transition run by a sampled message is part of its profile.
+"""
+
+from django.conf import settings
+from . import live_games
+import cProfile
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import socket
+import threading
+import time
+import tracemalloc
+
+log = logging.getLogger('hitme_game.background')
+
+PROFILING_CONFIG = getattr(settings, 'PROFILING_CONFIG', {})
+ENABLED = PROFILING_CONFIG.get('enabled', False)
+SAMPLE_RATE = PROFILING_CONFIG.get('sample_rate', 0.01)
+TRACEMALLOC = PROFILING_CONFIG.get('tracemalloc', False)
+DUMP_DIR = PROFILING_CONFIG.get('dump_dir', 'profiles')
+DUMP_INTERVAL = PROFILING_CONFIG.get('dump_interval', 60)
+POLL_INTERVAL = PROFILING_CONFIG.get('poll_interval', 1)
+
+# Hash of id, sample_rate and tracemalloc, expires with the capture
+PROFILING_CONTROL_KEY = "PROFILING:CONTROL"
+
+TRACEMALLOC_FRAMES = 10
+TRACEMALLOC_TOP = 50
+
+
+class Capture(object):
+
+    def __init__(self, capture_id, sample_rate, trace_allocations):
+        self.config = (capture_id, sample_rate, trace_allocations)
+        self.sample_rate = sample_rate
+        self.trace_allocations = trace_allocations
+        self.path = os.path.join(DUMP_DIR, capture_id, '{}-{}'.format(
+            socket.gethostname(), os.getpid()))
+        # label -> [pstats.Stats, samples, bytes allocated]
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.started_tracing = False
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.started_tracing = True
+
+    def add(self, label, profile, allocated):
+        profile.create_stats()
+        with self.lock:
+            if self.stopped:
+                return
+            entry = self.profiles.get(label)
+            if entry is None:
+                self.profiles[label] = [pstats.Stats(profile), 1, allocated]
+            else:
+                entry[0].add(profile)
+                entry[1] += 1
+                entry[2] += allocated
+
+    def dump(self):
+        # Copied under the lock and written outside it, sampled messages
+        # adding their profile never wait for the disk
+        with self.lock:
+            profiles = [(label, marshal.dumps(stats.stats), {
+                'samples': samples,
+                'seconds': stats.total_tt,
+                'allocated_bytes': (allocated if self.trace_allocations
+                                    else None),
+            }) for label, (stats, samples, allocated)
+                in self.profiles.items()]
+        if not profiles:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        summary = {}
+        for label, data, entry in profiles:
+            # What pstats.Stats.dump_stats writes
+            with open(os.path.join(self.path, label + '.prof'), 'wb') as f:
+                f.write(data)
+            summary[label] = entry
+        with open(os.path.join(self.path, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    def stop(self):
+        self.dump()
+        with self.lock:
+            self.stopped = True
+        if self.trace_allocations and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, 'tracemalloc.txt'), 'w') as f:
+                for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                    f.write('{}\n'.format(stat))
+        if self.started_tracing:
+            tracemalloc.stop()
+
+
+class _Sample(object):
+    """Profiles a with or async with block into the capture"""
+
+    def __init__(self, capture, label):
+        self.capture = capture
+        self.label = label
+
+    def __enter__(self):
+        _LOCAL.active = True
+        self.allocated = (tracemalloc.get_traced_memory()[0]
+                          if self.capture.trace_allocations else 0)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        _LOCAL.active = False
+        if self.capture.trace_allocations:
+            self.allocated = (tracemalloc.get_traced_memory()[0] -
+                              self.allocated)
+        self.capture.add(self.label, self.profile, self.allocated)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+class _NotSampled(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+_NOT_SAMPLED = _NotSampled()
+_LOCAL = threading.local()
+
+
+class Profiler(object):
+
+    def __init__(self, enabled, poll_interval, dump_interval):
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.dump_interval = dump_interval
+        self.capture = None
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            threading.Thread(target=self._run, name='profiler',
+                             daemon=True).start()
+            self.started = True
+
+    def sample(self, label):
+        if not self.started:
+            self.start()
+        capture = self.capture
+        if (capture is None or getattr(_LOCAL, 'active', False) or
+                random.random() >= capture.sample_rate):
+            return _NOT_SAMPLED
+        return _Sample(capture, label)
+
+    def _run(self):
+        r = live_games._get_redis_conn()
+        dumped = time.monotonic()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll(r)
+                if (self.capture is not None and
+                        time.monotonic() - dumped >= self.dump_interval):
+                    dumped = time.monotonic()
+                    self.capture.dump()
+            except Exception:
+                log.exception("profiling control poll failed")
+
+    def poll(self, r):
+        control = r.hgetall(PROFILING_CONTROL_KEY)
+        if control:
+            config = (control[b'id'].decode('utf-8'),
+                      float(control[b'sample_rate']),
+                      control[b'tracemalloc'] == b'1')
+        elif self.enabled:
+            config = ('settings', SAMPLE_RATE, TRACEMALLOC)
+        else:
+            config = None
+        current = self.capture
+        if current is not None and current.config != config:
+            self.capture = None
+            current.stop()
+            log.info("profiling capture stopped", extra={'data': {
+                'path': current.path}})
+        if config is not None and self.capture is None:
+            self.capture = Capture(*config)
+            log.info("profiling capture started", extra={'data': {
+                'path': self.capture.path,
+                'sample_rate': config[1],
+                'tracemalloc': config[2]}})
+
+
+_PROFILER = Profiler(ENABLED, POLL_INTERVAL, DUMP_INTERVAL)
+
+
+def sample(label):
+    """
+    Context manager profiling the block if the running capture samples it,
+    usable with with and async with
+    """
+    return _PROFILER.sample(label)
+
+
+# Control of the captures of all workers, used by profile_workers
+
+def start_capture(capture_id, sample_rate, trace_allocations, duration):
+    pipe = live_games._get_redis_conn().pipeline()
+    pipe.delete(PROFILING_CONTROL_KEY)
+    pipe.hset(PROFILING_CONTROL_KEY, mapping={
+        'id': capture_id,
+        'sample_rate': sample_rate,
+        'tracemalloc': int(trace_allocations),
+    })
+    pipe.expire(PROFILING_CONTROL_KEY, duration)
+    pipe.execute()
+
+
+def stop_capture():
+    return live_games._get_redis_conn().delete(PROFILING_CONTROL_KEY) > 0
+
+
+def get_capture():
+    control = live_games._get_redis_conn().hgetall(PROFILING_CONTROL_KEY)
+    return {key.decode('utf-8'): value.decode('utf-8')
+            for key, value in control.items()}
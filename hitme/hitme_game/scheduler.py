@@ -0,0 +1,56 @@
+"""
+Paced outbound events for game rooms.
+
+Game transitions are applied as soon as a message arrives, but clients
+animate each event, so broadcasts of one game are spaced out. Events and
+pauses are queued per game and delivered in order by a task on the event
+loop, the consumer that queued them returns right away.
+"""
+
+from collections import deque
+from . import metrics
+import asyncio
+import logging
+import time
+
+log = logging.getLogger('hitme_game.background')
+
+
+class GameEventScheduler(object):
+
+    def __init__(self):
+        # url -> deque of (seconds, None, _) pauses and
+        # (send, args, queued at) events
+        self.queues = {}
+
+    def send(self, url, send, *args):
+        """Queue the coroutine function send(*args) behind earlier events"""
+        self._queue(url, (send, args, time.perf_counter()))
+
+    def pause(self, url, seconds):
+        """Space the next event of the game at least seconds after the last"""
+        self._queue(url, (seconds, None, None))
+
+    def _queue(self, url, item):
+        queue = self.queues.get(url)
+        if queue is None:
+            queue = self.queues[url] = deque()
+            asyncio.ensure_future(self._drain(url, queue))
+        queue.append(item)
+
+    async def _drain(self, url, queue):
+        try:
+            while queue:
+                send, args, queued = queue.popleft()
+                if args is None:
+                    await asyncio.sleep(send)
+                    continue
+                metrics.EVENT_QUEUE_SECONDS.observe(
+                    time.perf_counter() - queued)
+                try:
+                    await send(*args)
+                except Exception:
+                    log.exception("game event failed",
+                                  extra={'data': {'game': url}})
+        finally:
+            self.queues.pop(url, None)
@@ -0,0 +1,133 @@
+"""
+Write-behind of GameSession.num_players.
+
+Joins and leaves record the new number of players of a game in the DIRTY
+hash in Redis instead of writing to MySQL, 0 standing for a game to
+delete. A background thread per process flushes the hash every
+flush_interval seconds, or as soon as the process recorded flush_changes
+changes, with one UPDATE for all games and one DELETE for the emptied
+ones. An entry is only removed from the hash once written and if it was
+not changed meanwhile, so whatever a crashed worker left behind is flushed
+by the next one. Flushes are serialized across processes by a lock,
+otherwise an older count read by one worker could be committed after a
+newer one and stay in the database.
+"""
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from .models import GameSession
+from . import handshake, live_games
+import logging
+import threading
+
+log = logging.getLogger('hitme_game.background')
+
+WRITER_CONFIG = getattr(settings, 'LIVE_GAMES_SESSION_WRITER_CONFIG', {})
+FLUSH_INTERVAL = WRITER_CONFIG.get('flush_interval', 0.5)
+FLUSH_CHANGES = WRITER_CONFIG.get('flush_changes', 200)
+FLUSH_LOCK_TIMEOUT = WRITER_CONFIG.get('flush_lock_timeout', 30)
+
+SESSIONS_DIRTY_KEY = "SESSIONS:DIRTY"
+SESSIONS_FLUSH_LOCK_KEY = "SESSIONS:FLUSH_LOCK"
+
+# ARGV holds url, num_players pairs that were written to the database
+LUA_CLEAR_FLUSHED = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return 0
+"""
+
+
+class SessionWriter(object):
+
+    def __init__(self, flush_interval, flush_changes):
+        self.flush_interval = flush_interval
+        self.flush_changes = flush_changes
+        self.changes = 0
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            threading.Thread(target=self._run, name='session-writer',
+                             daemon=True).start()
+            self.started = True
+
+    def changed(self):
+        """Count a change recorded in Redis, flush early if enough piled up"""
+        self.start()
+        self.changes += 1
+        if self.changes >= self.flush_changes:
+            self.wake.set()
+
+    def _run(self):
+        r = live_games._get_redis_conn()
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.changes = 0
+            lock = r.lock(SESSIONS_FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT,
+                          blocking_timeout=0)
+            try:
+                # Another process is flushing, what it misses stays dirty
+                if not lock.acquire():
+                    continue
+                try:
+                    self.flush(r)
+                finally:
+                    lock.release()
+            except Exception:
+                # Entries stay in Redis, retried on the next tick
+                log.exception("session write-behind failed")
+
+    def flush(self, r):
+        entries = {url.decode('utf-8'): int(num_players) for url, num_players
+                   in r.hgetall(SESSIONS_DIRTY_KEY).items()}
+        if not entries:
+            return 0
+        close_old_connections()
+        counts = {url: num_players for url, num_players in entries.items()
+                  if num_players > 0}
+        with transaction.atomic():
+            GameSession.objects.bulk_update_num_players(counts)
+            GameSession.objects.delete_game_sessions(
+                [url for url in entries if url not in counts])
+        flushed = []
+        for url, num_players in entries.items():
+            flushed += [url, num_players]
+        pipe = r.pipeline()
+        handshake.queue_delete_game_creators(
+            pipe, [url for url in entries if url not in counts])
+        pipe.eval(LUA_CLEAR_FLUSHED, 1, SESSIONS_DIRTY_KEY, *flushed)
+        pipe.execute()
+        return len(entries)
+
+
+_WRITER = SessionWriter(FLUSH_INTERVAL, FLUSH_CHANGES)
+
+
+def update_num_players(url, num_players):
+    live_games._get_redis_conn().hset(SESSIONS_DIRTY_KEY, url, num_players)
+    _WRITER.changed()
+
+
+def delete_game_session(url):
+    update_num_players(url, 0)
+
+
+# asyncio counterparts of the helpers above, used by the async consumers
+
+async def aupdate_num_players(url, num_players):
+    r = live_games._get_async_redis_conn()
+    await r.hset(SESSIONS_DIRTY_KEY, url, num_players)
+    _WRITER.changed()
+
+
+async def adelete_game_session(url):
+    await aupdate_num_players(url, 0)
@@ -0,0 +1,109 @@
+"""
+Per process read cache of live game JSON snapshots.
+
+Every write to a game bumps its version counter in Redis and publishes
+"<url>:<version>" on the invalidation channel. Each process listens on that
+channel and drops cached snapshots older than the published version, so
+reads can be served locally without taking the game lock. While the
+subscription is down nothing is served from the cache.
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+log = logging.getLogger('hitme_game.background')
+
+
+INVALIDATE_CHANNEL = "LIVE_GAMES:INVALIDATE"
+
+
+class SnapshotCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # url -> (version, snapshot), snapshot None marks a newer version
+        # seen on the channel but not cached yet
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.alive = False
+        self.started = False
+        # Bumped on every (re)subscription, reads fetched under an older
+        # subscription may have missed invalidations
+        self.generation = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def start(self, get_conn):
+        with self.lock:
+            if self.started or not self.enabled:
+                return
+            threading.Thread(target=self._listen, args=(get_conn,),
+                             name='snapshot-cache', daemon=True).start()
+            self.started = True
+
+    def get(self, url):
+        if not self.alive:
+            return None
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or entry[1] is None:
+                return None
+            self.entries.move_to_end(url)
+            return entry[1]
+
+    def token(self):
+        """Take before reading from Redis and hand back to put()"""
+        return self.generation if self.alive else None
+
+    def put(self, url, version, snapshot, token):
+        if token is None or token != self.token():
+            return
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry[0] > version:
+                # A newer write was announced while this one was read
+                return
+            self._set(url, version, snapshot)
+
+    def invalidate(self, url, version):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or entry[0] < version:
+                self._set(url, version, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _set(self, url, version, snapshot):
+        self.entries[url] = (version, snapshot)
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _listen(self, get_conn):
+        while True:
+            try:
+                pubsub = get_conn().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                self.clear()
+                self.generation += 1
+                self.alive = True
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    url, version = message['data'].decode(
+                        'utf-8').rsplit(':', 1)
+                    self.invalidate(url, int(version))
+            except Exception:
+                log.exception("snapshot cache subscription lost")
+            finally:
+                # Missed invalidations cannot be recovered, start over
+                self.alive = False
+                self.clear()
+            time.sleep(1)
@@ -1,86 +1,166 @@
-$(function() {
-    var lobbySocket = new WebSocket('ws://' + window.location.host + '/ws/lobby/');
-
-    lobbySocket.onmessage = function(e) {
-        var data = JSON.parse(e.data);
-        var type = data['type'];
-
-        if (type == "UPDATE_GAME")
-            update_game(data['url'], data['num_players'], data['creator']);
-
-        else if (type == "REMOVE_GAME")
-            remove_game(data['url']);
-
-        else if (type == "CHAT_MESSAGE")
-            add_chat_message(data['player'], data['chat_message']);
-
-    };
-
-    lobbySocket.onclose = function(e) {
-        console.error('Lobby socket closed unexpectedly');
-    };
-
-    document.querySelector('#chat-message-input').onkeyup = function(e) {
-        if (e.keyCode === 13) { // enter, return
-            document.querySelector('#chat-message-submit').click();
-        }
-    };
-
-    document.querySelector('#chat-message-submit').onclick = function(e) {
-        var messageInputDom = document.querySelector('#chat-message-input');
-        var message = messageInputDom.value;
-
-        if (message != '' && message != '\n') {
-            lobbySocket.send(JSON.stringify({
-                'type': 'CHAT',
-                'chat_message': message
-            }));
-        }
-
-        messageInputDom.value = '';
-    };
-
-});
-
-function update_game(url, num_players, creator) {
-    if ($('div.row#' + url).length > 0)
-        $('div.row#' + url).find($('span#player_count')).html(num_players.toString());
-    else
-        $('div#active-games-list').append(create_game_div(url, num_players, creator));
-}
-
-function remove_game(url) {
-    if ($('div.row#' + url).length > 0)
-        $('div.row#' + url).remove();
-}
-
-function add_chat_message(player, message) {
-    document.querySelector('#chat-log').value += (player + ': ' + message + '\n');
-    document.getElementById("chat-log").scrollTop = document.getElementById("chat-log").scrollHeight
-}
-
-function create_game_div(url, num_players, creator) {
-    var $row_div = $("<div></div>", {
-        id: url,
-        "class": "row"
-    });
-    var $col_div = $("<div></div>", {
-        "class": "col"
-    });
-    $col_div.append($("<p></p>").html(creator + "'s game, <span id='player_count'>" + num_players + "</span> players"));
-
-    $form_tag = $("<form></form>", {
-        "action": "/hitme/game/" + url,
-        "target": "_blank"
-    });
-    $form_tag.append($("<button></button>", {
-        "type": "submit",
-        "class": "btn btn-danger"
-    }).html("Join Game"));
-    $col_div.append($form_tag);
-
-    $col_div.append($("<hr>"));
-
-    $row_div.append($col_div);
-    return $row_div;
+$(function() {
+    var lobbySocket = new WebSocket('ws://' + window.location.host + '/ws/lobby/');
+
+    lobbySocket.onmessage = function(e) {
+        var data = JSON.parse(e.data);
+        var type = data['type'];
+
+        if (type == "LOBBY_DIFF")
+            apply_lobby_diff(lobbySocket, data['games']);
+
+        else if (type == "GAMES") {
+            set_games(data['games']);
+            set_page(data['page'], data['pages']);
+        }
+
+        else if (type == "CHAT_MESSAGE")
+            add_chat_message(data['player'], data['chat_message']);
+
+    };
+
+    // Also subscribes the socket to the changes of the page
+    lobbySocket.onopen = function(e) {
+        request_games(lobbySocket);
+    };
+
+    document.querySelector('#lobby-prev').onclick = function(e) {
+        lobby_view['page'] -= 1;
+        request_games(lobbySocket);
+    };
+
+    document.querySelector('#lobby-next').onclick = function(e) {
+        lobby_view['page'] += 1;
+        request_games(lobbySocket);
+    };
+
+    document.querySelector('#lobby-filter-free').onchange = function(e) {
+        lobby_view['free'] = parseInt(this.value) || null;
+        lobby_view['page'] = 0;
+        request_games(lobbySocket);
+    };
+
+    document.querySelector('#lobby-filter-creator').onchange = function(e) {
+        lobby_view['creator'] = this.value || null;
+        lobby_view['page'] = 0;
+        request_games(lobbySocket);
+    };
+
+    lobbySocket.onclose = function(e) {
+        console.error('Lobby socket closed unexpectedly');
+    };
+
+    document.querySelector('#chat-message-input').onkeyup = function(e) {
+        if (e.keyCode === 13) { // enter, return
+            document.querySelector('#chat-message-submit').click();
+        }
+    };
+
+    document.querySelector('#chat-message-submit').onclick = function(e) {
+        var messageInputDom = document.querySelector('#chat-message-input');
+        var message = messageInputDom.value;
+
+        if (message != '' && message != '\n') {
+            lobbySocket.send(JSON.stringify({
+                'type': 'CHAT',
+                'chat_message': message
+            }));
+        }
+
+        messageInputDom.value = '';
+    };
+
+});
+
+function update_game(url, num_players, creator) {
+    if ($('div.row#' + url).length > 0)
+        $('div.row#' + url).find($('span#player_count')).html(num_players.toString());
+    else
+        $('div#active-games-list').append(create_game_div(url, num_players, creator));
+}
+
+function set_games(games) {
+    var urls = new Set(games.map(game => game['url']));
+    $('div#active-games-list').children('div.row').each(function() {
+        if (!urls.has(this.id))
+            $(this).remove();
+    });
+    for (let game of games)
+        update_game(game['url'], game['num_players'], game['creator']);
+}
+
+// Page and filter of the listing shown
+var lobby_view = {
+    'page': 0,
+    'free': null,
+    'creator': null
+};
+
+function request_games(socket) {
+    socket.send(JSON.stringify({
+        'type': 'LIST_GAMES',
+        'page': lobby_view['page'],
+        'free': lobby_view['free'],
+        'creator': lobby_view['creator']
+    }));
+}
+
+function set_page(page, pages) {
+    lobby_view['page'] = page;
+    $('#lobby-page').html((page + 1) + ' / ' + pages);
+    $('#lobby-prev').prop('disabled', page == 0);
+    $('#lobby-next').prop('disabled', page + 1 >= pages);
+}
+
+// url -> current entry, null for games no longer listed. Seat counts are
+// updated in place, games joining or leaving the page or an earlier page
+// shift its rows so the page is listed again. With the free seats filter any change moves
+// the game to another listing.
+function apply_lobby_diff(socket, games) {
+    var relist = false;
+    for (let url in games) {
+        var game = games[url];
+        if (game === null || lobby_view['free'] !== null ||
+                $('div.row#' + url).length == 0)
+            relist = true;
+        else
+            update_game(url, game['num_players'], game['creator']);
+    }
+    if (relist)
+        request_games(socket);
+}
+
+function remove_game(url) {
+    if ($('div.row#' + url).length > 0)
+        $('div.row#' + url).remove();
+}
+
+function add_chat_message(player, message) {
+    document.querySelector('#chat-log').value += (player + ': ' + message + '\n');
+    document.getElementById("chat-log").scrollTop = document.getElementById("chat-log").scrollHeight
+}
+
+function create_game_div(url, num_players, creator) {
+    var $row_div = $("<div></div>", {
+        id: url,
+        "class": "row"
+    });
+    var $col_div = $("<div></div>", {
+        "class": "col"
+    });
+    $col_div.append($("<p></p>").html(creator + "'s game, <span id='player_count'>" + num_players + "</span> players"));
+
+    $form_tag = $("<form></form>", {
+        "action": "/hitme/game/" + url,
+        "target": "_blank"
+    });
+    $form_tag.append($("<button></button>", {
+        "type": "submit",
+        "class": "btn btn-danger"
+    }).html("Join Game"));
+    $col_div.append($form_tag);
+
+    $col_div.append($("<hr>"));
+
+    $row_div.append($col_div);
+    return $row_div;
 }
\ No newline at end of file
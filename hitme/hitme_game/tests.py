@@ -0,0 +1,87 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from redis.exceptions import ConnectionError
+from unittest import mock
+from . import game_actor, live_games, lua_games
+from .consumers import LobbyConsumer
+
+
+class RedisTestCase(SimpleTestCase):
+    """Runs against the LIVE_GAMES_REDIS_CONFIG server, skipped without"""
+
+    def setUp(self):
+        try:
+            live_games._get_redis_conn().ping()
+        except ConnectionError:
+            self.skipTest("Redis is not reachable")
+
+
+class GameActorLayerTests(RedisTestCase):
+
+    url = 'test-actor-layer'
+
+    def tearDown(self):
+        live_games._get_redis_conn().delete(
+            game_actor.OWNER_KEY_FORMAT.format(self.url))
+        with game_actor._ACTOR.state_lock:
+            game_actor._ACTOR.owned.discard(self.url)
+
+    def test_forward_while_consumer_receives(self):
+        async_to_sync(self.forward_while_consumer_receives)()
+
+    async def forward_while_consumer_receives(self):
+        # The consumer receives on the default layer on this loop, while
+        # the actor serves the forwarded command on its own loop
+        communicator = WebsocketCommunicator(LobbyConsumer, '/ws/lobby/')
+        communicator.scope['user'] = User(username='player')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        try:
+            actor = game_actor._ACTOR
+            await actor.astart()
+            self.assertIsNot(actor.channel_layer, get_channel_layer())
+
+            snapshot = await actor.forward(
+                actor.channel_name, self.url, 'snapshot', [])
+            self.assertIsNone(snapshot)
+
+            await LobbyConsumer.chat_broadcast({
+                'chat_message': 'hello', 'player': 'player'})
+            self.assertEqual(await communicator.receive_json_from(), {
+                'type': 'CHAT_MESSAGE',
+                'chat_message': 'hello',
+                'player': 'player',
+            })
+        finally:
+            await communicator.disconnect()
+
+
+class LuaShoeTests(RedisTestCase):
+
+    urls = ('test-lua-shoe-1', 'test-lua-shoe-2')
+
+    def tearDown(self):
+        live_games._get_redis_conn().delete(
+            *[lua_games.LUA_KEY_FORMAT.format(url) for url in self.urls])
+
+    def deal_shoes(self, url, count):
+        r = live_games._get_redis_conn()
+        key = lua_games.LUA_KEY_FORMAT.format(url)
+        lua_games._run_script(lua_games.LUA_ADD_PLAYER, url, 'channel',
+                              'player', url, 'creator')
+        shoes = []
+        for _ in range(count):
+            # Past the cut card, start_game reshuffles
+            r.hset(key, 'shoe_pos', r.hget(key, 'shoe_cut') or 0)
+            lua_games._redis_start_game(url)
+            shoes.append(r.hget(key, 'shoe'))
+        return shoes
+
+    def test_same_seed_deals_same_shoes(self):
+        with mock.patch.object(live_games, 'SHOE_SEED', 1 << 40 | 7):
+            first, second = [self.deal_shoes(url, 2) for url in self.urls]
+        self.assertEqual(first, second)
+        self.assertNotEqual(first[0], first[1])